@@ -0,0 +1,453 @@
+# coding: utf-8
+
+import argparse
+import collections
+import csv
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import re
+import signal
+import time
+import traceback
+
+import crschem.crossroad_schematization as cs
+from crschem.model.turning_sidewalk import TurningSidewalk
+from crschem.region import OSMRegion
+from crschem.osm_extract import OSMExtract
+from crschem.graph_store import ProjectedGraphStore
+from crschem.instrumentation import ProcessInstrumentation
+from crschem.debug import GeometryDebugSink
+
+
+class BatchJob:
+
+    # a crossroad to schematize, given by its coordinates. Parameters
+    # overload the default parameters of CrossroadSchematization.build
+    def __init__(self, name, latitude, longitude, parameters = None):
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.parameters = parameters if parameters is not None else {}
+
+
+    def get_basename(self):
+        name = re.sub(r'[^\w\-]+', '-', self.name.strip()).strip("-").lower()
+        if name == "":
+            name = "crossroad"
+        return name
+
+
+    def to_dict(self):
+        return {"name": self.name, "latitude": self.latitude, "longitude": self.longitude}
+
+
+    # parameters of crseg that can be given for a specific crossroad
+    # (e.g. "--c1 4 --c2 5" in notes.md)
+    def parse_parameters(txt):
+        parser = argparse.ArgumentParser(add_help=False)
+        parser.add_argument('--c0', type=float)
+        parser.add_argument('--c1', type=float)
+        parser.add_argument('--c2', type=float)
+        parser.add_argument('--similar-direction-angle', type=int)
+        args = parser.parse_args(txt.split())
+        return dict([(k, v) for k, v in vars(args).items() if v is not None])
+
+
+    def from_dict(d):
+        name = d.get("name", "")
+        latitude = float(d["latitude"] if "latitude" in d else d["lat"])
+        longitude = float(d["longitude"] if "longitude" in d else d["lon"])
+        parameters = {}
+        for key in ["c0", "c1", "c2"]:
+            if key in d and d[key] not in [None, ""]:
+                parameters[key] = float(d[key])
+        if "similar_direction_angle" in d and d["similar_direction_angle"] not in [None, ""]:
+            parameters["similar_direction_angle"] = int(d["similar_direction_angle"])
+        return BatchJob(name, latitude, longitude, parameters)
+
+
+    # read a list of crossroads from a csv file (with a header), a json file (list of objects),
+    # or a markdown file using the "### name: latitude longitude [parameters]" syntax of notes.md
+    def read_jobs(filename):
+        extension = os.path.splitext(filename)[1].lower()
+        jobs = []
+
+        if extension == ".csv":
+            with open(filename, newline='') as f:
+                for row in csv.DictReader(f):
+                    jobs.append(BatchJob.from_dict(row))
+        elif extension == ".json":
+            with open(filename) as f:
+                for entry in json.load(f):
+                    jobs.append(BatchJob.from_dict(entry))
+        elif extension == ".md":
+            pattern = re.compile(r'^###\s+(.+?)\s*:\s*(-?\d+(?:\.\d+)?)\s+(-?\d+(?:\.\d+)?)(.*)$')
+            with open(filename) as f:
+                for line in f:
+                    m = pattern.match(line.strip())
+                    if m:
+                        jobs.append(BatchJob(m.group(1), float(m.group(2)), float(m.group(3)),
+                                             BatchJob.parse_parameters(m.group(4))))
+        else:
+            raise ValueError("Unknown job list format: " + filename)
+
+        # avoid name collisions between output files
+        names = {}
+        for i, job in enumerate(jobs):
+            if job.name == "":
+                job.name = "crossroad " + str(i + 1)
+            basename = job.get_basename()
+            if basename in names:
+                names[basename] += 1
+                job.name += " " + str(names[basename])
+            else:
+                names[basename] = 1
+
+        return jobs
+
+
+
+# not an Exception: it cannot be caught by the error handling of the libraries
+class JobTimeout(BaseException):
+    pass
+
+
+
+class BatchWorker:
+
+    # a worker process running the jobs it receives through a pipe, one at a time. The
+    # region is given once to the process (see Batch.init_worker). The process can be
+    # killed (e.g. when a job is blocked in C code) and replaced by a new one.
+    def __init__(self, region):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=BatchWorker.main, args=(child_connection, region))
+        self.process.start()
+        child_connection.close()
+        self.index = None
+        self.start = None
+
+
+    def main(connection, region):
+        Batch.init_worker(region)
+        while True:
+            try:
+                message = connection.recv()
+            except EOFError:
+                break
+            if message is None:
+                break
+            index, arguments = message
+            connection.send((index, Batch.run_job(*arguments)))
+
+
+    def is_busy(self):
+        return self.index is not None
+
+
+    def submit(self, index, arguments):
+        self.index = index
+        self.start = time.perf_counter()
+        self.connection.send((index, arguments))
+
+
+    # result of the current job, or None if the process stopped before sending it
+    def receive(self):
+        try:
+            index, result = self.connection.recv()
+        except (EOFError, OSError):
+            return None
+        self.index = None
+        return result
+
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+
+class Batch:
+
+    default_crseg_parameters = {"c0": 2, "c1": 2, "c2": 4}
+
+    # region shared by all the jobs of a worker process
+    worker_region = None
+
+    # delay (in seconds) after the timeout before a worker still running its job is killed:
+    # the alarm raised within the worker does not interrupt a job blocked in C code
+    kill_delay = 5
+
+    # schematize a list of crossroads (BatchJob) using a pool of processes. Each crossroad
+    # runs the full pipeline (build, process, export) and is isolated from the others:
+    # a failure or a timeout only affects the corresponding job.
+    def __init__(self, output_directory, formats = ["pdf"],
+                 workers = None, timeout = None,
+                 build_parameters = {}, export_parameters = {},
+                 region = None):
+        self.output_directory = output_directory
+        self.formats = formats
+        self.workers = workers
+        self.timeout = timeout
+        self.build_parameters = build_parameters
+        self.export_parameters = export_parameters
+        self.region = region
+
+
+    def init_worker(region):
+        Batch.worker_region = region
+
+
+    def raise_timeout(signum, frame):
+        raise JobTimeout()
+
+
+    def run_job(job, output_directory, formats, timeout, build_parameters, export_parameters):
+        result = job.to_dict()
+        result["outputs"] = []
+        result["error"] = None
+        start = time.perf_counter()
+
+        # the timeout is raised within the worker process
+        use_alarm = timeout is not None and hasattr(signal, "SIGALRM")
+        if use_alarm:
+            previous_handler = signal.signal(signal.SIGALRM, Batch.raise_timeout)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+
+        try:
+            parameters = dict(Batch.default_crseg_parameters)
+            parameters.update(build_parameters)
+            parameters.update(job.parameters)
+            c0 = parameters.pop("c0")
+            c1 = parameters.pop("c1")
+            c2 = parameters.pop("c2")
+            if Batch.worker_region is not None:
+                parameters["region"] = Batch.worker_region
+
+            crschem = cs.CrossroadSchematization.build(job.latitude, job.longitude, c0, c1, c2, **parameters)
+            crschem.process(job.get_basename())
+            if crschem.report is not None:
+                result["report"] = crschem.report.to_dict()
+
+            filenames = [os.path.join(output_directory, job.get_basename() + "." + f) for f in formats]
+            if not crschem.export_all(filenames, **export_parameters):
+                raise ValueError("Unknown output format in: " + ", ".join(formats))
+            result["outputs"] += filenames
+
+            result["status"] = "ok"
+        except JobTimeout:
+            result["status"] = "timeout"
+            result["error"] = "timeout after " + str(timeout) + " s"
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, previous_handler)
+
+        result["duration"] = time.perf_counter() - start
+        return result
+
+
+    def get_failure(job, status, error, duration = None):
+        result = job.to_dict()
+        result.update({"status": status, "outputs": [], "duration": duration, "error": error})
+        return result
+
+
+    def run(self, jobs):
+        os.makedirs(self.output_directory, exist_ok=True)
+        start = time.perf_counter()
+        # results are given in the order of the input list
+        results = [None] * len(jobs)
+
+        def add_result(i, result):
+            print("[" + result["status"] + "]", result["name"], result["error"] if result["error"] else "")
+            results[i] = result
+
+        nb_workers = min(self.workers if self.workers is not None else (os.cpu_count() or 1), len(jobs))
+        pending = collections.deque(enumerate(jobs))
+        workers = []
+        try:
+            while len(pending) != 0 or len(workers) != 0:
+                # give the next jobs to the idle workers, and start new workers if required
+                for w in workers:
+                    if not w.is_busy() and len(pending) != 0:
+                        i, job = pending.popleft()
+                        w.submit(i, (job, self.output_directory, self.formats, self.timeout, self.build_parameters, self.export_parameters))
+                while len(workers) < nb_workers and len(pending) != 0:
+                    workers.append(BatchWorker(self.region))
+                    i, job = pending.popleft()
+                    workers[-1].submit(i, (job, self.output_directory, self.formats, self.timeout, self.build_parameters, self.export_parameters))
+                busy = [w for w in workers if w.is_busy()]
+                if len(busy) == 0:
+                    break
+
+                # wait for a result, or for the next deadline
+                wait_timeout = None
+                if self.timeout is not None:
+                    deadline = min([w.start for w in busy]) + self.timeout + Batch.kill_delay
+                    wait_timeout = max(0, deadline - time.perf_counter())
+                ready = multiprocessing.connection.wait([w.connection for w in busy] + [w.process.sentinel for w in busy], wait_timeout)
+
+                for w in busy:
+                    i = w.index
+                    if w.connection in ready or w.process.sentinel in ready:
+                        result = w.receive()
+                        if result is None:
+                            # the worker itself failed (e.g. killed by the system)
+                            add_result(i, Batch.get_failure(jobs[i], "error", "worker process terminated with exit code " + str(w.process.exitcode)))
+                        else:
+                            add_result(i, result)
+                        if result is None or not w.process.is_alive():
+                            w.kill()
+                            workers.remove(w)
+                    elif self.timeout is not None and time.perf_counter() - w.start > self.timeout + Batch.kill_delay:
+                        duration = time.perf_counter() - w.start
+                        w.kill()
+                        workers.remove(w)
+                        add_result(i, Batch.get_failure(jobs[i], "timeout", "timeout after " + str(self.timeout) + " s (worker process killed)", duration))
+        finally:
+            for w in workers:
+                if w.is_busy():
+                    w.kill()
+                else:
+                    w.stop()
+
+        return Batch.build_summary(results, time.perf_counter() - start)
+
+
+    def build_summary(results, duration):
+        return {"duration": duration,
+                "nb_jobs": len(results),
+                "nb_ok": len([r for r in results if r["status"] == "ok"]),
+                "nb_error": len([r for r in results if r["status"] == "error"]),
+                "nb_timeout": len([r for r in results if r["status"] == "timeout"]),
+                "jobs": results}
+
+
+
+def get_crossroad_schematization_batch_command():
+
+    parser = argparse.ArgumentParser(description="Generate schematized representations of a list of crossroads.")
+
+    group_input = parser.add_argument_group('Input', "Define the list of crossroads")
+    group_input.add_argument('input', help='list of crossroads: csv file (columns name, latitude, longitude and optional c0, c1, c2), json file (list of objects with the same keys), or markdown file (lines "### name: latitude longitude [--c0 X --c1 Y --c2 Z]", such as notes.md)')
+    group_input.add_argument('--overpass', help='Use Overpass to download data instead of the OSM api', action='store_true')
+    group_input.add_argument('--ignore-cache', help='Ignore local cache', action='store_true')
+    group_input.add_argument('--osm-extract', help='Load OSM data from a local extract (.osm or .osm.pbf file) rather than downloading it. The extract is indexed on first use.', type=str)
+    group_input.add_argument('--projected-graph-cache', help='Store the projected OSM graph of each crossroad in the given directory (compact binary format), and load it from there on the next runs (not used with --shared-region)', type=str)
+    group_input.add_argument('--shared-region', help='Load the OSM data of the area containing all the crossroads only once, and share it between crossroads', action='store_true')
+
+    group_preprocess = parser.add_argument_group('Preprocessing', "Default parameters of the preprocesses (crseg, crdesc), used if not given by the crossroad")
+    group_preprocess.add_argument('--c0', help='Initial intersection size (distance between boundaries and middle of the initial intersection). Default: 2.', type=float, default=2)
+    group_preprocess.add_argument('--c1', help='Intersection size (aggregation by adjacency). Default: 2.', type=float, default=2)
+    group_preprocess.add_argument('--c2', help='Intersection size (aggregation by cycle detection). Default: 4.', type=float, default=4)
+    group_preprocess.add_argument('--similar-direction-angle', help='Maximum angle for lanes to be considered inside the same branch (in degree). Default: 60.', type=int, default=60)
+
+    group_process = parser.add_argument_group("Processing", "Parameters of the processing")
+    group_process.add_argument('--keep-doubled-crossings', help='In case of double crossings (current bad configuration in OSM data with traffic lights), keep both nodes.', action='store_true')
+    group_process.add_argument('--ignore-crossings-for-sidewalks', help='Do not use crossings to shape the sidewalks', action='store_true')
+    group_process.add_argument('--use-fixed-width-on-branches', help='Use a fixed width on each branch (do not evaluate the width adjustment)', action='store_true')
+    group_process.add_argument('--turn-shape', help='Turn shape.', type=lambda s: TurningSidewalk.TurnShape[s], choices=list(TurningSidewalk.TurnShape), default=TurningSidewalk.TurnShape.ADJUSTED_ANGLE)
+    group_process.add_argument('--threshold-small-island', help='Area of a traffic island to be considered as small or large (m2). Default: 30', type=float, default=30)
+    group_process.add_argument('--normalizing-angles', help='Number of directions for normalization. Examples: 4, 8, 12. Use 0 for no angular normalization. Default: 0', type=int, default=0)
+    group_process.add_argument('--buffered-osm-radius', help='Only use the roadway edges within this distance (in meters) from the center of the crossroad to shape the turns of the sidewalks. Default: all the edges of the OSM data.', type=float, default=None)
+    group_process.add_argument('--crop-margin', help='Remove the OSM data farther than this distance (in meters) from the bounding box of the crossroad before processing it (e.g. 100). Small margins cut the branches and change the geometry normalization. Default: no cropping.', type=float, default=None)
+    group_process.add_argument('--no-snap-aligned-streets', help='Do not snap aligned streets.', action='store_true')
+
+    group_batch = parser.add_argument_group("Batch", "Parameters of the batch execution")
+    group_batch.add_argument('-w', '--workers', help='Number of worker processes. Default: number of processors.', type=int, default=None)
+    group_batch.add_argument('-t', '--timeout', help='Maximum duration of a crossroad (in seconds). A worker process still running a crossroad a few seconds after this limit is killed. Default: no limit.', type=float, default=None)
+    group_batch.add_argument('-s', '--summary', help='Write a json summary (durations and status of each crossroad) in this file', type=str, default=None)
+
+    group_output = parser.add_argument_group("Output", "Save results")
+    group_output.add_argument('-o', '--output-directory', help='Output directory', type=str, required=True)
+    group_output.add_argument('-f', '--format', help='Output format (can be used several times). Default: pdf.', action='append', choices=["geojson", "pdf", "tif", "svg", "shp"])
+    group_output.add_argument('--scale', help='Scale of the map. Default: 400 (for 1:400)', type=int, default=400, choices=[400, 500])
+    group_output.add_argument('--dpi', help='dpi for tif export', type=int, choices=[96, 300], default=300)
+    group_output.add_argument('--layout', help='Map layout.', type=lambda s: cs.CrossroadSchematization.Layout[s], choices=list(cs.CrossroadSchematization.Layout), default = cs.CrossroadSchematization.Layout.A5_landscape)
+    group_output.add_argument('--margin', help='Margin in cm. Default: 1.0cm', type=float, default=1)
+    group_output.add_argument("--non-reachable-islands", help="export non reachable islands.", action='store_true')
+    group_output.add_argument('--stage-report', help='measure time and memory of each processing stage, and write them to the given JSON lines file (one line per crossroad)', type=str)
+    group_output.add_argument('-l', '--log-files', help='write the intermediate geometries of each crossroad in the debug directory of the output directory', action='store_true')
+
+    args = parser.parse_args()
+
+    jobs = BatchJob.read_jobs(args.input)
+    print("Schematization of", len(jobs), "crossroads")
+
+    build_parameters = {"c0": args.c0, "c1": args.c1, "c2": args.c2,
+                        "similar_direction_angle": args.similar_direction_angle,
+                        "verbose": False,
+                        "ignore_crossings_for_sidewalks": args.ignore_crossings_for_sidewalks,
+                        "use_fixed_width_on_branches": args.use_fixed_width_on_branches,
+                        "turn_shape": args.turn_shape,
+                        "remove_doubled_crossings": not args.keep_doubled_crossings,
+                        "threshold_small_island": args.threshold_small_island,
+                        "normalizing_angles": args.normalizing_angles,
+                        "snap_aligned_streets": not args.no_snap_aligned_streets,
+                        "buffered_osm_radius": args.buffered_osm_radius,
+                        "crop_margin": args.crop_margin,
+                        "ignore_cache": args.ignore_cache,
+                        "overpass": args.overpass}
+    export_parameters = {"resolution": args.dpi, "scale": args.scale,
+                         "layout": args.layout, "margin": args.margin,
+                         "only_reachable_islands": not args.non_reachable_islands}
+
+    if args.stage_report:
+        build_parameters["instrumentation"] = ProcessInstrumentation()
+
+    osm_extract = None
+    if args.osm_extract:
+        osm_extract = OSMExtract(args.osm_extract)
+        # index it before starting the workers
+        osm_extract.index()
+        build_parameters["osm_extract"] = osm_extract
+
+    if args.log_files:
+        build_parameters["debug_sink"] = GeometryDebugSink(os.path.join(args.output_directory, "debug"))
+
+    if args.projected_graph_cache:
+        build_parameters["graph_store"] = ProjectedGraphStore(args.projected_graph_cache)
+
+    region = None
+    if args.shared_region:
+        print("Loading OpenStreetMap data of the region")
+        region = OSMRegion.from_points([(j.latitude, j.longitude) for j in jobs], margin=400, ignore_cache=args.ignore_cache, osm_extract=osm_extract)
+        # project it once, before sharing it with the workers
+        region.get_projected()
+
+    batch = Batch(args.output_directory, args.format if args.format else ["pdf"],
+                  workers=args.workers, timeout=args.timeout,
+                  build_parameters=build_parameters, export_parameters=export_parameters,
+                  region=region)
+    summary = batch.run(jobs)
+
+    print("Done in", round(summary["duration"], 1), "s:", summary["nb_ok"], "ok,",
+          summary["nb_error"], "error(s),", summary["nb_timeout"], "timeout(s)")
+
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if args.stage_report:
+        with open(args.stage_report, "a") as f:
+            for r in summary["jobs"]:
+                if "report" in r:
+                    f.write(json.dumps(dict(r["report"], name=r["name"])) + "\n")
@@ -0,0 +1,494 @@
+# coding: utf-8
+
+import argparse
+import json
+import math
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import crschem.crossroad_schematization as cs
+from crschem.batch import BatchJob, Batch
+from crschem.osm_extract import OSMExtract
+from crschem.instrumentation import ProcessInstrumentation
+from crschem.synthetic import SyntheticCrossroad
+
+
+class BenchmarkCase:
+
+    # a crossroad with all the inputs of the schematization available offline:
+    # the input model (crdesc) and the OSM graph around the crossroad
+    def __init__(self, name, cr_input, G_init, parameters = None):
+        self.name = name
+        self.cr_input = cr_input
+        self.G_init = G_init
+        self.parameters = parameters if parameters is not None else {}
+
+
+    # run the preprocessing (OSM download or extract, segmentation, model) of a crossroad
+    def capture(job, osm_extract = None, overpass = False):
+        parameters = dict(Batch.default_crseg_parameters)
+        parameters.update(job.parameters)
+        G_init = cs.CrossroadSchematization.load_osm_graph(job.latitude, job.longitude, False,
+                                                           overpass=overpass, osm_extract=osm_extract)
+        cr_input = cs.CrossroadSchematization.build_input_model(G_init, job.latitude, job.longitude,
+                                                                parameters["c0"], parameters["c1"], parameters["c2"],
+                                                                parameters.get("similar_direction_angle", 60), False)
+        return BenchmarkCase(job.get_basename(), cr_input, G_init, dict(job.to_dict(), **job.parameters))
+
+
+    def from_synthetic(crossroad):
+        G_init, cr_input = crossroad.build()
+        return BenchmarkCase(crossroad.get_name(), cr_input, G_init,
+                             {"nb_branches": crossroad.nb_branches, "nb_dual_carriageways": crossroad.nb_dual_carriageways,
+                              "crossings_per_branch": crossroad.crossings_per_branch})
+
+
+    # a case is a directory containing the input model (model.geojson),
+    # the OSM graph (osm.graphml) and a description (case.json)
+    def save(self, directory):
+        import osmnx
+
+        path = os.path.join(directory, self.name)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "model.geojson"), "w") as f:
+            f.write(self.cr_input.to_json())
+        osmnx.io.save_graphml(self.G_init, os.path.join(path, "osm.graphml"))
+        with open(os.path.join(path, "case.json"), "w") as f:
+            json.dump(self.parameters, f, indent=2)
+
+
+    def load(path):
+        import geopandas
+        import osmnx
+
+        with open(os.path.join(path, "model.geojson")) as f:
+            # read as in CrossroadSchematization.build_input_model
+            cr_input = geopandas.GeoDataFrame.from_features(json.load(f)["features"], crs="EPSG:4326")
+        G_init = osmnx.io.load_graphml(os.path.join(path, "osm.graphml"))
+        parameters = {}
+        if os.path.exists(os.path.join(path, "case.json")):
+            with open(os.path.join(path, "case.json")) as f:
+                parameters = json.load(f)
+        return BenchmarkCase(os.path.basename(os.path.normpath(path)), cr_input, G_init, parameters)
+
+
+    def load_directory(directory, names = None):
+        cases = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.exists(os.path.join(path, "model.geojson")) and (names is None or name in names):
+                cases.append(BenchmarkCase.load(path))
+        return cases
+
+
+
+class Benchmark:
+
+    # runs the schematization of each case several times (after some warm-up runs),
+    # and measures separately the loading of the OSM data (preparation and projection),
+    # each stage of process() and each export format
+    def __init__(self, cases, repeat = 5, warmup = 1, formats = ["geojson", "pdf", "tif", "svg"],
+                 process_parameters = {}, export_parameters = {}):
+        self.cases = cases
+        self.repeat = repeat
+        self.warmup = warmup
+        self.formats = formats
+        self.process_parameters = process_parameters
+        self.export_parameters = export_parameters
+
+
+    def run_once(self, case, directory):
+        measures = {}
+
+        start = time.perf_counter()
+        # the input model is modified by the processing (see assemble_sidewalks)
+        crschem = cs.CrossroadSchematization(case.cr_input.copy(), case.G_init,
+                                             instrumentation=ProcessInstrumentation(trace_memory=False),
+                                             **self.process_parameters)
+        measures["load_osm"] = time.perf_counter() - start
+
+        crschem.process()
+        measures["process"] = crschem.report.get_wall_time()
+        for stage in crschem.report.stages:
+            measures["process/" + stage.name] = stage.wall_time
+
+        for f in self.formats:
+            start = time.perf_counter()
+            crschem.export_all([os.path.join(directory, case.name + "." + f)], verbose=False, **self.export_parameters)
+            measures["export/" + f] = time.perf_counter() - start
+
+        measures["total"] = measures["load_osm"] + measures["process"] + sum([measures["export/" + f] for f in self.formats])
+        return measures
+
+
+    # statistics of each measure of the given runs
+    def summarize(runs):
+        return dict([(key, {"min": min([r[key] for r in runs]),
+                            "median": statistics.median([r[key] for r in runs]),
+                            "mean": statistics.mean([r[key] for r in runs])}) for key in runs[0]])
+
+
+    def run_case(self, case):
+        directory = tempfile.mkdtemp(prefix="crschem-benchmark-")
+        runs = []
+        try:
+            for i in range(self.warmup + self.repeat):
+                measures = self.run_once(case, directory)
+                if i >= self.warmup:
+                    runs.append(measures)
+        finally:
+            shutil.rmtree(directory)
+
+        return Benchmark.summarize(runs)
+
+
+    def run(self):
+        results = {"repeat": self.repeat, "warmup": self.warmup, "formats": self.formats, "cases": {}}
+        for case in self.cases:
+            print("Benchmarking", case.name)
+            results["cases"][case.name] = self.run_case(case)
+        return results
+
+
+    # list the measures of the results that are slower than the baseline by more than
+    # the given ratio (measures shorter than min_time in both runs are ignored, being mostly noise)
+    def compare(results, baseline, threshold = 0.2, min_time = 0.005, statistic = "median"):
+        regressions = []
+        for name, measures in results["cases"].items():
+            if not name in baseline["cases"]:
+                continue
+            for key, values in measures.items():
+                if not key in baseline["cases"][name]:
+                    continue
+                current = values[statistic]
+                reference = baseline["cases"][name][key][statistic]
+                if max(current, reference) < min_time:
+                    continue
+                if current > reference * (1 + threshold):
+                    regressions.append({"case": name, "measure": key, "baseline": reference, "current": current,
+                                        "ratio": current / reference if reference != 0 else None})
+        return regressions
+
+
+    def print_results(results, baseline = None, statistic = "median"):
+        for name, measures in results["cases"].items():
+            print(name)
+            for key, values in measures.items():
+                line = "  {:<40} {:>10.4f} s".format(key, values[statistic])
+                if baseline is not None and name in baseline["cases"] and key in baseline["cases"][name]:
+                    reference = baseline["cases"][name][key][statistic]
+                    if reference != 0:
+                        line += "  ({:+.1f}%)".format((values[statistic] / reference - 1) * 100)
+                print(line)
+
+
+class MicroBenchmark:
+
+    # single steps of the processing, run on generated data of increasing sizes. Results
+    # are checked, and stored as cases named <benchmark>-<size> (thus can be compared to a
+    # baseline as the results of Benchmark). The scaling of a measure is the ratio between
+    # its time per element on the largest size and on the smallest one (1 if linear).
+    sizes = {"expander": [1250, 2500, 5000, 10000],
+             "normalizer": [5000, 10000, 20000]}
+
+    def __init__(self, names = None, repeat = 5, warmup = 1):
+        self.names = names if names is not None else list(MicroBenchmark.sizes)
+        self.repeat = repeat
+        self.warmup = warmup
+
+
+    # a way (or a ring) of the given number of nodes, as in the undirected graph labelled
+    # by process(). Nodes are two meters apart, with small turns
+    def get_way(nb_nodes, closed = False):
+        import networkx
+
+        G = networkx.MultiGraph()
+        if closed:
+            radius = nb_nodes * 2 / (2 * math.pi)
+            for i in range(nb_nodes):
+                angle = 2 * math.pi * i / nb_nodes
+                G.add_node(i, x=radius * math.cos(angle), y=radius * math.sin(angle))
+        else:
+            for i in range(nb_nodes):
+                G.add_node(i, x=i * 2, y=(i % 2) * 0.1)
+        edges = [(i, i + 1) for i in range(nb_nodes - 1)] + ([(nb_nodes - 1, 0)] if closed else [])
+        for n1, n2 in edges:
+            G.add_edge(n1, n2, type="unknown", name="way")
+        return G
+
+
+    # walks of the Expander along a way and around a ring (they were recursive,
+    # and failed with a RecursionError on long ways)
+    def expander(nb_nodes):
+        from crschem.processing import Expander
+
+        measures = {}
+        way = MicroBenchmark.get_way(nb_nodes)
+        start = time.perf_counter()
+        path = Expander.extend_branch(way, 0, 1, True)
+        measures["extend_branch"] = time.perf_counter() - start
+        if len(path) != nb_nodes:
+            raise ValueError("extend_branch: path of " + str(len(path)) + " nodes instead of " + str(nb_nodes))
+
+        ring = MicroBenchmark.get_way(nb_nodes, True)
+        start = time.perf_counter()
+        polygon = Expander.close_polygon(ring, [0, 1])
+        measures["close_polygon"] = time.perf_counter() - start
+        if len(polygon) != nb_nodes + 1 or polygon[0] != polygon[-1]:
+            raise ValueError("close_polygon: the ring of " + str(nb_nodes) + " nodes is not closed")
+        return measures
+
+
+    # remapping of the nodes of the OSM graph by the geometry normalization (Normalizer.adjust_nodes),
+    # on a synthetic crossroad with 6 branches, and the given number of random nodes around it
+    def normalizer(nb_nodes):
+        import numpy as np
+        from crschem.normalization.normalizer import Normalizer
+
+        G_init, cr_input = SyntheticCrossroad(6, 2).build()
+        crschem = cs.CrossroadSchematization(cr_input, G_init)
+        crschem.label_osm_from_input()
+        crschem.build_branches()
+        normalizer = Normalizer(angular_discretization=8)
+        normalizer.normalize_branches(crschem.branches, crschem.center)
+
+        G = crschem.osm_input
+        coords = np.array([(G.nodes[n]["x"], G.nodes[n]["y"]) for n in G.nodes])
+        random_coords = np.random.default_rng(0).uniform(coords.min(axis=0), coords.max(axis=0), (nb_nodes, 2))
+        first = max(G.nodes) + 1
+        G.add_nodes_from([(first + i, {"x": x, "y": y}) for i, (x, y) in enumerate(random_coords.tolist())])
+
+        start = time.perf_counter()
+        normalizer.adjust_nodes(G)
+        measures = {"adjust_nodes": time.perf_counter() - start}
+        if not all([math.isfinite(G.nodes[n]["x"]) and math.isfinite(G.nodes[n]["y"]) for n in G.nodes]):
+            raise ValueError("adjust_nodes: invalid coordinates")
+        return measures
+
+
+    def run(self):
+        results = {"repeat": self.repeat, "warmup": self.warmup, "cases": {}, "scaling": {}}
+        for name in self.names:
+            function = getattr(MicroBenchmark, name)
+            sizes = MicroBenchmark.sizes[name]
+            for size in sizes:
+                print("Benchmarking", name, "on", size, "elements")
+                runs = [function(size) for i in range(self.warmup + self.repeat)][self.warmup:]
+                results["cases"][name + "-" + str(size)] = Benchmark.summarize(runs)
+            first = results["cases"][name + "-" + str(sizes[0])]
+            last = results["cases"][name + "-" + str(sizes[-1])]
+            results["scaling"][name] = dict([(key, (last[key]["median"] / sizes[-1]) / (first[key]["median"] / sizes[0]))
+                                             for key in first if first[key]["median"] != 0])
+        return results
+
+
+    # list the measures whose scaling exceeds the given value
+    def check(results, max_scaling):
+        failures = []
+        for name, measures in results["scaling"].items():
+            for key, scaling in measures.items():
+                if scaling > max_scaling:
+                    failures.append(name + "/" + key + ": time per element x{:.2f} on the largest size".format(scaling))
+        return failures
+
+
+    def print_results(results, baseline = None):
+        Benchmark.print_results(results, baseline)
+        for name, measures in results["scaling"].items():
+            for key, scaling in measures.items():
+                print("  {:<40} x{:.2f}".format("scaling " + name + "/" + key, scaling))
+
+
+
+class ImportBenchmark:
+
+    # heavy dependencies that must only be imported by the code using them,
+    # not when importing the library or starting the command line tools
+    lazy_modules = ["osmnx", "geopandas", "pandas", "matplotlib", "mapnik", "osgeo", "crseg", "crmodel", "scipy"]
+
+    # each command is run in a fresh interpreter
+    commands = {"import": "import crschem.crossroad_schematization",
+                "help": "import sys\n"
+                        "sys.argv = ['get_crossroad_schematization', '--help']\n"
+                        "from crschem.cmd import get_crossroad_schematization_command\n"
+                        "try:\n"
+                        "    get_crossroad_schematization_command()\n"
+                        "except SystemExit:\n"
+                        "    pass\n"}
+
+    def __init__(self, repeat = 5):
+        self.repeat = repeat
+
+
+    def run_command(code):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL)
+        return time.perf_counter() - start
+
+
+    # heavy dependencies loaded by the given command
+    def get_lazy_modules_loaded(code):
+        code += "\nimport sys, json\nprint(json.dumps(sorted(sys.modules)), file=sys.stderr)\n"
+        output = subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, text=True).stderr
+        modules = json.loads(output.strip().split("\n")[-1])
+        return sorted(set([m.split(".")[0] for m in modules]) & set(ImportBenchmark.lazy_modules))
+
+
+    def run(self):
+        # the interpreter startup alone, to be able to tell it apart from the import time
+        results = {"repeat": self.repeat, "python": min([ImportBenchmark.run_command("pass") for i in range(self.repeat)])}
+        for name, code in ImportBenchmark.commands.items():
+            times = [ImportBenchmark.run_command(code) for i in range(self.repeat)]
+            results[name] = {"min": min(times),
+                             "median": statistics.median(times),
+                             "lazy_modules_loaded": ImportBenchmark.get_lazy_modules_loaded(code)}
+        return results
+
+
+    # list the commands slower than their budget (in seconds), or loading a heavy dependency
+    def check(results, budgets):
+        failures = []
+        for name, budget in budgets.items():
+            if budget is not None and results[name]["min"] > budget:
+                failures.append(name + ": {:.3f} s exceeds the budget of {:.3f} s".format(results[name]["min"], budget))
+            if len(results[name]["lazy_modules_loaded"]) != 0:
+                failures.append(name + ": loads " + ", ".join(results[name]["lazy_modules_loaded"]))
+        return failures
+
+
+    def print_results(results):
+        print("  {:<40} {:>10.4f} s".format("python startup", results["python"]))
+        for name in ImportBenchmark.commands:
+            print("  {:<40} {:>10.4f} s".format(name, results[name]["min"]))
+
+
+
+def get_crossroad_schematization_benchmark_command():
+
+    parser = argparse.ArgumentParser(description="Benchmark the crossroad schematization on offline cases.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_capture = subparsers.add_parser("capture", help="Download (or extract) and preprocess crossroads, and save them as offline benchmark cases")
+    parser_capture.add_argument('input', help='list of crossroads: csv file, json file or markdown file (such as notes.md), as for get_crossroad_schematization_batch')
+    parser_capture.add_argument('-d', '--directory', help='Directory of the benchmark cases', type=str, required=True)
+    parser_capture.add_argument('--overpass', help='Use Overpass to download data instead of the OSM api', action='store_true')
+    parser_capture.add_argument('--osm-extract', help='Load OSM data from a local extract (.osm or .osm.pbf file) rather than downloading it.', type=str)
+
+    parser_run = subparsers.add_parser("run", help="Run the benchmark")
+    parser_run.add_argument('directory', help='Directory of the benchmark cases', nargs='?')
+    parser_run.add_argument('--synthetic', help='Add a synthetic crossroad with the given number of branches, and optionally of dual carriageways and of mid-block crossings per branch (e.g. 8, 8:3 or 8:3:4). Can be used several times.', action='append')
+    parser_run.add_argument('--case', help='Only run this case (can be used several times)', action='append')
+    parser_run.add_argument('-r', '--repeat', help='Number of measured runs per case. Default: 5.', type=int, default=5)
+    parser_run.add_argument('--warmup', help='Number of warm-up runs per case (not measured). Default: 1.', type=int, default=1)
+    parser_run.add_argument('-f', '--format', help='Export format to measure (can be used several times). Default: geojson, pdf, tif, svg.', action='append', choices=["geojson", "pdf", "tif", "svg", "shp"])
+    parser_run.add_argument('-o', '--output', help='Save the results in this json file (e.g. to be used as a baseline)', type=str)
+    parser_run.add_argument('-b', '--baseline', help='Compare to the results stored in this json file', type=str)
+    parser_run.add_argument('--threshold', help='Maximum allowed slowdown compared to the baseline, as a ratio. Default: 0.2 (20%%).', type=float, default=0.2)
+    parser_run.add_argument('--min-time', help='Ignore measures shorter than this duration (in seconds) when comparing. Default: 0.005.', type=float, default=0.005)
+
+    parser_imports = subparsers.add_parser("imports", help="Measure the import time of the library and the startup time of the command line tool")
+    parser_imports.add_argument('-r', '--repeat', help='Number of measured runs. Default: 5.', type=int, default=5)
+    parser_imports.add_argument('--budget-import', help='Maximum time (in seconds, including the interpreter startup) to import crschem.crossroad_schematization. Default: 0.5.', type=float, default=0.5)
+    parser_imports.add_argument('--budget-help', help='Maximum time (in seconds, including the interpreter startup) of get_crossroad_schematization --help. Default: 0.5.', type=float, default=0.5)
+    parser_imports.add_argument('-o', '--output', help='Save the results in this json file', type=str)
+
+    parser_micro = subparsers.add_parser("micro", help="Measure single steps of the processing on generated data of increasing sizes")
+    parser_micro.add_argument('benchmark', help='Benchmarks to run (' + ", ".join(MicroBenchmark.sizes) + '). Default: all.', nargs='*')
+    parser_micro.add_argument('-r', '--repeat', help='Number of measured runs per size. Default: 5.', type=int, default=5)
+    parser_micro.add_argument('--warmup', help='Number of warm-up runs per size (not measured). Default: 1.', type=int, default=1)
+    parser_micro.add_argument('--max-scaling', help='Maximum ratio between the time per element on the largest size and on the smallest one. Default: 2.', type=float, default=2)
+    parser_micro.add_argument('-o', '--output', help='Save the results in this json file (e.g. to be used as a baseline)', type=str)
+    parser_micro.add_argument('-b', '--baseline', help='Compare to the results stored in this json file', type=str)
+    parser_micro.add_argument('--threshold', help='Maximum allowed slowdown compared to the baseline, as a ratio. Default: 0.2 (20%%).', type=float, default=0.2)
+
+    args = parser.parse_args()
+
+    if args.command == "capture":
+        osm_extract = OSMExtract(args.osm_extract) if args.osm_extract else None
+        for job in BatchJob.read_jobs(args.input):
+            print("Capturing", job.name)
+            try:
+                BenchmarkCase.capture(job, osm_extract, args.overpass).save(args.directory)
+            except Exception as e:
+                print("Error:", e)
+        return
+
+    if args.command == "micro":
+        for name in args.benchmark:
+            if not name in MicroBenchmark.sizes:
+                parser_micro.error("unknown benchmark: " + name)
+        try:
+            results = MicroBenchmark(args.benchmark if len(args.benchmark) != 0 else None, args.repeat, args.warmup).run()
+        except (ValueError, RecursionError) as e:
+            print("Failure:", e)
+            sys.exit(1)
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        MicroBenchmark.print_results(results, baseline)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        failures = MicroBenchmark.check(results, args.max_scaling)
+        if baseline is not None:
+            failures += [r["case"] + "/" + r["measure"] + ": {:.4f} s -> {:.4f} s".format(r["baseline"], r["current"])
+                         for r in Benchmark.compare(results, baseline, args.threshold)]
+        for f in failures:
+            print("Failure:", f)
+        if len(failures) != 0:
+            sys.exit(1)
+        return
+
+    if args.command == "imports":
+        results = ImportBenchmark(args.repeat).run()
+        ImportBenchmark.print_results(results)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        failures = ImportBenchmark.check(results, {"import": args.budget_import, "help": args.budget_help})
+        for f in failures:
+            print("Failure:", f)
+        if len(failures) != 0:
+            sys.exit(1)
+        return
+
+    cases = []
+    if args.directory:
+        cases += BenchmarkCase.load_directory(args.directory, args.case)
+    if args.synthetic:
+        for p in args.synthetic:
+            values = [int(x) for x in p.split(":")]
+            cases.append(BenchmarkCase.from_synthetic(SyntheticCrossroad(values[0], values[1] if len(values) > 1 else 0,
+                                                                         crossings_per_branch=values[2] if len(values) > 2 else 0)))
+    if len(cases) == 0:
+        print("No benchmark case")
+        sys.exit(1)
+
+    benchmark = Benchmark(cases, repeat=args.repeat, warmup=args.warmup,
+                          formats=args.format if args.format else ["geojson", "pdf", "tif", "svg"])
+    results = benchmark.run()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    Benchmark.print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = Benchmark.compare(results, baseline, args.threshold, args.min_time)
+        for r in regressions:
+            print("Regression:", r["case"], r["measure"], "{:.4f} s -> {:.4f} s".format(r["baseline"], r["current"]))
+        if len(regressions) != 0:
+            sys.exit(1)
@@ -1,29 +1,34 @@
 # coding: utf-8
 
 import argparse
-import geopandas
+import copy
 import sys
 
 import crschem.crossroad_schematization as cs
+from crschem.osm_extract import OSMExtract
+from crschem.instrumentation import ProcessInstrumentation, JSONLinesSink
 from crschem.model.turning_sidewalk import TurningSidewalk
-
-def get_crossroad_schematization_command():
-
-
-    # a trick to avoid the creation of files given as parameters
-    class FileOpener(argparse.FileType):
-        # delayed FileType;
-        # sample use:
-        # with args.input.open() as f: f.read()
-        def __call__(self, string):
-            # optionally test string
-            self.filename = string
-            return self
-        def open(self):
-            return super(FileOpener,self).__call__(self.filename)
-        file =  property(open, None, None, 'open file property')
-
-
+from crschem.server import SchematizationClient, get_default_socket_path
+from crschem.stage_cache import StageCache
+from crschem.graph_store import ProjectedGraphStore
+
+# a trick to avoid the creation of files given as parameters
+class FileOpener(argparse.FileType):
+    # delayed FileType;
+    # sample use:
+    # with args.input.open() as f: f.read()
+    def __call__(self, string):
+        # optionally test string
+        # (a copy, as the option can be given several times)
+        opener = copy.copy(self)
+        opener.filename = string
+        return opener
+    def open(self):
+        return super(FileOpener,self).__call__(self.filename)
+    file =  property(open, None, None, 'open file property')
+
+
+def get_crossroad_schematization_parser():
 
     parser = argparse.ArgumentParser(description="Generate a schematized representation of a given crossroad.")
 
@@ -35,6 +40,8 @@ def get_crossroad_schematization_command():
 
     group_input.add_argument('--overpass', help='Use Overpass to download data instead of the OSM api', action='store_true')
     group_input.add_argument('--ignore-cache', help='Ignore local cache', action='store_true')
+    group_input.add_argument('--osm-extract', help='Load OSM data from a local extract (.osm or .osm.pbf file) rather than downloading it. The extract is indexed on first use.', type=str)
+    group_input.add_argument('--projected-graph-cache', help='Store the projected OSM graph of each crossroad in the given directory (compact binary format), and load it from there on the next runs', type=str)
 
     group_preprocess = parser.add_argument_group('Preprocessing', "Parameters of the preprocesses (crseg, crdesc)")
     group_preprocess.add_argument('--c0', help='Initial intersection size (distance between boundaries and middle of the initial intersection). Default: 2.', type=float, default=2)
@@ -47,16 +54,24 @@ def get_crossroad_schematization_command():
     group_process.add_argument('--ignore-crossings-for-sidewalks', help='Do not use crossings to shape the sidewalks', action='store_true')
     group_process.add_argument('--use-fixed-width-on-branches', help='Use a fixed width on each branch (do not evaluate the width adjustment)', action='store_true')
     group_process.add_argument('--turn-shape', help='Turn shape.', type=lambda s: TurningSidewalk.TurnShape[s], choices=list(TurningSidewalk.TurnShape))
+    group_process.add_argument('--threshold-small-island', help='Area of a traffic island to be considered as small or large (m2). Default: 30', type=float, default=30)
+    group_process.add_argument('--normalizing-angles', help='Number of directions for normalization. Examples: 4, 8, 12. Use 0 for no angular normalization. Default: 0', type=int, default=0)
+    group_process.add_argument('--buffered-osm-radius', help='Only use the roadway edges within this distance (in meters) from the center of the crossroad to shape the turns of the sidewalks. Default: all the edges of the OSM data.', type=float, default=None)
+    group_process.add_argument('--crop-margin', help='Remove the OSM data farther than this distance (in meters) from the bounding box of the crossroad before processing it (e.g. 100). Small margins cut the branches and change the geometry normalization. Default: no cropping.', type=float, default=None)
+
+    group_process.add_argument('--stage-cache', help='Keep the results of the stages (OSM data, segmentation, model, and each stage of the processing) in the given directory, so that running again the same crossroad with other parameters only recomputes the stages depending on them', type=str)
+    group_process.add_argument('--stage-cache-size', help='Maximum size of the stage cache directory, in MB. Default: 1024.', type=int, default=1024)
 
     group_output = parser.add_argument_group("Output", "Display, log or save results")
     group_output.add_argument('-l', '--log-files', help='keep intermediate files and give their name in output', action='store_true')
     group_output.add_argument('-d', '--display-all', help='display all steps', action='store_true')
     group_output.add_argument('--display-preview', help='display a preview of the crossroad schematization', action='store_true')
-    group_output.add_argument('-o', '--output', help='output file (supported format: geojson, pdf, tif, shp)', type=FileOpener('w'))
+    group_output.add_argument('-o', '--output', help='output file (supported format: geojson, pdf, tif, svg, shp). Can be given several times: the styled outputs are then rendered from a single workspace.', type=FileOpener('w'), action='append')
     group_output.add_argument('--scale', help='Scale of the map. Default: 400 (for 1:400)', type=int, default=400, choices=[400, 500])
     group_output.add_argument('--dpi', help='dpi for tif export', type=int, choices=[96, 300], default=300)
     group_output.add_argument('--layout', help='Map layout.', type=lambda s: cs.CrossroadSchematization.Layout[s], choices=list(cs.CrossroadSchematization.Layout), default = cs.CrossroadSchematization.Layout.A5_landscape)
     group_output.add_argument('--margin', help='Margin in cm. Default: 1.0cm', type=float, default=1)
+    group_output.add_argument('--stage-report', help='measure time and memory of each processing stage, print them and append them to the given JSON lines file', type=str)
 
     group_preview = parser.add_argument_group("Preview options", "Parameters used by the preview display")
     group_preview.add_argument('--osm', help='display OpenStreetMap network', action='store_true')
@@ -65,9 +80,16 @@ def get_crossroad_schematization_command():
     group_preview.add_argument('--exact-islands', help='display exact shape of the islands', action='store_true')
     group_preview.add_argument("--non-reachable-islands", help="display non reachable islands.", action='store_true')
 
-    args = parser.parse_args()
+    group_worker = parser.add_argument_group("Worker", "Forward the job to a running worker (see get_crossroad_schematization_server)")
+    group_worker.add_argument('--server', help='Unix socket of the worker. Default: $CRSCHEM_SOCKET, or crschem.sock in $XDG_RUNTIME_DIR (or in a private crschem-<uid> directory of the temporary directory).', type=str, default=get_default_socket_path())
+    group_worker.add_argument('--no-server', help='Run the job in this process, even if a worker is running', action='store_true')
+
+    return parser
 
 
+# run a job. A worker (SchematizationWorker) provides the OSM data and the maps kept in memory by the daemon.
+def run_crossroad_schematization(args, worker = None):
+
     try:
 
         if args.input_model:
@@ -78,6 +100,17 @@ def get_crossroad_schematization_command():
         else:
             latitude = args.by_coordinates[0]
             longitude = args.by_coordinates[1]
+            if worker is not None:
+                osm_extract = worker.get_osm_extract(args.osm_extract) if args.osm_extract else None
+                G_init = worker.get_osm_graph(latitude, longitude, args.ignore_cache, args.overpass, osm_extract)
+                stage_cache = worker.stage_cache
+                debug_sink = worker.get_debug_sink() if args.log_files else None
+            else:
+                osm_extract = OSMExtract(args.osm_extract) if args.osm_extract else None
+                G_init = None
+                stage_cache = StageCache(directory=args.stage_cache, max_disk_size=args.stage_cache_size * 1024 * 1024) if args.stage_cache else None
+                debug_sink = None
+            graph_store = ProjectedGraphStore(args.projected_graph_cache) if args.projected_graph_cache else None
             crschem = cs.CrossroadSchematization.build(latitude, longitude,
                                                     args.c0, args.c1, args.c2,
                                                     similar_direction_angle = args.similar_direction_angle,
@@ -85,17 +118,32 @@ def get_crossroad_schematization_command():
                                                     ignore_crossings_for_sidewalks = args.ignore_crossings_for_sidewalks,
                                                     use_fixed_width_on_branches = args.use_fixed_width_on_branches,
                                                     turn_shape = args.turn_shape,
+                                                    normalizing_angles = args.normalizing_angles,
+                                                    threshold_small_island = args.threshold_small_island,
                                                     remove_doubled_crossings = not args.keep_doubled_crossings,
                                                     ignore_cache = args.ignore_cache,
                                                     overpass = args.overpass,
-                                                    log_files = args.log_files)
+                                                    log_files = args.log_files,
+                                                    osm_extract = osm_extract,
+                                                    G_init = G_init,
+                                                    stage_cache = stage_cache,
+                                                    graph_store = graph_store,
+                                                    buffered_osm_radius = args.buffered_osm_radius,
+                                                    crop_margin = args.crop_margin,
+                                                    debug_sink = debug_sink)
 
         '''if not crschem.is_valid_model():
             print("Error: the model is not valid")
             exit(1)'''
 
+        if args.stage_report:
+            crschem.instrumentation = ProcessInstrumentation(JSONLinesSink(args.stage_report))
+
         crschem.process()
 
+        if crschem.report is not None:
+            crschem.report.print()
+
         if args.display_preview or args.display_all:
             crschem.show(only_reachable_islands=not args.non_reachable_islands, osm_graph=args.osm,
                             branches=args.branches,
@@ -103,31 +151,23 @@ def get_crossroad_schematization_command():
                             exact_islands=args.exact_islands)
 
         if args.output:
-            if len(args.output.filename) < 4:
-                "Cannot deduce required format with small file names"
-                
-        if args.output:
+            crschem.export_all([o.filename for o in args.output], args.log_files, resolution=args.dpi, layout=args.layout, margin=args.margin, scale=args.scale, only_reachable_islands=not args.non_reachable_islands,
+                                map_cache=worker.map_cache if worker is not None else None)
 
-            if args.output.filename.endswith(".pdf"):
-                print("Exporting as pdf:", args.output.filename)
-                crschem.toPdf(args.output.filename, args.log_files, resolution=args.dpi, layout=args.layout, margin=args.margin, scale=args.scale, only_reachable_islands=not args.non_reachable_islands)
-            elif args.output.filename.endswith(".tif"):
-                print("Exporting as tif:", args.output.filename)
-                crschem.toTif(args.output.filename, args.log_files, resolution=args.dpi, layout=args.layout, margin=args.margin, scale=args.scale, only_reachable_islands=not args.non_reachable_islands)
-            elif args.output.filename.endswith(".svg"):
-                print("Exporting as svg:", args.output.filename)
-                crschem.toSvg(args.output.filename, args.log_files, resolution=args.dpi, layout=args.layout, margin=args.margin, scale=args.scale, only_reachable_islands=not args.non_reachable_islands)
-            elif args.output.filename.endswith(".geojson"):
-                print("Exporting as geojson:", args.output.filename)
-                crschem.toGeojson(args.output.filename, not args.non_reachable_islands)
-            elif args.output.filename.endswith(".shp"):
-                print("Exporting as shapefile:", args.output.filename)
-                crschem.toShapefiles(args.output.filename, not args.non_reachable_islands)
-            else:
-                print("Unknown output format")
-                
 
     except ValueError as e:
         print("Error:", e)
         print("Intermediate files:", input_file)
 
+
+def get_crossroad_schematization_command():
+
+    args = get_crossroad_schematization_parser().parse_args()
+
+    # the display requires this process
+    if not args.no_server and not args.display_preview and not args.display_all:
+        status = SchematizationClient.run(args.server, sys.argv[1:])
+        if status is not None:
+            sys.exit(status)
+
+    run_crossroad_schematization(args)
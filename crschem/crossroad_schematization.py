@@ -1,33 +1,30 @@
 from shapely.geometry import Point, LineString, MultiLineString, LinearRing, Polygon, box
 from shapely import affinity
-import osmnx
 import os
+import json
 import networkx
 import numpy as np
 import copy
 import itertools
-import geopandas
-import pandas
 import re
-import matplotlib.pyplot as plt
-import crseg.segmentation as cseg
 import shutil
-import mapnik
-import mapnik.printing
-from mapnik.printing.conversions import m2px
 import sys
-from osgeo import gdal, osr
 import tempfile
 from enum import Enum
 
 from . import utils as u
 from . import processing as p
+from .debug import DebugSink, GeometryDebugSink
+from .instrumentation import Instrumentation
+from .stage_cache import StageCache
 
 from .model.branch import Branch
 from .model.traffic_island import TrafficIsland
 from .model.turning_sidewalk import TurningSidewalk
 from .model.simple_way import SimpleWay
 from .model.crossing import Crossing
+from .model.input_index import InputIndex
+from .model.geometry_context import GeometryContext
 from .normalization.normalizer import Normalizer
 
 class CrossroadSchematization:
@@ -91,7 +88,15 @@ class CrossroadSchematization:
                  white_space_meter = 1.5, 
                  threshold_small_island = 30,
                  normalizing_angles = 0,
-                 snap_aligned_streets = True):
+                 snap_aligned_streets = True,
+                 debug_sink = None,
+                 region = None,
+                 osm_extract = None,
+                 instrumentation = None,
+                 stage_cache = None,
+                 graph_store = None,
+                 buffered_osm_radius = None,
+                 crop_margin = None):
         self.osm_buffer_size_meters = osm_buffer_size_meters
         self.distance_kerb_footway = distance_kerb_footway
         self.white_space_meter = white_space_meter
@@ -103,12 +108,26 @@ class CrossroadSchematization:
         self.threshold_small_island = threshold_small_island
         self.normalizing_angles = normalizing_angles
         self.snap_aligned_streets = snap_aligned_streets
+        self.buffered_osm_radius = buffered_osm_radius
+        self.crop_margin = crop_margin
+        self.debug_sink = debug_sink if debug_sink is not None else DebugSink()
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.report = None
+        self.region = region
+        self.osm_extract = osm_extract
+        # the stage cache is not used when intermediate geometries are logged
+        self.stage_cache = stage_cache if not self.debug_sink.is_enabled() else None
+        self.graph_store = graph_store
 
-        self.load_osm(osm_oriented, osm_unoriented)
+        self.input_index = InputIndex(cr_input)
+
+        self.load_osm_cached(osm_oriented, osm_unoriented)
+        u.Utils.add_way_compositions(self.osm_input)
+
+        self.geometry_context = GeometryContext(self.osm_input, self.distance_kerb_footway, self.input_index, buffered_osm_radius)
 
         # get crossroad center
-        is_n = cr_input["type"] == "crossroads"
-        self.center = cr_input[is_n]["geometry"][0]
+        self.center = self.input_index.center
 
 
 
@@ -125,27 +144,105 @@ class CrossroadSchematization:
               ignore_cache = False,
               overpass = False,
               log_files = False,
-              threshold_small_island = 30):
+              threshold_small_island = 30,
+              region = None,
+              osm_extract = None,
+              instrumentation = None,
+              G_init = None,
+              stage_cache = None,
+              graph_store = None,
+              buffered_osm_radius = None,
+              crop_margin = None,
+              debug_sink = None):
+
+        if stage_cache is not None and log_files:
+            stage_cache = None
+
+        # the OSM graph can be given (e.g. kept in memory from a previous call)
+        if G_init is None:
+            graph_key = None
+            if stage_cache is not None and region is None and not ignore_cache:
+                graph_key = StageCache.key("osm_graph", latitude, longitude, overpass,
+                                           osm_extract.filename if osm_extract is not None else None)
+                G_init = stage_cache.get(graph_key)
+            if G_init is None:
+                G_init = CrossroadSchematization.load_osm_graph(latitude, longitude, verbose, ignore_cache, overpass, region, osm_extract)
+                if graph_key is not None:
+                    stage_cache.put(graph_key, G_init)
+            elif verbose:
+                print("Using cached OpenStreetMap data")
+        else:
+            graph_key = None
+
+        # segmentation and model
+        cr_input = None
+        if stage_cache is not None:
+            model_key = StageCache.key(graph_key if graph_key is not None else StageCache.hash_graph(G_init),
+                                       "input_model", latitude, longitude, C0, C1, C2, similar_direction_angle)
+            cr_input = stage_cache.get(model_key)
+            if cr_input is not None and verbose:
+                print("Using cached segmentation and model")
+        if cr_input is None:
+            cr_input = CrossroadSchematization.build_input_model(G_init, latitude, longitude, C0, C1, C2,
+                                                                 similar_direction_angle, verbose, log_files)
+            if stage_cache is not None:
+                stage_cache.put(model_key, cr_input)
 
-        import crseg.segmentation as cseg
+        return CrossroadSchematization(cr_input, G_init, 
+                                        ignore_crossings_for_sidewalks=ignore_crossings_for_sidewalks, 
+                                        use_fixed_width_on_branches=use_fixed_width_on_branches,
+                                        turn_shape=turn_shape,
+                                        remove_doubled_crossings=remove_doubled_crossings,
+                                        threshold_small_island=threshold_small_island,
+                                        normalizing_angles=normalizing_angles,
+                                        snap_aligned_streets=snap_aligned_streets,
+                                        debug_sink=debug_sink if debug_sink is not None else (GeometryDebugSink() if log_files else None),
+                                        region=region,
+                                        osm_extract=osm_extract,
+                                        instrumentation=instrumentation,
+                                        stage_cache=stage_cache,
+                                        graph_store=graph_store,
+                                        buffered_osm_radius=buffered_osm_radius,
+                                        crop_margin=crop_margin)
+
+
+    # load the OSM graph around the given coordinates, from a shared region,
+    # a local extract, or the OSM api
+    def load_osm_graph(latitude, longitude, verbose = True, ignore_cache = False, overpass = False, region = None, osm_extract = None):
         import crseg.utils as cru
-        import crmodel.crmodel as cm
         import osmnx as ox
-        from copy import deepcopy
-        import os
 
         # load data from OSM
         if verbose:
             print("Loading data from OpenStreetMap")
         ox.settings.use_cache = not ignore_cache
         ox.settings.useful_tags_node = list(set(ox.settings.useful_tags_node + CrossroadSchematization.node_tags_to_keep))
-        G_init = cru.Util.get_osm_data(latitude, longitude, 300, overpass)#, ["cycleway", "cycleway:right", "cycleway:left", "psv"])
+        if region is not None:
+            # use the data previously loaded for a larger region
+            G_init = region.get_graph(latitude, longitude, 300)
+        elif osm_extract is not None:
+            # use a local OSM extract
+            G_init = osm_extract.get_graph(latitude, longitude, 300, overpass)
+        else:
+            G_init = cru.Util.get_osm_data(latitude, longitude, 300, overpass)#, ["cycleway", "cycleway:right", "cycleway:left", "psv"])
+
+        return G_init
+
+
+    # segment the crossroad and build the input model (crdesc) of the schematization
+    def build_input_model(G_init, latitude, longitude, C0, C1, C2, similar_direction_angle = 60, verbose = True, log_files = False):
+        import crseg.segmentation as cseg
+        import crmodel.crmodel as cm
+        import osmnx as ox
+        import geopandas
 
         # segment intersection(from https://github.com/jmtrivial/crossroads-segmentation)
         if verbose:
             print("Segmenting intersection")
-        # remove sidewalks, cycleways, service ways
-        G = cseg.Segmentation.prepare_network(deepcopy(G_init))
+        # remove sidewalks, cycleways, service ways. prepare_network only removes edges and nodes
+        # from its parameter, then builds a new graph: a copy of the structure of G_init is enough
+        # to leave it unchanged
+        G = cseg.Segmentation.prepare_network(G_init.copy())
         # build an undirected version of the graph
         undirected_G = ox.utils_graph.get_undirected(G)
 
@@ -153,132 +250,317 @@ class CrossroadSchematization:
         seg = cseg.Segmentation(undirected_G, C0 = C0, C1 = C1, C2 = C2, max_cycle_elements = 10, similar_direction_angle = similar_direction_angle)
         seg.process()
 
-        tmp1 = tempfile.NamedTemporaryFile(mode='w', delete=False)
-        seg.to_json(tmp1.name, longitude, latitude)
+        segmentation = [x.to_json_data() for x in seg.get_crossroad(longitude, latitude)]
+
         # convert it as a model (from https://gitlab.limos.fr/jeremyk6/crossroads-description)
         print("Converting graph as a model")
 
         model = cm.CrModel()
-        model.computeModel(G, tmp1.name)
-
         if log_files:
+            tmp1 = tempfile.NamedTemporaryFile(mode='w', suffix=".json", delete=False)
+            with tmp1 as fp:
+                json.dump(segmentation, fp)
+            model.computeModel(G, tmp1.name)
             print("Segmentation:", tmp1.name)
         else:
-            os.unlink(tmp1.name)
+            CrossroadSchematization.compute_model_in_memory(model, G, segmentation)
 
-        # save this model as a temporary file
-        tmp2 = tempfile.NamedTemporaryFile(mode='w', delete=False)
-        with tmp2 as fp:
-            content = model.getGeoJSON()
-            fp.write(content)
-            fp.close()
-
-        cr_input = geopandas.read_file(tmp2.name)
+        # build the input GeoDataFrame directly from the model
+        content = model.getGeoJSON()
+        cr_input = geopandas.GeoDataFrame.from_features(json.loads(content)["features"], crs="EPSG:4326")
 
         if log_files:
+            tmp2 = tempfile.NamedTemporaryFile(mode='w', suffix=".geojson", delete=False)
+            with tmp2 as fp:
+                fp.write(content)
             print("Model:", tmp2.name)
-        else:
-            os.unlink(tmp2.name)
 
-        return CrossroadSchematization(cr_input, G_init, 
-                                        ignore_crossings_for_sidewalks=ignore_crossings_for_sidewalks, 
-                                        use_fixed_width_on_branches=use_fixed_width_on_branches,
-                                        turn_shape=turn_shape,
-                                        remove_doubled_crossings=remove_doubled_crossings,
-                                        threshold_small_island=threshold_small_island,
-                                        normalizing_angles=normalizing_angles,
-                                        snap_aligned_streets=snap_aligned_streets)
+        return cr_input
+
+
+    # crmodel only reads the segmentation from a file: an anonymous in-memory file
+    # is used where available (Linux), and a temporary file otherwise
+    def compute_model_in_memory(model, G, segmentation):
+        if hasattr(os, "memfd_create"):
+            fd = os.memfd_create("segmentation")
+            try:
+                with os.fdopen(fd, "w", closefd=False) as fp:
+                    json.dump(segmentation, fp)
+                model.computeModel(G, "/proc/self/fd/" + str(fd))
+            finally:
+                os.close(fd)
+        else:
+            tmp = tempfile.NamedTemporaryFile(mode='w', suffix=".json", delete=False)
+            try:
+                with tmp as fp:
+                    json.dump(segmentation, fp)
+                model.computeModel(G, tmp.name)
+            finally:
+                os.unlink(tmp.name)
 
     def is_valid_model(self):
-        for index, elem in self.cr_input.iterrows():
-            if elem["type"] in ["branch", "way"]:                
-                for side in ["left", "right"]:
-                    for obj in ["_island", "_sidewalk"]:
-                        key = side + obj
-                        if not (isinstance(elem[key], float) or elem[key] is None):
-                            print(key, "=", elem[key])
-                            return False
+        for e in self.input_index.get_edges():
+            for side in ["left", "right"]:
+                for obj in ["_island", "_sidewalk"]:
+                    key = side + obj
+                    if not (isinstance(e.tags[key], float) or e.tags[key] is None):
+                        print(key, "=", e.tags[key])
+                        return False
 
 
             
         return True
 
 
-    def process(self):
-        self.label_osm_from_input()
-        
+    # attributes of the schematization modified by the stages of process(), saved in the stage cache
+    stage_attributes = ["cr_input", "input_index", "osm_input", "osm_input_oriented", "geometry_context",
+                        "branches", "sidewalks", "crossings", "merged_sidewalks", "inner_region", "traffic_islands"]
+
+    # debug_name: name of the file of the intermediate geometries (if they are logged)
+    def process(self, debug_name = None):
+        try:
+            self.process_stages()
+        finally:
+            # write intermediate geometries (if required), even if a stage failed
+            debug_file = self.debug_sink.flush(debug_name)
+            if debug_file is not None:
+                print("Intermediate geometries:", debug_file)
+
+
+    def process_stages(self):
+        instrumentation = self.instrumentation
+        instrumentation.start(self.center.y, self.center.x)
+
+        def label_osm_from_input(stage):
+            self.label_osm_from_input()
+            stage.count("nodes", len(self.osm_input.nodes))
+            stage.count("edges", len(self.osm_input.edges))
+
+        # keep only the part of the OSM graph around the crossroad
+        def crop_osm(stage):
+            if self.crop_margin is not None:
+                self.crop_osm(self.crop_margin)
+            stage.count("nodes", len(self.osm_input.nodes))
+
         # grouping ways by branch
-        print("Creating branches")
-        self.build_branches()
+        def build_branches(stage):
+            self.build_branches()
+            stage.count("branches", len(self.branches))
 
-        print("Geometry normalization")
-        if self.normalizing_angles != 0 or self.snap_aligned_streets:
-            self.normalize_geometry()
+        def normalize_geometry(stage):
+            if self.normalizing_angles != 0 or self.snap_aligned_streets:
+                self.normalize_geometry()
 
         # compute for each branch two long edges *S1* and *S2* corresponding to the sidewalks:
-        print("Creating sidewalks")
-        self.build_sidewalks()
+        def build_sidewalks(stage):
+            self.build_sidewalks()
 
         # add pedestrian crossings
-        print("Creating crossings")
-        self.crossings = Crossing.create_crossings(self.osm_input, self.cr_input, 
-                                                     self.osm_input_oriented,
-                                                     self.distance_kerb_footway,
-                                                     self.remove_doubled_crossings)
+        def create_crossings(stage):
+            self.crossings = Crossing.create_crossings(self.osm_input, self.input_index, 
+                                                         self.osm_input_oriented,
+                                                         self.distance_kerb_footway,
+                                                         self.remove_doubled_crossings,
+                                                         self.geometry_context.get_crossing_nodes_index())
+            stage.count("crossings", len(self.crossings))
 
         # assemble sidewalks
-        print("Assembling sidewalks")
-        self.assemble_sidewalks()
+        def assemble_sidewalks(stage):
+            self.assemble_sidewalks()
+            stage.count("sidewalks", len(self.merged_sidewalks))
 
         # compute inner region 
-        print("Computing inner region")
-        self.build_inner_region()
+        def build_inner_region(stage):
+            self.build_inner_region()
 
         # filtering crossings
-        print("Filtering crossings")
-        self.filter_crossings()
+        def filter_crossings(stage):
+            self.filter_crossings()
+            stage.count("crossings", len(self.crossings))
 
         # build traffic islands
-        print("Building traffic islands")
-        self.build_traffic_islands()
+        def build_traffic_islands(stage):
+            self.build_traffic_islands()
+            stage.count("islands", len(self.traffic_islands))
 
-        print("Computing traffic island shape")
         # compute traffic island shape
-        for island in self.traffic_islands:
-            island.compute_generalization(self.crossings, self.inner_region)
+        def compute_generalization(stage):
+            for island in self.traffic_islands:
+                island.compute_generalization(self.crossings, self.inner_region)
+            stage.count("islands", len(self.traffic_islands))
+
+        # name, message, function, and parameters used by each stage (in addition
+        # to the input and to the results of the previous stages)
+        stages = [("label_osm_from_input", None, label_osm_from_input, [self.distance_kerb_footway]),
+                  ("crop_osm", "Cropping OSM network" if self.crop_margin is not None else None, crop_osm, [self.crop_margin]),
+                  ("build_branches", "Creating branches", build_branches, []),
+                  ("normalize_geometry", "Geometry normalization", normalize_geometry, [self.normalizing_angles, self.snap_aligned_streets]),
+                  ("build_sidewalks", "Creating sidewalks", build_sidewalks, [self.use_fixed_width_on_branches]),
+                  ("create_crossings", "Creating crossings", create_crossings, [self.remove_doubled_crossings]),
+                  ("assemble_sidewalks", "Assembling sidewalks", assemble_sidewalks, [self.ignore_crossings_for_sidewalks, str(self.turn_shape), self.buffered_osm_radius]),
+                  ("build_inner_region", "Computing inner region", build_inner_region, []),
+                  ("filter_crossings", "Filtering crossings", filter_crossings, []),
+                  ("build_traffic_islands", "Building traffic islands", build_traffic_islands, [self.threshold_small_island]),
+                  ("compute_generalization", "Computing traffic island shape", compute_generalization, [])]
+
+        keys = None
+        first = 0
+        if self.stage_cache is not None and self.input_key is not None:
+            keys = []
+            for name, message, function, parameters in stages:
+                keys.append(StageCache.key(keys[-1] if len(keys) != 0 else self.input_key, name, parameters))
+            with instrumentation.stage("restore_stage_cache") as stage:
+                first = self.restore_stages(keys)
+                stage.count("stages", first)
+            if first != 0:
+                print("Using cached results up to stage", stages[first - 1][0])
+
+        for i, (name, message, function, parameters) in enumerate(stages):
+            if i < first:
+                continue
+            if message is not None:
+                print(message)
+            with instrumentation.stage(name) as stage:
+                function(stage)
+            if keys is not None:
+                self.stage_cache.put(keys[i], self.get_stage_state())
+
+        self.report = instrumentation.finish()
+
+
+    def get_stage_state(self):
+        return dict([(a, getattr(self, a)) for a in CrossroadSchematization.stage_attributes if hasattr(self, a)])
+
+
+    # restore the results of the last stage available in the cache, and return the number of stages restored
+    def restore_stages(self, keys):
+        for i in reversed(range(len(keys))):
+            if self.stage_cache.contains(keys[i]):
+                state = self.stage_cache.get(keys[i])
+                if state is not None:
+                    for a, value in state.items():
+                        setattr(self, a, value)
+                    # the restored context has been created with the parameters of another run
+                    if "geometry_context" in state:
+                        self.geometry_context.buffered_osm_radius = self.buffered_osm_radius
+                        self.geometry_context.invalidate()
+                    return i + 1
+        return 0
+
+
+    # load_osm, using the projected graph store, or the stage cache. The key of the projected
+    # graph and the input model is the first key of the stages of process()
+    def load_osm_cached(self, osm_oriented, osm_unoriented):
+        self.input_key = None
+        if (self.stage_cache is None and self.graph_store is None) or self.region is not None or osm_unoriented is not None:
+            self.load_osm(osm_oriented, osm_unoriented)
+            return
+
+        if osm_oriented is not None:
+            source = StageCache.hash_graph(osm_oriented)
+        else:
+            source = (tuple(self.cr_input.total_bounds), self.osm_extract.filename if self.osm_extract is not None else None)
+        graph_key = StageCache.key(source, "projected_graph", self.osm_buffer_size_meters)
+        if self.graph_store is not None:
+            graphs = self.graph_store.load(graph_key)
+        else:
+            graphs = self.stage_cache.get(graph_key)
+        if graphs is None:
+            self.load_osm(osm_oriented, osm_unoriented)
+            if self.graph_store is not None:
+                self.graph_store.save(graph_key, self.osm_input_oriented, self.osm_input)
+            else:
+                self.stage_cache.put(graph_key, (self.osm_input_oriented, self.osm_input))
+        else:
+            print("Using cached projected OpenStreetMap data")
+            self.osm_input_oriented, self.osm_input = graphs
+
+        if self.stage_cache is not None:
+            self.input_key = StageCache.key(graph_key, "input", self.cr_input.to_json())
 
 
     def filter_crossings(self):
-        def function_is_inside(pair):
-            return pair[1].is_inside(self.inner_region)
-        self.crossings = dict(filter(function_is_inside, self.crossings.items()))
+        import shapely
+
+        # test all the crossings at once, with the prepared region
+        nodes = list(self.crossings.keys())
+        coords = u.Utils.get_nodes_coordinates(self.osm_input, nodes)
+        shapely.prepare(self.inner_region)
+        inside = shapely.contains_xy(self.inner_region, coords[:, 0], coords[:, 1])
+        self.crossings = dict([(n, self.crossings[n]) for n, i in zip(nodes, inside.tolist()) if i])
 
     def load_osm(self, osm_oriented, osm_unoriented):
+        import osmnx
+        import crseg.segmentation as cseg
+
         # load OSM data from the same crossroad (osmnx:graph)
         bounds = self.cr_input.total_bounds
         center = [(bounds[1] + bounds[3]) / 2, (bounds[0] + bounds[2]) / 2]
 
-        if osm_oriented is None:
-            print("Loading OpenStreetMap data " + str(center))
-            osmnx.settings.use_cache = True
-            osmnx.settings.useful_tags_node = list(set(osmnx.settings.useful_tags_node + CrossroadSchematization.node_tags_to_keep))
-            self.osm_input_oriented = osmnx.graph.graph_from_point(center, 
-                                                                   self.osm_buffer_size_meters, 
-                                                                   network_type="all", 
-                                                                   retain_all=False, 
-                                                                   truncate_by_edge=True, 
-                                                                   simplify=False)
+        if self.region is not None:
+            # the region has already been projected to Lambert93
+            if osm_oriented is None:
+                print("Loading OpenStreetMap data from region " + str(center))
+                # as osmnx.graph.graph_from_point below, only the largest component is kept
+                self.osm_input_oriented = self.region.get_projected_graph(center[0], center[1], self.osm_buffer_size_meters, retain_all=False)
+            else:
+                self.osm_input_oriented = cseg.Segmentation.prepare_network(self.region.get_projected_subgraph(osm_oriented), remove_footways=False, keep_all_components=True)
         else:
-            self.osm_input_oriented = cseg.Segmentation.prepare_network(copy.deepcopy(osm_oriented), remove_footways=False, keep_all_components=True)
-
-        # project to Lambert93 (France) for a metric approximation
-        self.osm_input_oriented = osmnx.projection.project_graph(self.osm_input_oriented, to_crs = "EPSG:2154")
-
+            if osm_oriented is None and self.osm_extract is not None:
+                print("Loading OpenStreetMap data " + str(center) + " from " + self.osm_extract.filename)
+                osmnx.settings.useful_tags_node = list(set(osmnx.settings.useful_tags_node + CrossroadSchematization.node_tags_to_keep))
+                # as osmnx.graph.graph_from_point below
+                self.osm_input_oriented = self.osm_extract.get_graph(center[0], center[1], self.osm_buffer_size_meters, overpass=True)
+            elif osm_oriented is None:
+                print("Loading OpenStreetMap data " + str(center))
+                osmnx.settings.use_cache = True
+                osmnx.settings.useful_tags_node = list(set(osmnx.settings.useful_tags_node + CrossroadSchematization.node_tags_to_keep))
+                self.osm_input_oriented = osmnx.graph.graph_from_point(center, 
+                                                                       self.osm_buffer_size_meters, 
+                                                                       network_type="all", 
+                                                                       retain_all=False, 
+                                                                       truncate_by_edge=True, 
+                                                                       simplify=False)
+            else:
+                # (the given graph is not modified, see build_input_model)
+                self.osm_input_oriented = cseg.Segmentation.prepare_network(osm_oriented.copy(), remove_footways=False, keep_all_components=True)
+
+            # project to Lambert93 (France) for a metric approximation
+            self.osm_input_oriented = osmnx.projection.project_graph(self.osm_input_oriented, to_crs = "EPSG:2154")
+
+        # the undirected graph is labelled and its coordinates are normalized by process():
+        # it is always a graph owned by this schematization
         if osm_unoriented is None:
             # convert to undirected graph
             self.osm_input = osmnx.utils_graph.get_undirected(self.osm_input_oriented)
         else:
-            self.osm_input = osm_unoriented
+            self.osm_input = osm_unoriented.copy()
+
+
+    # remove the nodes of the OSM graph far from the input model: only the nodes in its bounding box
+    # (extended by the given margin) are kept, with their neighbours, and the nodes used to close
+    # the traffic islands. The graph is modified in place (it is shared with the geometry context)
+    def crop_osm(self, margin):
+        input_nodes = [n for n in self.input_index.node_ids.tolist() if n in self.osm_input]
+        if len(input_nodes) == 0:
+            return
+
+        store = u.Utils.get_coordinate_store(self.osm_input)
+        coords = store.get_coordinates(input_nodes)
+        minimum = coords.min(axis=0) - margin
+        maximum = coords.max(axis=0) + margin
+        inside = np.all((store.coords >= minimum) & (store.coords <= maximum), axis=1)
+        kept = set([n for n, i in zip(store.node_ids, inside.tolist()) if i])
+
+        # islands are closed using the OSM graph (see TrafficIsland.get_polygon)
+        for edgelist in self.get_traffic_islands_edges().values():
+            kept.update(TrafficIsland.get_polygon(edgelist, self.osm_input))
+
+        for n in list(kept):
+            kept.update(self.osm_input[n])
+
+        self.osm_input.remove_nodes_from([n for n in store.node_ids if not n in kept])
+        self.geometry_context.invalidate()
 
 
     def label_osm_from_input(self):
@@ -287,13 +569,12 @@ class CrossroadSchematization:
         networkx.set_edge_attributes(self.osm_input, values="unknown", name="type")
         networkx.set_edge_attributes(self.osm_input, values="created", name="type_origin")
         networkx.set_node_attributes(self.osm_input, values="unknown", name="type")
-        for index, elem in self.cr_input.iterrows():
-            if elem["type"] in ["branch", "way"]:
-                ids = list(map(int, elem["osm_node_ids"]))
-                self.osm_input[ids[0]][ids[1]][0]["type"] = elem["type"]
-                self.osm_input[ids[0]][ids[1]][0]["type_origin"] = "input"
-                self.osm_input.nodes[ids[0]]["type"] = "input"
-                self.osm_input.nodes[ids[1]]["type"] = "input"
+        for e in self.input_index.get_edges():
+            ids = e.osm_node_ids
+            self.osm_input[ids[0]][ids[1]][0]["type"] = e.type
+            self.osm_input[ids[0]][ids[1]][0]["type_origin"] = "input"
+            self.osm_input.nodes[ids[0]]["type"] = "input"
+            self.osm_input.nodes[ids[1]]["type"] = "input"
 
 
     def is_boundary_node(self, node):
@@ -314,20 +595,18 @@ class CrossroadSchematization:
         self.branches = {}
 
         bid = 0
-        for index, elem in self.cr_input.iterrows():
-            if elem["type"] == "branch":
-                ids = list(map(int, elem["osm_node_ids"]))
-                osm_n1 = ids[0] # first id in the OSM direction
-                osm_n2 = ids[1] # last id in the OSM direction
-                n1 = osm_n1 if self.is_boundary_node(osm_n1) else osm_n2
-                n2 = osm_n2 if n1 == osm_n1 else osm_n1
-                e = u.Utils.get_initial_edge_tags(self.cr_input, osm_n1, osm_n2)
-                if e is not None:
-                    id = e["id"]
-                    bname = e["name"]
-                    if not id in self.branches:
-                        self.branches[id] = Branch(bname, id, self.osm_input, self.cr_input, self.distance_kerb_footway)
-                    self.branches[id].add_way(SimpleWay(n1, n2, e, osm_n1 == n1))
+        for edge in self.input_index.get_edges(("branch",)):
+            osm_n1 = edge.osm_node_ids[0] # first id in the OSM direction
+            osm_n2 = edge.osm_node_ids[1] # last id in the OSM direction
+            n1 = osm_n1 if self.is_boundary_node(osm_n1) else osm_n2
+            n2 = osm_n2 if n1 == osm_n1 else osm_n1
+            e = self.input_index.get_edge_tags(osm_n1, osm_n2)
+            if e is not None:
+                id = e["id"]
+                bname = e["name"]
+                if not id in self.branches:
+                    self.branches[id] = Branch(bname, id, self.osm_input, self.input_index, self.distance_kerb_footway, self.geometry_context)
+                self.branches[id].add_way(SimpleWay(n1, n2, e, osm_n1 == n1))
 
 
     def normalize_geometry(self):
@@ -374,20 +653,25 @@ class CrossroadSchematization:
 
 
     def assemble_sidewalks(self):
-        self.cr_input.replace('', np.nan, inplace=True)
+        self.input_index.replace('', np.nan)
         original_sidewalks_ids = self.get_sidewalk_ids()
         self.merged_sidewalks = []
 
         # TODO: find crossings that should be part of the sidewalks and
         # integrate them to the final shape
 
+        if self.debug_sink.is_enabled():
+            self.debug_sink.add("buffered_osm", self.geometry_context.get_buffered_osm())
+
         for sid in original_sidewalks_ids:
             self.merged_sidewalks.append(TurningSidewalk(sid,
                                                             self.get_sidewalks_by_id(sid), 
                                                             self.get_crossings_by_sidewalks_ids(sid),
-                                                            self.osm_input, self.cr_input, self.distance_kerb_footway,
+                                                            self.osm_input, self.input_index, self.geometry_context,
+                                                            self.distance_kerb_footway,
                                                             self.ignore_crossings_for_sidewalks,
-                                                            self.turn_shape))
+                                                            self.turn_shape,
+                                                            self.debug_sink))
 
 
     def build_inner_region(self):
@@ -419,47 +703,55 @@ class CrossroadSchematization:
         self.inner_region = Polygon(final_shape)
 
 
-    def build_traffic_islands(self):
-        traffic_islands_edges = {}
+    # edges of the input model grouped by island id
+    def get_traffic_islands_edges(self):
+        return self.input_index.get_islands()
+
 
+    def build_traffic_islands(self):
         # first group edges by island id
-        for index, elem in self.cr_input.iterrows():
-            if elem["type"] in ["branch", "way"]:
-                for side in ["left", "right"]:
-                    id = u.Utils.get_number_from_label(elem[side + "_island"])
-                    if not id is None:
-                        if not id in traffic_islands_edges:
-                            traffic_islands_edges[id] = []
-                        traffic_islands_edges[id].append(";".join(elem["osm_node_ids"]))
+        traffic_islands_edges = self.get_traffic_islands_edges()
         
         # then build traffic islands
         self.traffic_islands = []
         for eid in traffic_islands_edges:
-            self.traffic_islands.append(TrafficIsland(eid, traffic_islands_edges[eid], self.osm_input, self.cr_input, 
+            self.traffic_islands.append(TrafficIsland(eid, traffic_islands_edges[eid], self.osm_input, self.input_index, 
                                 self.crossings, self.distance_kerb_footway, self.threshold_small_island))
 
 
     def getMapnikMap(self, dirName, resolution, scale, layout, marginCM):
-        widthMeter = layout.width(marginCM / 100)
-        heightMeter = layout.height(marginCM / 100)
-
-        width = int(m2px(widthMeter, resolution))
-        height = int(m2px(heightMeter, resolution))
+        import mapnik
 
         mapfile = dirName + "/style-" + str(resolution) + ".xml"
 
         pseudo_mercator = mapnik.Projection('+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 +lon_0=0.0 +x_0=0.0 +y_0=0 +k=1.0 +units=m +nadgrids=@null +no_defs +over')
-        mercator = mapnik.Projection('+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs')
-        trans = mapnik.ProjTransform(mercator, pseudo_mercator)
-
 
         # make a new Map object for the given mapfile
-        m = mapnik.Map(width, height)
+        m = mapnik.Map(1, 1)
         mapnik.load_map(m, mapfile)
 
         # ensure the target map projection is pseudo-mercator
         m.srs = pseudo_mercator.params()
 
+        self.setMapnikMapView(m, resolution, scale, layout, marginCM)
+
+        return m
+
+
+    # set the size of the map and center it on the crossroad
+    def setMapnikMapView(self, m, resolution, scale, layout, marginCM):
+        import mapnik
+        from mapnik.printing.conversions import m2px
+
+        widthMeter = layout.width(marginCM / 100)
+        heightMeter = layout.height(marginCM / 100)
+
+        m.resize(int(m2px(widthMeter, resolution)), int(m2px(heightMeter, resolution)))
+
+        pseudo_mercator = mapnik.Projection(m.srs)
+        mercator = mapnik.Projection('+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs')
+        trans = mapnik.ProjTransform(mercator, pseudo_mercator)
+
         # get crossroads center
 
         pmerc_centre = trans.forward(mapnik.Coord(self.center.x, self.center.y))
@@ -475,8 +767,6 @@ class CrossroadSchematization:
         bounds = mapnik.Box2d(minx, pmerc_centre.y - 10, maxx, pmerc_centre.y + 10) # the y bounds will be fixed by mapnik due to ADJUST_BBOX_HEIGHT
         m.zoom_to_box(bounds)
 
-        return m
-
 
     def create_style_tmp_directory(self, resolution, scale, only_reachable_islands, log_files):
         # first export to shapefiles in a temporary directory
@@ -501,14 +791,8 @@ class CrossroadSchematization:
         return dirName
 
 
-    def toPdf(self, filename, log_files = False, resolution = 300, scale = 400, layout=Layout.A5_portrait, margin=1, only_reachable_islands = False):
-        # first export to shapefiles in a temporary directory
-        dirName = self.create_style_tmp_directory(resolution, scale, only_reachable_islands, log_files)
-        if dirName == "":
-            return
-        
-        # get the mapnik map
-        m = self.getMapnikMap(dirName, resolution, scale, layout, margin)
+    def toPdfInternal(self, m, filename, resolution, layout):
+        import mapnik.printing
 
         # render the map image to a file
         page = mapnik.printing.PDFPrinter(pagesize=layout.page_size(), margin=0, resolution=resolution)
@@ -520,9 +804,10 @@ class CrossroadSchematization:
         page.add_geospatial_pdf_header(m, filename, epsg=4326)
 
 
-    def toTifInternal(self, dirName, filename, log_files, resolution, scale, layout, marginCM):
-        # get the mapnik map
-        m = self.getMapnikMap(dirName, resolution, scale, layout, marginCM)
+    def toTifInternal(self, m, filename, resolution, scale):
+        import mapnik
+        from mapnik.printing.conversions import m2px
+        from osgeo import gdal, osr
 
         # render the map image to a file
         mapnik.render_to_file(m, filename)
@@ -554,38 +839,126 @@ class CrossroadSchematization:
         ds.SetProjection(wkt)
 
 
-    def toTif(self, filename, log_files = False, resolution = 300, scale = 400, layout=Layout.A5_portrait, margin=1, only_reachable_islands = False):
-        # first export to shapefiles in a temporary directory
-        dirName = self.create_style_tmp_directory(resolution, scale, only_reachable_islands, log_files)
-        if dirName == "":
-            return
+    def toSvgInternal(self, m, filename):
+        import mapnik
 
-        # finally render the image
-        self.toTifInternal(dirName, filename, log_files, resolution, scale, layout, margin)
+        # render the map image to a file
+        mapnik.render_to_file(m, filename)
 
-        # then delete the temporary directory
-        if not log_files:
-            shutil.rmtree(dirName)
-        
 
-    def toSvg(self, filename, log_files = False, resolution = 300, scale = 400, layout=Layout.A5_portrait, margin=1, only_reachable_islands = False):
-        # first export to shapefiles in a temporary directory
-        dirName = self.create_style_tmp_directory(resolution, scale, only_reachable_islands, log_files)
-        if dirName == "":
-            return
-        
-        # get the mapnik map
-        m = self.getMapnikMap(dirName, resolution, scale, layout, margin)
+    def toPdf(self, filename, log_files = False, resolution = 300, scale = 400, layout=Layout.A5_portrait, margin=1, only_reachable_islands = False):
+        return self.export_all([{"filename": filename, "format": "pdf"}], log_files, resolution, scale, layout, margin, only_reachable_islands, verbose=False)
 
-        # render the map image to a file
-        mapnik.render_to_file(m, filename)
+
+    def toTif(self, filename, log_files = False, resolution = 300, scale = 400, layout=Layout.A5_portrait, margin=1, only_reachable_islands = False):
+        return self.export_all([{"filename": filename, "format": "tif"}], log_files, resolution, scale, layout, margin, only_reachable_islands, verbose=False)
+
+
+    def toSvg(self, filename, log_files = False, resolution = 300, scale = 400, layout=Layout.A5_portrait, margin=1, only_reachable_islands = False):
+        return self.export_all([{"filename": filename, "format": "svg"}], log_files, resolution, scale, layout, margin, only_reachable_islands, verbose=False)
+
+
+    export_formats = ["pdf", "tif", "svg", "geojson", "shp"]
+    styled_formats = ["pdf", "tif", "svg"]
+
+    def get_export_format(filename):
+        for f in CrossroadSchematization.export_formats:
+            if filename.endswith("." + f):
+                return f
+        return None
+
+
+    # export using the format given by the extension of the file name
+    def export(self, filename, log_files = False, resolution = 300, scale = 400, layout=Layout.A5_portrait, margin=1, only_reachable_islands = False):
+        return self.export_all([filename], log_files, resolution, scale, layout, margin, only_reachable_islands)
+
+
+    # export to several files at once. Each target is either a file name (the format is given
+    # by its extension), or a dictionary with a "filename" and optionally "format", "resolution",
+    # "scale", "layout" and "margin" that replace the default parameters for this target.
+    # The styled workspace (shapefiles, style and symbols) is created once per (resolution, scale),
+    # and the mapnik map is loaded once per (resolution, scale, layout, margin), then all the
+    # corresponding targets are rendered from it.
+    # With a MapnikMapCache, the workspaces and the maps are kept for the next crossroads.
+    def export_all(self, targets, log_files = False, resolution = 300, scale = 400, layout=Layout.A5_portrait, margin=1, only_reachable_islands = False, verbose = True, map_cache = None):
+        success = True
+        styled = {}
+
+        for target in targets:
+            if isinstance(target, str):
+                target = {"filename": target}
+            filename = target["filename"]
+            format = target.get("format", CrossroadSchematization.get_export_format(filename))
+
+            if format in CrossroadSchematization.styled_formats:
+                key = (target.get("resolution", resolution), target.get("scale", scale),
+                       target.get("layout", layout), target.get("margin", margin))
+                styled.setdefault(key, []).append((filename, format))
+                continue
+
+            if verbose and format is not None:
+                print("Exporting as " + format + ":", filename)
+            if format == "geojson":
+                self.toGeojson(filename, only_reachable_islands)
+            elif format == "shp":
+                self.toShapefiles(filename, only_reachable_islands)
+            else:
+                print("Unknown output format:", filename)
+                success = False
+
+        workspaces = {}
+        try:
+            for (t_resolution, t_scale, t_layout, t_margin), files in styled.items():
+                if not (t_resolution, t_scale) in workspaces:
+                    if map_cache is not None:
+                        workspaces[(t_resolution, t_scale)] = map_cache.get_workspace(self, t_resolution, t_scale, only_reachable_islands, log_files)
+                    else:
+                        workspaces[(t_resolution, t_scale)] = self.create_style_tmp_directory(t_resolution, t_scale, only_reachable_islands, log_files)
+                dirName = workspaces[(t_resolution, t_scale)]
+                if dirName == "":
+                    success = False
+                    continue
+
+                # get the mapnik map
+                if map_cache is not None:
+                    m = map_cache.get_map(self, dirName, t_resolution, t_scale, t_layout, t_margin)
+                else:
+                    m = self.getMapnikMap(dirName, t_resolution, t_scale, t_layout, t_margin)
+
+                # the pdf printer adjusts the map to the page, so pdf files are rendered last,
+                # and the next ones are rendered from a newly loaded map
+                nb_pdf = 0
+                for filename, format in sorted(files, key=lambda f: f[1] == "pdf"):
+                    if verbose:
+                        print("Exporting as " + format + ":", filename)
+                    if format == "pdf":
+                        if nb_pdf != 0:
+                            m = self.getMapnikMap(dirName, t_resolution, t_scale, t_layout, t_margin)
+                        self.toPdfInternal(m, filename, t_resolution, t_layout)
+                        nb_pdf += 1
+                    elif format == "tif":
+                        self.toTifInternal(m, filename, t_resolution, t_scale)
+                    else:
+                        self.toSvgInternal(m, filename)
+        finally:
+            # then delete the temporary directories (the workspaces of a cache are kept)
+            if not log_files and map_cache is None:
+                for dirName in workspaces.values():
+                    if dirName != "":
+                        shutil.rmtree(dirName)
+
+        return success
 
 
     def toGDFInnerRegion(self):
+        import geopandas
+
         d = {'type': ['inner_region'], 'geometry': [self.inner_region]}
         return geopandas.GeoDataFrame(d, crs=2154)
 
     def toGDFOuterRegion(self):
+        import geopandas
+
         bbox = self.inner_region.bounds
         area = affinity.scale(box(*bbox), 1.1, 1.1)
         outer = area.difference(self.inner_region.buffer(0))
@@ -595,6 +968,8 @@ class CrossroadSchematization:
 
 
     def toGeojson(self, filename, only_reachable_islands = False, crs = "EPSG:4326"):
+        import pandas
+
         df = pandas.concat([self.toGDFInnerRegion().to_crs(crs),
                             TurningSidewalk.toGDFSidewalks(self.merged_sidewalks).to_crs(crs),
                             Branch.toGDFBranches(self.branches).to_crs(crs),
@@ -632,6 +1007,9 @@ class CrossroadSchematization:
              crossings = True,
              islands = True,
              only_reachable_islands = True):
+        import geopandas
+        import matplotlib.pyplot as plt
+
         colors = [ 'r', 'y', 'b', 'g', "orange", 'purple', 'b']
 
         if inner_region:
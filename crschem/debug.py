@@ -0,0 +1,64 @@
+import os
+import tempfile
+
+
+class DebugSink:
+
+    # default sink: intermediate geometries are ignored
+    def is_enabled(self):
+        return False
+
+
+    def add(self, layer, geometry, **properties):
+        pass
+
+
+    def flush(self, name = None):
+        return None
+
+
+
+class GeometryDebugSink(DebugSink):
+
+    # intermediate geometries are collected in memory, then written
+    # in a single GeoPackage per crossroad (one layer per kind of geometry),
+    # all of them in the same directory. A single sink is created per run, and
+    # shared by all its crossroads (the directory is created at once, so that
+    # the copies of the sink given to worker processes use the same one)
+    def __init__(self, directory = None, crs = 2154):
+        self.directory = directory if directory is not None else tempfile.mkdtemp(prefix="crschem-debug-")
+        self.crs = crs
+        self.layers = {}
+        self.nb_files = 0
+
+
+    def is_enabled(self):
+        return True
+
+
+    def add(self, layer, geometry, **properties):
+        if not layer in self.layers:
+            self.layers[layer] = []
+        self.layers[layer].append(dict(properties, geometry=geometry))
+
+
+    def flush(self, name = None):
+        import geopandas
+
+        if len(self.layers) == 0:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        if name is None:
+            name = "crossroad-" + str(self.nb_files)
+        filename = os.path.join(self.directory, name + ".gpkg")
+
+        for layer in self.layers:
+            gdf = geopandas.GeoDataFrame(self.layers[layer], geometry="geometry", crs=self.crs)
+            gdf.to_file(filename, layer=layer, driver="GPKG")
+
+        self.layers = {}
+        self.nb_files += 1
+
+        return filename
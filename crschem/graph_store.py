@@ -0,0 +1,238 @@
+import json
+import numbers
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class ProjectedGraphStore:
+
+    # projected OSM graphs (oriented and undirected) of the crossroads, stored in a compact
+    # binary format, and memory-mapped when loaded. Each entry is a directory containing:
+    # - the node ids (in the order of the graph) and the edges as CSR arrays (for each node,
+    #   the index of the first of its outgoing edges, then the index of the target node and
+    #   the key of each edge), in the order of the adjacency of the graph;
+    # - the numerical attributes (coordinates, lengths, ...) as columns;
+    # - the other attributes as indices in tables of distinct tags (stored in json).
+    # Least recently used entries are removed when the size of the store (in bytes) is exceeded.
+    def __init__(self, directory, max_size = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key)
+
+
+    def contains(self, key):
+        return os.path.exists(os.path.join(self.get_path(key), "graph.json"))
+
+
+    # json-compatible version of a tag value (geometries are stored as WKB)
+    def encode_value(value):
+        if hasattr(value, "wkb_hex"):
+            return {"wkb": value.wkb_hex}
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, (list, tuple)):
+            return [ProjectedGraphStore.encode_value(v) for v in value]
+        return value
+
+
+    def decode_value(value):
+        if isinstance(value, dict) and "wkb" in value:
+            import shapely.wkb
+            return shapely.wkb.loads(value["wkb"], hex=True)
+        return value
+
+
+    # type of column used to store an attribute value: "int", "float", "linestring" or None (stored as a tag)
+    def get_column_type(value):
+        if isinstance(value, (bool, np.bool_)):
+            return None
+        if isinstance(value, numbers.Integral):
+            return "int"
+        if isinstance(value, numbers.Number):
+            return "float"
+        if getattr(value, "geom_type", None) == "LineString":
+            return "linestring"
+        return None
+
+
+    # split attributes into columns (numbers and linestrings) and a table of distinct tags
+    def encode_attributes(path, prefix, attributes):
+        import shapely
+
+        columns = {}
+        for data in attributes:
+            for k, v in data.items():
+                t = ProjectedGraphStore.get_column_type(v)
+                if not k in columns:
+                    columns[k] = t
+                elif columns[k] != t:
+                    # integers and floats are stored as floats
+                    columns[k] = "float" if set([columns[k], t]) == set(["int", "float"]) else None
+        columns = [(k, t) for k, t in columns.items() if t is not None]
+
+        for i, (k, t) in enumerate(columns):
+            missing = np.array([not k in data for data in attributes], dtype=bool)
+            if missing.any():
+                np.save(os.path.join(path, prefix + "-missing-" + str(i) + ".npy"), missing)
+            if t == "linestring":
+                coords, index = shapely.get_coordinates(np.array([data[k] for data in attributes if k in data]), return_index=True)
+                np.save(os.path.join(path, prefix + "-column-" + str(i) + ".npy"), coords)
+                np.save(os.path.join(path, prefix + "-column-" + str(i) + "-index.npy"), index)
+            else:
+                values = np.array([data.get(k, 0) for data in attributes], dtype=np.int64 if t == "int" else np.float64)
+                np.save(os.path.join(path, prefix + "-column-" + str(i) + ".npy"), values)
+
+        column_names = set([k for k, t in columns])
+        tags = {}
+        table = []
+        indices = np.empty(len(attributes), dtype=np.int32)
+        for i, data in enumerate(attributes):
+            t = json.dumps(dict([(k, ProjectedGraphStore.encode_value(v)) for k, v in data.items() if not k in column_names]), sort_keys=True)
+            if not t in tags:
+                tags[t] = len(table)
+                table.append(t)
+            indices[i] = tags[t]
+        np.save(os.path.join(path, prefix + "-tags.npy"), indices)
+
+        return {"columns": [[k, t] for k, t in columns], "tags": [json.loads(t) for t in table]}
+
+
+    def decode_attributes(path, prefix, description):
+        table = [dict([(k, ProjectedGraphStore.decode_value(v)) for k, v in t.items()]) for t in description["tags"]]
+        indices = np.load(os.path.join(path, prefix + "-tags.npy"), mmap_mode="r").tolist()
+        attributes = [dict(table[i]) for i in indices]
+
+        for i, (k, t) in enumerate(description["columns"]):
+            values = np.load(os.path.join(path, prefix + "-column-" + str(i) + ".npy"), mmap_mode="r")
+            if t == "linestring":
+                import shapely
+                index = np.load(os.path.join(path, prefix + "-column-" + str(i) + "-index.npy"), mmap_mode="r")
+                values = shapely.linestrings(values, indices=index).tolist()
+            else:
+                values = values.tolist()
+            missing_file = os.path.join(path, prefix + "-missing-" + str(i) + ".npy")
+            if os.path.exists(missing_file):
+                present = [data for data, m in zip(attributes, np.load(missing_file, mmap_mode="r").tolist()) if not m]
+                if t != "linestring":
+                    values = [v for v, m in zip(values, np.load(missing_file, mmap_mode="r").tolist()) if not m]
+                for data, v in zip(present, values):
+                    data[k] = v
+            else:
+                for data, v in zip(attributes, values):
+                    data[k] = v
+        return attributes
+
+
+    def encode_graph(path, prefix, G, node_index):
+        indptr = np.zeros(len(G.nodes) + 1, dtype=np.int64)
+        targets = []
+        keys = []
+        attributes = []
+        # each edge of an undirected graph is stored once, when it is first seen
+        seen = set()
+        for i, (n, neighbours) in enumerate(G.adjacency()):
+            for m, edges in neighbours.items():
+                for k, data in edges.items():
+                    if not G.is_directed():
+                        if (m, n, k) in seen:
+                            continue
+                        seen.add((n, m, k))
+                    targets.append(node_index[m])
+                    keys.append(k)
+                    attributes.append(data)
+            indptr[i + 1] = len(targets)
+
+        np.save(os.path.join(path, prefix + "-indptr.npy"), indptr)
+        np.save(os.path.join(path, prefix + "-indices.npy"), np.array(targets, dtype=np.int32))
+        np.save(os.path.join(path, prefix + "-keys.npy"), np.array(keys, dtype=np.int32))
+        return {"directed": G.is_directed(),
+                "graph": dict([(k, ProjectedGraphStore.encode_value(v) if not k == "crs" else str(v)) for k, v in G.graph.items()]),
+                "edges": ProjectedGraphStore.encode_attributes(path, prefix + "-edges", attributes)}
+
+
+    def decode_graph(path, prefix, description, node_ids, node_attributes):
+        import networkx
+
+        G = networkx.MultiDiGraph() if description["directed"] else networkx.MultiGraph()
+        G.graph.update(description["graph"])
+        G.add_nodes_from(zip(node_ids, [dict(data) for data in node_attributes]))
+
+        indptr = np.load(os.path.join(path, prefix + "-indptr.npy"), mmap_mode="r").tolist()
+        targets = np.load(os.path.join(path, prefix + "-indices.npy"), mmap_mode="r").tolist()
+        keys = np.load(os.path.join(path, prefix + "-keys.npy"), mmap_mode="r").tolist()
+        attributes = ProjectedGraphStore.decode_attributes(path, prefix + "-edges", description["edges"])
+
+        sources = [None] * len(targets)
+        for i, n in enumerate(node_ids):
+            sources[indptr[i]:indptr[i + 1]] = [n] * (indptr[i + 1] - indptr[i])
+        G.add_edges_from(zip(sources, [node_ids[t] for t in targets], keys, attributes))
+        return G
+
+
+    # return the oriented and undirected graphs stored with the given key, or None
+    def load(self, key):
+        path = self.get_path(key)
+        try:
+            with open(os.path.join(path, "graph.json")) as f:
+                description = json.load(f)
+            node_ids = np.load(os.path.join(path, "nodes.npy"), mmap_mode="r").tolist()
+            node_attributes = ProjectedGraphStore.decode_attributes(path, "nodes", description["nodes"])
+            oriented = ProjectedGraphStore.decode_graph(path, "oriented", description["oriented"], node_ids, node_attributes)
+            undirected = ProjectedGraphStore.decode_graph(path, "undirected", description["undirected"], node_ids, node_attributes)
+        except (OSError, ValueError, KeyError):
+            return None
+        # the modification time is used for the eviction
+        os.utime(path)
+        return oriented, undirected
+
+
+    # both graphs share the same nodes (the undirected graph is built from the oriented one)
+    def save(self, key, oriented, undirected):
+        if self.contains(key) or list(oriented.nodes(data=True)) != list(undirected.nodes(data=True)):
+            return
+
+        # written in a temporary directory then moved, so that concurrent readers never see a partial entry
+        path = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            node_ids = list(oriented.nodes)
+            node_index = dict([(n, i) for i, n in enumerate(node_ids)])
+            np.save(os.path.join(path, "nodes.npy"), np.array(node_ids, dtype=np.int64))
+            description = {"nodes": ProjectedGraphStore.encode_attributes(path, "nodes", [data for n, data in oriented.nodes(data=True)]),
+                           "oriented": ProjectedGraphStore.encode_graph(path, "oriented", oriented, node_index),
+                           "undirected": ProjectedGraphStore.encode_graph(path, "undirected", undirected, node_index)}
+            with open(os.path.join(path, "graph.json"), "w") as f:
+                json.dump(description, f)
+            os.rename(path, self.get_path(key))
+        except OSError:
+            # e.g. the entry has been written by another process
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        except TypeError:
+            # a tag cannot be stored
+            shutil.rmtree(path, ignore_errors=True)
+            return
+
+        self.evict()
+
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum([os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)])
+            entries.append((os.path.getmtime(path), size, path))
+        total = sum([e[1] for e in entries])
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,168 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class StageMeasure:
+
+    # measures of a single stage of the pipeline: wall time and CPU time (in seconds),
+    # peak of memory allocated during the stage (in bytes, None if memory is not traced),
+    # and counts of the elements produced by the stage
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0
+        self.cpu_time = 0
+        self.peak_memory = None
+        self.counts = {}
+
+
+    def count(self, name, value):
+        self.counts[name] = value
+
+
+    def to_dict(self):
+        return {"name": self.name,
+                "wall_time": self.wall_time,
+                "cpu_time": self.cpu_time,
+                "peak_memory": self.peak_memory,
+                "counts": dict(self.counts)}
+
+
+
+class ProcessReport:
+
+    # measures of all the stages of a CrossroadSchematization.process() call
+    def __init__(self, latitude = None, longitude = None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.stages = []
+
+
+    def get_stage(self, name):
+        for s in self.stages:
+            if s.name == name:
+                return s
+        return None
+
+
+    def get_wall_time(self):
+        return sum([s.wall_time for s in self.stages])
+
+
+    def get_cpu_time(self):
+        return sum([s.cpu_time for s in self.stages])
+
+
+    def get_peak_memory(self):
+        peaks = [s.peak_memory for s in self.stages if s.peak_memory is not None]
+        return max(peaks) if len(peaks) != 0 else None
+
+
+    def to_dict(self):
+        return {"latitude": self.latitude,
+                "longitude": self.longitude,
+                "wall_time": self.get_wall_time(),
+                "cpu_time": self.get_cpu_time(),
+                "peak_memory": self.get_peak_memory(),
+                "stages": [s.to_dict() for s in self.stages]}
+
+
+    def print(self):
+        print("{:<28} {:>10} {:>10} {:>12}  {}".format("stage", "wall (s)", "cpu (s)", "peak (kB)", "counts"))
+        for s in self.stages:
+            peak = "-" if s.peak_memory is None else "{:.0f}".format(s.peak_memory / 1024)
+            counts = ", ".join([k + "=" + str(v) for k, v in s.counts.items()])
+            print("{:<28} {:>10.4f} {:>10.4f} {:>12}  {}".format(s.name, s.wall_time, s.cpu_time, peak, counts))
+        print("{:<28} {:>10.4f} {:>10.4f}".format("total", self.get_wall_time(), self.get_cpu_time()))
+
+
+
+class JSONLinesSink:
+
+    # each report is appended as a single line of a JSON file
+    def __init__(self, filename):
+        self.filename = filename
+
+
+    def write(self, report):
+        with open(self.filename, "a") as f:
+            f.write(json.dumps(report.to_dict()) + "\n")
+
+
+
+class Instrumentation:
+
+    # default instrumentation: nothing is measured
+    class NullStage:
+        def count(self, name, value):
+            pass
+
+    null_stage = NullStage()
+
+    def is_enabled(self):
+        return False
+
+
+    def start(self, latitude = None, longitude = None):
+        pass
+
+
+    @contextmanager
+    def stage(self, name):
+        yield Instrumentation.null_stage
+
+
+    def finish(self):
+        return None
+
+
+
+class ProcessInstrumentation(Instrumentation):
+
+    # measures each stage of the pipeline. Memory is traced using tracemalloc
+    # (which slows the process down), and can be disabled.
+    # If a sink is given, each report is written to it at the end of the process.
+    def __init__(self, sink = None, trace_memory = True):
+        self.sink = sink
+        self.trace_memory = trace_memory
+        self.report = None
+        self.started_tracing = False
+
+
+    def is_enabled(self):
+        return True
+
+
+    def start(self, latitude = None, longitude = None):
+        self.report = ProcessReport(latitude, longitude)
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+
+    @contextmanager
+    def stage(self, name):
+        measure = StageMeasure(name)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield measure
+        finally:
+            measure.wall_time = time.perf_counter() - wall_start
+            measure.cpu_time = time.process_time() - cpu_start
+            if self.trace_memory:
+                measure.peak_memory = tracemalloc.get_traced_memory()[1] - memory_start
+            self.report.stages.append(measure)
+
+
+    def finish(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        if self.sink is not None:
+            self.sink.write(self.report)
+        return self.report
@@ -0,0 +1,59 @@
+import os
+import shutil
+import xml.etree.ElementTree as ET
+
+
+class MapnikMapCache:
+
+    # mapnik maps kept between the exports of successive crossroads (e.g. by the worker daemon):
+    # the style, the symbols and the layers are loaded once per (resolution, scale, layout, margin).
+    # Each (resolution, scale) has a persistent workspace where the shapefiles of the current
+    # crossroad are written, then only the datasources of the layers are reloaded, and the
+    # map is centered on the new crossroad.
+    # Maps are not shared between threads: exports using the same cache must be sequential.
+    def __init__(self):
+        self.workspaces = {}
+        self.maps = {}
+        self.layer_files = {}
+
+
+    # shapefiles used by each layer of the style, in the order of the layers
+    def get_layer_files(mapfile):
+        return [layer.find("Datasource/Parameter[@name='file']").text for layer in ET.parse(mapfile).getroot().iter("Layer")]
+
+
+    def get_workspace(self, crschem, resolution, scale, only_reachable_islands, log_files = False):
+        key = (resolution, scale)
+        if not key in self.workspaces:
+            dirName = crschem.create_style_tmp_directory(resolution, scale, only_reachable_islands, log_files)
+            if dirName == "":
+                return ""
+            self.workspaces[key] = dirName
+        else:
+            crschem.toShapefiles(self.workspaces[key] + "/crossroad.shp", only_reachable_islands)
+        return self.workspaces[key]
+
+
+    def get_map(self, crschem, dirName, resolution, scale, layout, marginCM):
+        import mapnik
+
+        key = (resolution, scale, layout, marginCM)
+        if not key in self.maps:
+            self.maps[key] = crschem.getMapnikMap(dirName, resolution, scale, layout, marginCM)
+            self.layer_files[key] = MapnikMapCache.get_layer_files(dirName + "/style-" + str(resolution) + ".xml")
+            return self.maps[key]
+
+        # the shapefiles have been replaced: reopen them
+        m = self.maps[key]
+        for layer, f in zip(m.layers, self.layer_files[key]):
+            layer.datasource = mapnik.Shapefile(file=os.path.join(dirName, f))
+        crschem.setMapnikMapView(m, resolution, scale, layout, marginCM)
+        return m
+
+
+    def close(self):
+        for dirName in self.workspaces.values():
+            shutil.rmtree(dirName, ignore_errors=True)
+        self.workspaces = {}
+        self.maps = {}
+        self.layer_files = {}
@@ -1,6 +1,5 @@
 from shapely.geometry import Point, LineString
-
-import geopandas
+import shapely.ops
 
 
 from .. import utils as u
@@ -13,13 +12,14 @@ from .straight_sidewalk import StraightSidewalk
 
 class Branch:
 
-    def __init__(self, name, id, osm_input, cr_input, distance_kerb_footway):
+    def __init__(self, name, id, osm_input, input_index, distance_kerb_footway, geometry_context):
         self.ways = []
         self.name = name
         self.id = id
         self.osm_input = osm_input
-        self.cr_input = cr_input
+        self.input_index = input_index
         self.distance_kerb_footway = distance_kerb_footway
+        self.geometry_context = geometry_context
         self.middle_line = None
         self.widths = None
 
@@ -35,12 +35,7 @@ class Branch:
     # return all the edges contained in the initial intersection
     # that are not part of this branch
     def get_other_edges(self):
-        result = []
-        for index, elem in self.cr_input.iterrows():
-            if elem["type"] in ["branch", "way"] and elem["name"] != self.name:
-                ids = list(map(int, elem["osm_node_ids"]))
-                result.append(ids)
-        return result
+        return [list(e.osm_node_ids) for e in self.input_index.get_edges() if e.name != self.name]
 
 
     def shift_middle_line(self, shifts, direction):
@@ -63,9 +58,13 @@ class Branch:
                                    self.sides[1],
                                    "right")]
 
-        # shift them if required
-        buf = u.Utils.get_edges_buffered_by_osm(self.get_other_edges(), self.osm_input, self.distance_kerb_footway).boundary
+        # shift them if required: only the other edges (buffered) intersecting the sidewalk are used
+        index = self.geometry_context.get_input_edges_index()
         for i, s in enumerate(result):
+            others = [index.geometries[j] for j in index.query(s.edge, "intersects") if index.items[j][0] != self.name]
+            if len(others) == 0:
+                continue
+            buf = shapely.ops.unary_union(others).boundary
             if s.edge.intersects(buf):
                 intersections = s.edge.intersection(buf)
                 if not intersections.is_empty and isinstance(intersections, Point):
@@ -108,8 +107,8 @@ class Branch:
 
             # for each point estimate the width of the way
             interdistance = u.Utils.edge_length(p1, p2)
-            w1 = u.Utils.evaluate_width_way(self.osm_input[e1[0]][e1[1]][0]) / 2 + self.distance_kerb_footway
-            w2 = u.Utils.evaluate_width_way(self.osm_input[e2[0]][e2[1]][0]) / 2 + self.distance_kerb_footway
+            w1 = u.Utils.get_width_way(self.osm_input[e1[0]][e1[1]][0]) / 2 + self.distance_kerb_footway
+            w2 = u.Utils.get_width_way(self.osm_input[e2[0]][e2[1]][0]) / 2 + self.distance_kerb_footway
 
             # compute the final width
             self.widths.append(interdistance + w1 + w2)
@@ -181,6 +180,8 @@ class Branch:
 
 
     def toGDFBranches(branches):
+        import geopandas
+
         d = {'type': [], 'osm_id': [], 'geometry': []}
 
         for bid in branches:
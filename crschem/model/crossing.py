@@ -1,9 +1,7 @@
 import math
 from shapely.geometry import Point
-import geopandas
 
 from .. import utils as u
-from crseg.utils import Util as ucr
 
 class Crossing:
 
@@ -12,12 +10,12 @@ class Crossing:
     # If there is an island in one side, this sidewalk comes first.
     # If there are two islands, they are ordered in increasing ID order.
 
-    def __init__(self, node_id, osm_input, cr_input, osm_input_oriented, distance_kerb_footway):
+    def __init__(self, node_id, osm_input, input_index, osm_input_oriented, distance_kerb_footway):
 
         self.node_id = node_id
 
         self.osm_input = osm_input
-        self.cr_input = cr_input
+        self.input_index = input_index
         self.osm_input_oriented = osm_input_oriented
         self.distance_kerb_footway = distance_kerb_footway
 
@@ -92,7 +90,7 @@ class Crossing:
         next_node = self.roadway_nodes[idx]
         
         # get tags
-        tags = u.Utils.get_initial_edge_tags(self.cr_input, self.node_id, next_node, True)
+        tags = self.input_index.get_edge_tags(self.node_id, next_node, True)
 
         if tags is None:
             # if tags are not defined, the crossing is located in border of the input segmentation, we choose the 
@@ -101,7 +99,7 @@ class Crossing:
             idx = positive_angles.index(max(positive_angles))
             next_node = self.roadway_nodes[idx]
 
-            tags = u.Utils.get_initial_edge_tags(self.cr_input, self.node_id, next_node, True)
+            tags = self.input_index.get_edge_tags(self.node_id, next_node, True)
 
             side = "left" if str(next_node) != str(tags["osm_node_ids"][0]) else "right"
 
@@ -200,10 +198,10 @@ class Crossing:
         for nw in ways:
             if nw in self.osm_input[self.node_id]:
                 edge = self.osm_input[self.node_id][nw][0]
-                nb_b, nb_f, w = u.Utils.evaluate_way_composition(edge)
+                nb_b, nb_f, w = u.Utils.get_way_composition(edge)
             else:
                 edge = self.osm_input[nw][self.node_id][0]
-                nb_f, nb_b, w = u.Utils.evaluate_way_composition(edge)
+                nb_f, nb_b, w = u.Utils.get_way_composition(edge)
             nb_backward += nb_b
             nb_forward += nb_f
             total_width += w * (nb_f + nb_b)
@@ -258,16 +256,27 @@ class Crossing:
 
 
     def build_vectors(self, nodes):
-        return [u.Utils.normalized_vector(self.osm_input.nodes[self.node_id], self.osm_input.nodes[n]) for n in nodes]
+        coords = u.Utils.get_nodes_coordinates(self.osm_input, [self.node_id] + list(nodes))
+        vectors = u.Utils.normalized_vectors(coords[0], coords[1:])
+        return [None if math.isnan(v[0]) else v for v in vectors]
 
 
-    def has_adjacent_crossing(osm_input, cr_input, node, radius = 7):
+    # if a spatial index of the crossing nodes is given, paths are only explored
+    # when a crossing is close to the node
+    def has_adjacent_crossing(osm_input, input_index, node, radius = 7, crossing_nodes_index = None):
+        from crseg.utils import Util as ucr
+
         if len(osm_input[node]) != 2:
             return False
 
+        if crossing_nodes_index is not None:
+            location = Point(osm_input.nodes[node]["x"], osm_input.nodes[node]["y"])
+            if len([n for n in crossing_nodes_index.query_items(location, "dwithin", radius) if n != node]) == 0:
+                return False
+
         # check for all nodes near to the given node
         for n in sum([ucr.get_path_to_biffurcation(osm_input, node, x) for x in osm_input[node]], []):
-            if n != node and Crossing.is_crossing(n, cr_input):
+            if n != node and Crossing.is_crossing(n, input_index):
                 distance = u.Utils.edge_length(osm_input.nodes[n], osm_input.nodes[node])
                 if distance < radius:
                     return True
@@ -278,9 +287,9 @@ class Crossing:
     def is_crossing_osm(node, osm_input):
         return ("highway" in osm_input.nodes[node] and osm_input.nodes[node]["highway"] == "crossing") or ("crossing" in osm_input.nodes[node])
 
-    def create_crossings(osm_input, cr_input, osm_input_oriented, distance_kerb_footway, remove_doubled_crossings):
-        crossings = dict([(n, Crossing(n, osm_input, cr_input, osm_input_oriented, distance_kerb_footway)) for n in osm_input.nodes if 
-                      osm_input.nodes[n]["type"] == "input" and Crossing.is_crossing(n, cr_input) and Crossing.is_crossing_osm(n, osm_input)])
+    def create_crossings(osm_input, input_index, osm_input_oriented, distance_kerb_footway, remove_doubled_crossings, crossing_nodes_index = None):
+        crossings = dict([(n, Crossing(n, osm_input, input_index, osm_input_oriented, distance_kerb_footway)) for n in osm_input.nodes if 
+                      osm_input.nodes[n]["type"] == "input" and Crossing.is_crossing(n, input_index) and Crossing.is_crossing_osm(n, osm_input)])
 
         if remove_doubled_crossings:
             print("Removing double crossings")
@@ -288,17 +297,13 @@ class Crossing:
             for n in list(crossings.keys()):
                 # if this crossing is on a traffic light node
                 if "highway" in osm_input.nodes[n] and osm_input.nodes[n]["highway"] == "traffic_signals":
-                    if Crossing.has_adjacent_crossing(osm_input, cr_input, n):
+                    if Crossing.has_adjacent_crossing(osm_input, input_index, n, crossing_nodes_index=crossing_nodes_index):
                         del crossings[n]
 
         return crossings
 
-    def is_inside(self, region):
-        return region.contains(Point(Point(self.osm_input.nodes[self.node_id]["x"], self.osm_input.nodes[self.node_id]["y"])))
-
-    def is_crossing(node, cr_input):
-        tags = u.Utils.get_initial_node_tags(cr_input, node)
-        return tags and tags["type"] == "crosswalk"
+    def is_crossing(node, input_index):
+        return input_index.is_crosswalk(node)
 
 
     def get_line_representation(self, length = 1):
@@ -392,6 +397,8 @@ class Crossing:
 
 
     def toGDFCrossings(crossings, details = True):
+        import geopandas
+
         d = {'type': [], 
              'osm_id': [],
              'geometry': [],
@@ -0,0 +1,92 @@
+from shapely.geometry import Point
+
+from .. import utils as u
+from .spatial_index import SpatialIndex
+
+
+class GeometryContext:
+
+    # geometries and spatial indices shared by all the elements of a crossroad. They are
+    # computed on demand, and kept until the coordinates of the OSM graph are modified.
+    # If a radius is given, the buffered OSM graph only contains the edges within this
+    # distance from the center of the crossroad (far edges never shape the sidewalks)
+    def __init__(self, osm_input, distance_kerb_footway, input_index = None, buffered_osm_radius = None):
+        self.osm_input = osm_input
+        self.distance_kerb_footway = distance_kerb_footway
+        self.input_index = input_index
+        self.buffered_osm_radius = buffered_osm_radius
+        self.invalidate()
+
+
+    def invalidate(self):
+        self.version = None
+        self.center = None
+        self.buffered_osm = None
+        self.buffered_osm_boundary = None
+        self.input_edges_index = None
+        self.crossing_nodes_index = None
+
+
+    def update_version(self):
+        version = u.Utils.get_coordinates_version(self.osm_input)
+        if version != self.version:
+            self.invalidate()
+            self.version = version
+
+
+    # center of the crossroad: mean location of the nodes of the input model
+    def get_center(self):
+        self.update_version()
+        if self.center is None:
+            nodes = self.input_index.node_ids.tolist()
+            self.center = tuple(u.Utils.get_nodes_coordinates(self.osm_input, nodes).mean(axis=0).tolist())
+        return self.center
+
+
+    # union of all the roadway edges, buffered by their width. The geometry is
+    # prepared, since it is tested against many lines
+    def get_buffered_osm(self):
+        import shapely
+
+        self.update_version()
+        if self.buffered_osm is None:
+            if self.buffered_osm_radius is None:
+                self.buffered_osm = u.Utils.get_buffered_osm(self.osm_input, self.distance_kerb_footway)
+            else:
+                self.buffered_osm = u.Utils.get_buffered_osm(self.osm_input, self.distance_kerb_footway, self.get_center(), self.buffered_osm_radius)
+            shapely.prepare(self.buffered_osm)
+        return self.buffered_osm
+
+
+    def get_buffered_osm_boundary(self):
+        import shapely
+
+        self.update_version()
+        if self.buffered_osm_boundary is None:
+            self.buffered_osm_boundary = self.get_buffered_osm().boundary
+            shapely.prepare(self.buffered_osm_boundary)
+        return self.buffered_osm_boundary
+
+
+    # edges of the input model (branches and ways), buffered by their width. Items are
+    # (name, osm node ids) pairs, in the order of the input model
+    def get_input_edges_index(self):
+        self.update_version()
+        if self.input_edges_index is None:
+            items = [(e.name, list(e.osm_node_ids)) for e in self.input_index.get_edges()]
+            edges = [ids for name, ids in items]
+            widths = [u.Utils.get_edge_width_by_osm(n1, n2, self.osm_input, self.distance_kerb_footway) for n1, n2 in edges]
+            self.input_edges_index = SpatialIndex(u.Utils.get_buffered_edges(self.osm_input, edges, widths), items)
+        return self.input_edges_index
+
+
+    # nodes of the OSM graph that are crossings in the input model. Items are node ids
+    def get_crossing_nodes_index(self):
+        from .crossing import Crossing
+
+        self.update_version()
+        if self.crossing_nodes_index is None:
+            nodes = [n for n in self.osm_input.nodes if Crossing.is_crossing(n, self.input_index)]
+            coords = u.Utils.get_nodes_coordinates(self.osm_input, nodes)
+            self.crossing_nodes_index = SpatialIndex([Point(c) for c in coords], nodes)
+        return self.crossing_nodes_index
@@ -0,0 +1,139 @@
+import sys
+
+import numpy as np
+
+from .. import utils as u
+
+
+class InputIndex:
+
+    # an edge of the input model (a row of type "branch" or "way")
+    # - type, id, name: interned strings (name can be None or nan)
+    # - osm_node_ids: pair of OSM node ids (int), in the OSM direction
+    # - islands: island ids (int or None) on the left and right sides
+    # - tags: the complete row of the input model
+    class Edge:
+        __slots__ = ("type", "id", "name", "osm_node_ids", "islands", "tags")
+
+        def __init__(self, tags):
+            self.type = InputIndex.intern(tags["type"])
+            self.id = InputIndex.intern(tags.get("id"))
+            self.name = InputIndex.intern(tags.get("name"))
+            self.osm_node_ids = tuple([int(n) for n in tags["osm_node_ids"]])
+            self.islands = tuple([u.Utils.get_number_from_label(tags.get(side + "_island")) for side in ["left", "right"]])
+            self.tags = tags
+
+
+    # a node of the input model (a row with an osm_node_id, e.g. a crossing)
+    class Node:
+        __slots__ = ("type", "osm_node_id", "tags")
+
+        def __init__(self, tags):
+            self.type = InputIndex.intern(tags["type"])
+            self.osm_node_id = int(tags["osm_node_id"])
+            self.tags = tags
+
+
+    # a traffic island of the input model: its id (int) and the edges along it
+    # (pairs of OSM node ids, in the OSM direction)
+    class Island:
+        __slots__ = ("id", "edges")
+
+        def __init__(self, id):
+            self.id = id
+            self.edges = []
+
+
+    # compact version of the input model (cr_input, generated by crdesc), built
+    # once per crossroad: the GeoDataFrame is only used for input and output.
+    # Tags of an edge are available using the pair of OSM node ids (in the OSM
+    # direction), and tags of a node using its OSM node id. The sidewalk tags
+    # are only available in the rows (their empty values are replaced by nan
+    # before assembling the sidewalks, see replace).
+    def __init__(self, cr_input):
+        self.edge_list = []
+        self.node_list = []
+        self.center = None
+        self.edges = {}
+        self.nodes = {}
+
+        has_node_ids = "osm_node_id" in cr_input.columns.tolist()
+
+        for row in cr_input.to_dict("records"):
+            row = dict([(k, InputIndex.intern(v)) for k, v in row.items()])
+            ids = row.get("osm_node_ids")
+            if row["type"] in ["branch", "way"]:
+                self.edge_list.append(InputIndex.Edge(row))
+            elif row["type"] == "crossroads" and self.center is None:
+                self.center = row["geometry"]
+            if has_node_ids and isinstance(row["osm_node_id"], str):
+                self.node_list.append(InputIndex.Node(row))
+            # the first row describing an edge is kept
+            if isinstance(ids, list) and len(ids) == 2:
+                self.edges.setdefault((int(ids[0]), int(ids[1])), row)
+        for n in self.node_list:
+            self.nodes.setdefault(n.osm_node_id, n.tags)
+
+        # traffic islands, in the order of their first edge
+        islands = {}
+        for e in self.edge_list:
+            for id in e.islands:
+                if not id is None:
+                    if not id in islands:
+                        islands[id] = InputIndex.Island(id)
+                    islands[id].edges.append(e.osm_node_ids)
+        self.island_list = list(islands.values())
+
+        self.set_crosswalk_ids()
+
+        # all the OSM nodes used by the edges, sorted
+        self.node_ids = np.unique(np.array([e.osm_node_ids for e in self.edge_list], dtype=np.int64).reshape(-1))
+
+
+    def intern(value):
+        return sys.intern(value) if isinstance(value, str) else value
+
+
+    def get_edges(self, types = ("branch", "way")):
+        return [e for e in self.edge_list if e.type in types]
+
+
+    # OSM ids of the crosswalks (nodes described by a row of type "crosswalk")
+    def set_crosswalk_ids(self):
+        self.crosswalk_ids = set([n for n, tags in self.nodes.items() if tags["type"] == "crosswalk"])
+
+
+    def is_crosswalk(self, osm_n1):
+        return int(osm_n1) in self.crosswalk_ids
+
+
+    # edges (pairs of OSM node ids) of the input model grouped by island id
+    def get_islands(self):
+        return dict([(i.id, i.edges) for i in self.island_list])
+
+
+    def get_edge_tags(self, osm_n1, osm_n2, inverse = False):
+        tags = self.edges.get((int(osm_n1), int(osm_n2)))
+        if tags is None and inverse:
+            tags = self.edges.get((int(osm_n2), int(osm_n1)))
+        return tags
+
+
+    # replace the given value in all the tags (similar to DataFrame.replace,
+    # but the dictionaries previously returned by the index are not modified)
+    def replace(self, to_replace, value):
+        replaced = {}
+
+        def replace_row(row):
+            if id(row) not in replaced:
+                replaced[id(row)] = dict([(k, value if isinstance(v, str) and v == to_replace else v) for k, v in row.items()])
+            return replaced[id(row)]
+
+        self.edges = dict([(k, replace_row(row)) for k, row in self.edges.items()])
+        self.nodes = dict([(k, replace_row(row)) for k, row in self.nodes.items()])
+        for e in self.edge_list + self.node_list:
+            e.tags = replace_row(e.tags)
+            for k in ["type", "id", "name"]:
+                if hasattr(e, k) and isinstance(getattr(e, k), str) and getattr(e, k) == to_replace:
+                    setattr(e, k, value)
+        self.set_crosswalk_ids()
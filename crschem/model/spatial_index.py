@@ -0,0 +1,41 @@
+import numpy as np
+
+
+class SpatialIndex:
+
+    # geometries indexed by a STRtree, each one with an associated item (e.g. a node id,
+    # or an edge). Queries return the indices of the geometries in their initial order,
+    # thus results (and unions built from them) do not depend on the structure of the tree
+    def __init__(self, geometries, items):
+        import shapely
+
+        self.geometries = list(geometries)
+        self.items = list(items)
+        self.tree = shapely.STRtree(self.geometries)
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+    # indices of the geometries satisfying predicate(geometry, indexed geometry),
+    # or with an intersecting bounding box if no predicate is given
+    def query(self, geometry, predicate = None, distance = None):
+        if len(self.items) == 0:
+            return []
+        if predicate == "dwithin":
+            indices = self.tree.query(geometry, predicate=predicate, distance=distance)
+        else:
+            indices = self.tree.query(geometry, predicate=predicate)
+        return np.sort(indices).tolist()
+
+
+    def query_items(self, geometry, predicate = None, distance = None):
+        return [self.items[i] for i in self.query(geometry, predicate, distance)]
+
+
+    # index of the nearest geometry, or None if the index is empty
+    def nearest(self, geometry):
+        if len(self.items) == 0:
+            return None
+        return int(self.tree.nearest(geometry))
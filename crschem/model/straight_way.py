@@ -96,6 +96,6 @@ class StraightWay(SimpleWay):
             return pt, edges[0]
         else:
             # find the edge with the largest estimated width
-            ewidths = [(e, u.Utils.evaluate_width_way(self.G[e[0]][e[1]][0])) for e in edges]
+            ewidths = [(e, u.Utils.get_width_way(self.G[e[0]][e[1]][0])) for e in edges]
             return pt, max(ewidths, key=lambda x: x[1])[0]
         
\ No newline at end of file
@@ -2,12 +2,9 @@ from shapely.geometry import Point, LineString, Polygon, LinearRing, MultiPolygo
 import numpy as np
 import shapely.ops
 from numpy import linalg
-import geopandas
 from enum import Enum
 import math
 
-import copy
-import osmnx
 from more_itertools import locate
 
 from .. import utils as u
@@ -20,11 +17,11 @@ class TrafficIsland:
         lines = 1
         polygon = 2
 
-    def __init__(self, island_id, edgelist, osm_input, cr_input, crossings, distance_kerb_footway = 0.5, threshold_small_island = 30):
+    def __init__(self, island_id, edgelist, osm_input, input_index, crossings, distance_kerb_footway = 0.5, threshold_small_island = 30):
         self.island_id = island_id
-        self.edgelist = [list(map(int, x.split(";"))) for x in edgelist]
+        self.edgelist = edgelist
         self.osm_input = osm_input
-        self.cr_input = cr_input
+        self.input_index = input_index
         self.crossings = crossings
 
         self.significant_ratio = 2
@@ -36,40 +33,45 @@ class TrafficIsland:
 
 
     def build_polygon(self):
+        self.polygon = TrafficIsland.get_polygon(self.edgelist, self.osm_input)
 
-        ledges = copy.deepcopy(self.edgelist)
-        if len(self.edgelist) == 0:
-            self.polygon = []
-            return
+    # polygon (list of nodes) of an island given by its edges (pairs of nodes)
+    def get_polygon(edgelist, osm_input):
 
-        self.polygon = ledges.pop()
+        ledges = [list(e) for e in edgelist]
+        if len(edgelist) == 0:
+            return []
+
+        polygon = ledges.pop()
         
         reverse = False
         while len(ledges) != 0:
-            # find next element in ledges
+            # find next element in ledges
             found = False
             for i, e in enumerate(ledges):
-                if e[0] == self.polygon[-1]:
-                    self.polygon += e[1:]
+                if e[0] == polygon[-1]:
+                    polygon += e[1:]
                     ledges.pop(i)
                     found = True
                     break
-                if e[-1] == self.polygon[-1]:
-                    self.polygon += e[::-1][1:]
+                if e[-1] == polygon[-1]:
+                    polygon += e[::-1][1:]
                     ledges.pop(i)
                     found = True
                     break
             if not found:
                 if reverse:
                     print("Error: cannot merge all edges in a single traffic island")
-                    return
+                    return polygon
                 else:
                     reverse = True
-                    self.polygon = self.polygon[::-1]
+                    polygon = polygon[::-1]
 
         # if the polygon is not closed, a part is missing in the original data (but available in OSM)
-        if self.polygon[0] != self.polygon[-1]:
-            self.polygon = p.Expander.close_polygon(self.osm_input, self.polygon)
+        if polygon[0] != polygon[-1]:
+            polygon = p.Expander.close_polygon(osm_input, polygon)
+
+        return polygon
 
     def build_inner_polygon(self):
         ring = Polygon(self.get_linearring())
@@ -92,6 +94,8 @@ class TrafficIsland:
 
 
     def compute_center_and_radius(self, crossings):
+        import osmnx
+
         local_crossings = [self.crossings[c] for c in crossings if c in self.polygon]
         if len(local_crossings) != 0:
             # use extremity of the crossing
@@ -136,13 +140,15 @@ class TrafficIsland:
             return False
         if j not in self.osm_input[i] or k not in self.osm_input[j]:
             return True
-        tags1 = u.Utils.get_initial_edge_tags(self.cr_input, j, i, True)
-        tags2 = u.Utils.get_initial_edge_tags(self.cr_input, k, j, True)
+        tags1 = self.input_index.get_edge_tags(j, i, True)
+        tags2 = self.input_index.get_edge_tags(k, j, True)
         if tags1 == None or tags2 == None:
             return False
         return (tags1["left_sidewalk"] != "" or tags1["right_sidewalk"] != "") and (tags2["left_sidewalk"] != "" or tags2["right_sidewalk"] != "")
 
     def max_distance_to_center(self, section):
+        import osmnx
+
         sidewalk_section = section
         return max([osmnx.distance.euclidean_dist_vec(self.osm_input.nodes[c]["x"], 
                                                       self.osm_input.nodes[c]["y"],
@@ -346,6 +352,8 @@ class TrafficIsland:
             return [Polygon(self.inner_polygon)]
 
     def toGDFTrafficIslands(traffic_islands, only_reachable = True):
+        import geopandas
+
         d = {'type': [], 'osm_id': [], 'geometry': []}
 
         for t in traffic_islands:
@@ -2,9 +2,10 @@ from shapely.geometry import Point, LineString
 import shapely.ops
 from enum import Enum
 import numpy as np
-import geopandas
 
 from .. import utils as u
+from ..debug import DebugSink
+from .spatial_index import SpatialIndex
 
 class TurningSidewalk:
 
@@ -51,9 +52,10 @@ class TurningSidewalk:
         
 
     def __init__(self, id, str_sidewalks, crossings, 
-                 osm_input, cr_input,
+                 osm_input, input_index, geometry_context,
                  distance_kerb_footway, ignore_crossings_for_sidewalks,
-                 turn_shape = TurnShape.ADJUSTED_ANGLE):
+                 turn_shape = TurnShape.ADJUSTED_ANGLE,
+                 debug_sink = None):
         self.id = id
 
         self.distance_kerb_footway = distance_kerb_footway
@@ -63,7 +65,9 @@ class TurningSidewalk:
         self.crossings = crossings
         
         self.osm_input = osm_input
-        self.cr_input = cr_input
+        self.input_index = input_index
+        self.geometry_context = geometry_context
+        self.debug_sink = debug_sink if debug_sink is not None else DebugSink()
 
         self.epsilon_for_merging = 2
 
@@ -100,7 +104,7 @@ class TurningSidewalk:
 
 
     def is_sidewalk_edge(self, node1, node2):
-        tags = u.Utils.get_initial_edge_tags(self.cr_input, node1, node2, True)
+        tags = self.input_index.get_edge_tags(node1, node2, True)
         return tags != None and (tags["left_sidewalk"] == str(self.id) or tags["right_sidewalk"] == str(self.id))
 
     def find_next_point_on_original_path(self, path):
@@ -134,6 +138,12 @@ class TurningSidewalk:
         # add the final part
         self.original_path += polybranch2[1:]
         self.original_path_linestring = [(self.osm_input.nodes[x]["x"], self.osm_input.nodes[x]["y"]) for x in self.original_path]
+        # coordinates and curvilign location of each point of the path
+        self.original_path_coords = np.array(self.original_path_linestring, dtype=np.float64)
+        coords = self.original_path_coords
+        self.original_path_locations = np.cumsum(np.concatenate([[0], u.Utils.edge_lengths(coords[:-1], coords[1:])]))
+        # segments of the path, for the projections
+        self.original_path_index = SpatialIndex([LineString([c1, c2]) for c1, c2 in zip(coords, coords[1:])], range(len(coords) - 1))
 
 
     def project_on_original_path(self, point):
@@ -141,23 +151,25 @@ class TurningSidewalk:
             p = point.coord
         else:
             p = point
-        nearest = shapely.ops.nearest_points(LineString(self.original_path_linestring), Point(p))
+        # projection on the nearest segment
+        p = Point(p)
+        segment = self.original_path_index.nearest(p)
+        nearest = shapely.ops.nearest_points(self.original_path_index.geometries[segment], p)
         return nearest[0]
 
 
     def estimate_curvilign_location_by_projection(self, point):
         proj = self.project_on_original_path(point)
 
-        location = 0.0
+        p = (proj.x, proj.y)
+        coords = self.original_path_coords
 
-        for x, y in zip(self.original_path_linestring, self.original_path_linestring[1:]):
-            if u.Utils.is_in_edge(proj, x, y):
-                location += u.Utils.edge_length(x, proj)
-                break
-            else:
-                location += u.Utils.edge_length(x, y)
-
-        return location
+        # location of the first edge containing the projection
+        in_edges = np.flatnonzero(u.Utils.are_in_edges(p, coords[:-1], coords[1:]))
+        if len(in_edges) == 0:
+            return float(self.original_path_locations[-1])
+        i = in_edges[0]
+        return float(self.original_path_locations[i] + u.Utils.edge_lengths(coords[i], p))
 
 
     def compute_curvilign_locations(self):
@@ -247,12 +259,7 @@ class TurningSidewalk:
         
 
     def adjust_flexible_points(self):
-        buffered_osm = u.Utils.get_buffered_osm(self.osm_input, self.distance_kerb_footway)
-
-        # DEBUG BEGIN
-        gdr = geopandas.GeoDataFrame({'feature': [0], 'geometry': buffered_osm})
-        gdr.to_file("/tmp/buffered_osm.shp")
-        # DEBUG END
+        buffered_osm = self.geometry_context.get_buffered_osm()
 
         for id_point in range(1, len(self.way) - 1):
             pred = self.way[id_point - 1]
@@ -262,10 +269,7 @@ class TurningSidewalk:
                 middle_bevel = Point([(x + y) / 2 for x, y in zip(pred.coord, next.coord)])
                 middle_extand = self.compute_straight_angle(id_point)
 
-                # DEBUG BEGIN
-                gdr = geopandas.GeoDataFrame({'feature': [0], 'geometry': LineString([pred.coord, next.coord])})
-                gdr.to_file("/tmp/edge" + str(self.id) + "-" + str(id_point) + ".shp")
-                # DEBUG END
+                self.debug_sink.add("edge", LineString([pred.coord, next.coord]), sidewalk=self.id, point=id_point)
 
 
                 if middle_extand is None or u.Utils.is_colinear(middle_extand, pred.coord, next.coord, 1e-1):
@@ -284,15 +288,12 @@ class TurningSidewalk:
                             edge = u.Utils.extends_edge((middle_extand, middle_bevel.coords[0]), 0, 3)
                             line = LineString(edge)
 
-                            # DEBUG BEGIN
-                            gdr = geopandas.GeoDataFrame({'feature': [0], 'geometry': line})
-                            gdr.to_file("/tmp/line" + str(self.id) + "-" + str(id_point) + ".shp")
-                            # DEBUG END
+                            self.debug_sink.add("line", line, sidewalk=self.id, point=id_point)
 
                             if buffered_osm.intersects(line):
                                 # build a more complex turn
                                 
-                                elements = buffered_osm.boundary.intersection(line)
+                                elements = self.geometry_context.get_buffered_osm_boundary().intersection(line)
                                 if not elements.is_empty:
                                     nearest = shapely.ops.nearest_points(middle_bevel, elements)
                                     self.way[id_point].coord = (nearest[1].x, nearest[1].y)
@@ -335,6 +336,8 @@ class TurningSidewalk:
         return ";".join([x.getOSMIds() for x in self.str_sidewalks])
 
     def toGDFSidewalks(sidewalks):
+        import geopandas
+
         d = {'type': [], 'osm_id': [], 'geometry': []}
 
         for s in sidewalks:
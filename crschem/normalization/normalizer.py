@@ -1,10 +1,7 @@
-import shapely.affinity
-from shapely.geometry import Point
 
 from .normalized_branch import NormalizedBranch
 
 import numpy as np
-from scipy.spatial import Delaunay
 import crschem.utils as u
 
 class Normalizer:
@@ -68,7 +65,15 @@ class Normalizer:
 
 
     def adjust_nodes(self, osm_input):
-        new_coords = {}
+        from scipy.spatial import Delaunay
+
+        # coordinates of all the nodes, as an array
+        nodes = list(osm_input.nodes)
+        node_index = dict([(n, i) for i, n in enumerate(nodes)])
+        coords = np.array([(osm_input.nodes[n]["x"], osm_input.nodes[n]["y"]) for n in nodes], dtype=np.float64).reshape(-1, 2)
+
+        new_coords = coords.copy()
+        is_branch_node = np.zeros(len(nodes), dtype=bool)
         branch_nodes = []
         middle_lines_nodes = []
         new_middle_lines_nodes = []
@@ -77,12 +82,14 @@ class Normalizer:
         # if it's inside a branch
         # apply the corresponding transformation
         for b in self.branches:
-            matrix = b.get_transformation_matrix()
-            for n in b.branch.get_all_nodes():
-                node = osm_input.nodes[n]
-                new_loc = shapely.affinity.affine_transform(Point(node['x'], node['y']), matrix)
-                new_coords[n] = [new_loc.x, new_loc.y]
-                branch_nodes.append(n)
+            m = b.get_transformation_matrix()
+            ids = np.array([node_index[n] for n in b.branch.get_all_nodes()], dtype=np.intp)
+            x = coords[ids, 0]
+            y = coords[ids, 1]
+            new_coords[ids, 0] = m[0] * x + m[1] * y + m[4]
+            new_coords[ids, 1] = m[2] * x + m[3] * y + m[5]
+            is_branch_node[ids] = True
+            branch_nodes.append(ids)
 
             # consider also extremity points from the middle line
             middle_lines_nodes.append(b.middle_line.coords[0])
@@ -90,41 +97,36 @@ class Normalizer:
             new_middle_lines_nodes.append(b.get_new_middle_line().coords[0])
             new_middle_lines_nodes.append(b.get_new_middle_line().coords[1])
 
+        branch_nodes = np.concatenate(branch_nodes) if len(branch_nodes) != 0 else np.zeros(0, dtype=np.intp)
 
         # create bounding box nodes
-        bound_nodes = u.Utils.bounding_box_nodes(osm_input, 50)
+        bound_nodes = np.array(u.Utils.bounding_box_nodes(osm_input, 50), dtype=np.float64).reshape(-1, 2)
 
         # then for all other points, we apply a continuous deformation
 
-        # build a Delaunay triangulation of points inside branches (with original coordinates)
-        points = np.array([[osm_input.nodes[n]["x"], osm_input.nodes[n]["y"]] for n in branch_nodes] + bound_nodes + middle_lines_nodes)
+        # build a Delaunay triangulation of points inside branches (with original coordinates),
+        # and the same vertices after deformation
+        points = np.concatenate([coords[branch_nodes], bound_nodes, np.array(middle_lines_nodes).reshape(-1, 2)])
+        new_points = np.concatenate([new_coords[branch_nodes], bound_nodes, np.array(new_middle_lines_nodes).reshape(-1, 2)])
         tri = Delaunay(points)
-        
+
         # for all the other points, compute their coordinate (triangle ID, and barycentric coordinates) in the original triangulation
         # then compute the new coordinate wrt the deformed triangulation
-        other_points = [id for id in osm_input.nodes if id not in branch_nodes]
-        n_other_points = np.array([(osm_input.nodes[n]['x'], osm_input.nodes[n]['y']) for n in other_points])                
-        simplices = tri.find_simplex(n_other_points)
-
-        other_points_simplices = [ (op, s, tri.simplices[s]) for op, s in zip(other_points, simplices) if s >= 0]
-
-        for op, tr, ids in other_points_simplices:
-            point = np.array([(osm_input.nodes[op]["x"], osm_input.nodes[op]["y"])])
-            b = tri.transform[tr, :2].dot(np.transpose(point - tri.transform[tr, 2]))
-            coords = np.c_[np.transpose(b), 1 - b.sum(axis=0)][0]
-            new_tri = [new_coords[branch_nodes[n]] if n < len(branch_nodes) else \
-                       bound_nodes[n - len(branch_nodes)] if n < len(branch_nodes) + 4 else \
-                       new_middle_lines_nodes[n - len(branch_nodes) - 4] for n in ids]
-
-            new_point = [sum([c * t[0] for c, t in zip(coords, new_tri)]), \
-                         sum([c * t[1] for c, t in zip(coords, new_tri)])]
-
-            osm_input.nodes[op]["x"] = new_point[0]
-            osm_input.nodes[op]["y"] = new_point[1]
-
-
-        # finally adjust branch points to their new coordinates
-        for n in branch_nodes:
-            osm_input.nodes[n]["x"] = new_coords[n][0]
-            osm_input.nodes[n]["y"] = new_coords[n][1]
+        other_points = np.flatnonzero(~is_branch_node)
+        simplices = tri.find_simplex(coords[other_points]) if len(other_points) != 0 else np.zeros(0, dtype=np.intp)
+        inside = simplices >= 0
+        other_points = other_points[inside]
+        simplices = simplices[inside]
+
+        transform = tri.transform[simplices]
+        b = np.einsum("nij,nj->ni", transform[:, :2], coords[other_points] - transform[:, 2])
+        barycentric = np.c_[b, 1 - b.sum(axis=1)]
+        new_coords[other_points] = np.einsum("ni,nij->nj", barycentric, new_points[tri.simplices[simplices]])
+
+        # finally move all the adjusted points to their new coordinates
+        for i in np.concatenate([other_points, branch_nodes]):
+            osm_input.nodes[nodes[i]]["x"] = float(new_coords[i, 0])
+            osm_input.nodes[nodes[i]]["y"] = float(new_coords[i, 1])
+
+        u.Utils.touch_coordinates(osm_input)
 
@@ -0,0 +1,213 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import tempfile
+import xml.etree.ElementTree as ET
+
+
+class OSMExtract:
+
+    # a local OSM extract (.osm or .osm.pbf file), used instead of the OSM API or Overpass.
+    # The extract is indexed once in a SQLite database (next to the extract by default)
+    # with an R*Tree on the nodes of the ways, then the neighbourhood of a crossroad
+    # is a local query in this database.
+    # Only the ways matching the osmnx "all" network type are indexed.
+
+    excluded_highways = re.compile("abandoned|construction|no|planned|platform|proposed|raceway|razed")
+
+    # version of the index, increased when the indexed ways change
+    index_version = 2
+
+    def __init__(self, filename, store = None):
+        self.filename = filename
+        self.store = store if store is not None else filename + ".sqlite"
+
+
+    def is_indexed(self):
+        if not os.path.exists(self.store) or os.path.getmtime(self.store) < os.path.getmtime(self.filename):
+            return False
+        db = sqlite3.connect(self.store)
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        db.close()
+        return version == OSMExtract.index_version
+
+
+    # same as the osmnx filter of the "all" network type
+    def is_network_way(tags):
+        if not "highway" in tags:
+            return False
+        if "area" in tags and "yes" in tags["area"]:
+            return False
+        if "access" in tags and "private" in tags["access"]:
+            return False
+        if "service" in tags and "private" in tags["service"]:
+            return False
+        return OSMExtract.excluded_highways.search(tags["highway"]) is None
+
+
+    def index(self, force = False, batch_size = 100000):
+        if self.is_indexed() and not force:
+            return
+
+        print("Indexing OSM extract", self.filename)
+
+        # the database is built in a temporary file, then moved, so that concurrent readers
+        # never see a partial index
+        directory = os.path.dirname(os.path.abspath(self.store))
+        fd, tmp_store = tempfile.mkstemp(suffix=".sqlite", dir=directory)
+        os.close(fd)
+
+        db = sqlite3.connect(tmp_store)
+        db.execute("CREATE TABLE nodes (id INTEGER PRIMARY KEY, lat REAL, lon REAL, tags TEXT)")
+        db.execute("CREATE TABLE ways (id INTEGER PRIMARY KEY, nodes TEXT, tags TEXT)")
+        db.execute("CREATE TABLE way_nodes (node_id INTEGER, way_id INTEGER)")
+
+        nodes = []
+        ways = []
+
+        def add_node(id, lat, lon, tags):
+            nodes.append((id, lat, lon, json.dumps(tags) if len(tags) != 0 else None))
+            if len(nodes) >= batch_size:
+                db.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?)", nodes)
+                nodes.clear()
+
+        def add_way(id, refs, tags):
+            if OSMExtract.is_network_way(tags):
+                ways.append((id, refs, tags))
+                if len(ways) >= batch_size:
+                    flush_ways()
+
+        def flush_ways():
+            db.executemany("INSERT INTO ways VALUES (?, ?, ?)", [(id, json.dumps(refs), json.dumps(tags)) for id, refs, tags in ways])
+            db.executemany("INSERT INTO way_nodes VALUES (?, ?)", [(n, id) for id, refs, tags in ways for n in refs])
+            ways.clear()
+
+        if self.filename.endswith(".pbf"):
+            OSMExtract.read_pbf(self.filename, add_node, add_way)
+        else:
+            OSMExtract.read_xml(self.filename, add_node, add_way)
+
+        db.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?)", nodes)
+        flush_ways()
+
+        # spatial index on the nodes that belong to a way
+        db.execute("CREATE INDEX way_nodes_node ON way_nodes (node_id)")
+        db.execute("CREATE VIRTUAL TABLE node_index USING rtree(id, min_lon, max_lon, min_lat, max_lat)")
+        db.execute("INSERT INTO node_index SELECT id, lon, lon, lat, lat FROM nodes WHERE id IN (SELECT node_id FROM way_nodes)")
+        db.execute("PRAGMA user_version = " + str(OSMExtract.index_version))
+        db.commit()
+        db.close()
+
+        os.replace(tmp_store, self.store)
+
+
+    # the processed elements are removed from the root, so that the memory used
+    # does not grow with the size of the extract
+    def read_xml(filename, add_node, add_way):
+        root = None
+        for event, elem in ET.iterparse(filename, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag == "node":
+                tags = dict([(t.get("k"), t.get("v")) for t in elem.iter("tag")])
+                add_node(int(elem.get("id")), float(elem.get("lat")), float(elem.get("lon")), tags)
+                root.clear()
+            elif elem.tag == "way":
+                tags = dict([(t.get("k"), t.get("v")) for t in elem.iter("tag")])
+                add_way(int(elem.get("id")), [int(nd.get("ref")) for nd in elem.iter("nd")], tags)
+                root.clear()
+            elif elem.tag == "relation":
+                root.clear()
+
+
+    def read_pbf(filename, add_node, add_way):
+        try:
+            import osmium
+        except ImportError:
+            raise ImportError("pyosmium is required to read .osm.pbf extracts (pip install osmium)")
+
+        class Handler(osmium.SimpleHandler):
+            def node(self, n):
+                add_node(n.id, n.location.lat, n.location.lon, dict([(t.k, t.v) for t in n.tags]))
+
+            def way(self, w):
+                add_way(w.id, [nd.ref for nd in w.nodes], dict([(t.k, t.v) for t in w.tags]))
+
+        Handler().apply_file(filename)
+
+
+    def select(db, query, ids, chunk_size = 500):
+        ids = list(ids)
+        result = []
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i:i + chunk_size]
+            result += db.execute(query % ",".join(["?"] * len(chunk)), chunk).fetchall()
+        return result
+
+
+    # write the OSM ways touching the given bounding box (and all their nodes) as an OSM XML file
+    def write_bbox(self, north, south, east, west, filename):
+        self.index()
+
+        db = sqlite3.connect(self.store)
+        node_ids = [r[0] for r in db.execute("SELECT id FROM node_index WHERE min_lon <= ? AND max_lon >= ? AND min_lat <= ? AND max_lat >= ?",
+                                             (east, west, north, south))]
+        way_ids = set([r[0] for r in OSMExtract.select(db, "SELECT way_id FROM way_nodes WHERE node_id IN (%s)", node_ids)])
+        ways = OSMExtract.select(db, "SELECT id, nodes, tags FROM ways WHERE id IN (%s)", way_ids)
+        all_node_ids = set([n for w in ways for n in json.loads(w[1])])
+        nodes = OSMExtract.select(db, "SELECT id, lat, lon, tags FROM nodes WHERE id IN (%s)", all_node_ids)
+        db.close()
+
+        root = ET.Element("osm", version="0.6", generator="crschem")
+        for id, lat, lon, tags in nodes:
+            elem = ET.SubElement(root, "node", id=str(id), lat=repr(lat), lon=repr(lon))
+            if tags is not None:
+                for k, v in json.loads(tags).items():
+                    ET.SubElement(elem, "tag", k=k, v=v)
+        for id, refs, tags in ways:
+            elem = ET.SubElement(root, "way", id=str(id))
+            for n in json.loads(refs):
+                ET.SubElement(elem, "nd", ref=str(n))
+            for k, v in json.loads(tags).items():
+                ET.SubElement(elem, "tag", k=k, v=v)
+        ET.ElementTree(root).write(filename, encoding="utf-8", xml_declaration=True)
+
+
+    def get_graph_bbox(self, north, south, east, west, retain_all = True):
+        import osmnx
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "extract.osm")
+            self.write_bbox(north, south, east, west, filename)
+            return osmnx.graph.graph_from_xml(filename, bidirectional=False, simplify=False, retain_all=retain_all)
+
+
+    # bounding box (north, south, east, west) requested by crseg from the OSM api:
+    # the envelope of a buffer of dist around the point, in pseudo-mercator
+    def get_api_bbox(latitude, longitude, dist):
+        R = 6378137
+        y = R * math.log(math.tan(math.pi / 4 + math.radians(latitude) / 2))
+        dlon = math.degrees(dist / R)
+        return (math.degrees(2 * math.atan(math.exp((y + dist) / R)) - math.pi / 2),
+                math.degrees(2 * math.atan(math.exp((y - dist) / R)) - math.pi / 2),
+                longitude + dlon, longitude - dlon)
+
+
+    # same data as crseg.utils.Util.get_osm_data: the ways touching the bounding box
+    # of the OSM api with all the connected components, or with overpass, as
+    # osmnx.graph.graph_from_point(center, dist, network_type="all", retain_all=False,
+    # truncate_by_edge=True, simplify=False)
+    def get_graph(self, latitude, longitude, dist, overpass = False):
+        import osmnx
+
+        if not overpass:
+            return self.get_graph_bbox(*OSMExtract.get_api_bbox(latitude, longitude, dist))
+
+        north, south, east, west = osmnx.utils_geo.bbox_from_point((latitude, longitude), dist)
+        G = self.get_graph_bbox(north, south, east, west)
+        G = osmnx.truncate.truncate_graph_bbox(G, north, south, east, west, truncate_by_edge=True)
+        return osmnx.truncate.largest_component(G)
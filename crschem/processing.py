@@ -91,13 +91,15 @@ class Expander:
         if len(polyline) <= 2:
             return polyline
 
+        coords = u.Utils.get_nodes_coordinates(G, polyline)
+
         # identify if each point is a split (thanks to the angle or its arity)
-        middle_points = zip(polyline, polyline[1:], polyline[2:])
-        is_split = [False] + [Expander.is_split_in_straight_part(G, p) for p in middle_points] + [False]
+        angles = u.Utils.turn_angles(coords[1:-1], coords[:-2], coords[2:])
+        angles = np.where(angles > 180, 360 - angles, angles)
+        is_split = [False] + [len(G[p]) > 2 or abs(a) > 30 for p, a in zip(polyline[1:-1], angles.tolist())] + [False]
 
         # use threshold to filter these possible splits
-        distances = [0] + [u.Utils.edge_length([G.nodes[a]["x"], G.nodes[a]["y"]], [G.nodes[b]["x"], G.nodes[b]["y"]]) for a, b in zip(polyline, polyline[1:])]
-        cumuld_dists = np.cumsum(distances)
+        cumuld_dists = np.cumsum(np.concatenate([[0], u.Utils.edge_lengths(coords[:-1], coords[1:])]))
         is_split = [i and d < threshold for i, d in zip(is_split, cumuld_dists)]
 
         try:
@@ -108,15 +110,25 @@ class Expander:
 
 
     def convert_to_linestring(G, polyline):
-        return LineString([Point(G.nodes[x]["x"], G.nodes[x]["y"]) for x in polyline])
+        return LineString(u.Utils.get_nodes_coordinates(G, polyline))
+
 
+    # turn angles are cached (by (middle, n1, n2) triple) during a walk in the graph
+    def turn_angle(G, middle, n1, n2, turn_angles = None):
+        if turn_angles is None:
+            return u.Utils.turn_angle(G, middle, n1, n2)
+        key = (middle, n1, n2)
+        if not key in turn_angles:
+            turn_angles[key] = u.Utils.turn_angle(G, middle, n1, n2)
+        return turn_angles[key]
 
-    def is_turn(G, m, c1, c2):
-        ta = u.Utils.turn_angle(G, m, c1, c2)
+
+    def is_turn(G, m, c1, c2, turn_angles = None):
+        ta = Expander.turn_angle(G, m, c1, c2, turn_angles)
         return ta < 90 or ta > 90 * 3
 
 
-    def is_similar_edge(G, e1, e2):
+    def is_similar_edge(G, e1, e2, turn_angles = None):
         tags_e1 = G[e1[0]][e1[1]][0]
         tags_e2 = G[e2[0]][e2[1]][0]
 
@@ -124,7 +136,7 @@ class Expander:
             return False
         if tags_e1["name"] != tags_e2["name"]:
             return False
-        if Expander.is_turn(G, e1[1], e1[0], e2[1]):
+        if Expander.is_turn(G, e1[1], e1[0], e2[1], turn_angles):
             return False
         return True
 
@@ -137,71 +149,84 @@ class Expander:
         else:
             return None
 
-    def find_next_edge(G, n1, n2, left_first):
+    def find_next_edge(G, n1, n2, left_first, turn_angles = None):
 
         other = [n for n in G[n2] if n != n1 and G[n2][n][0]["type"] == "unknown" and
-                 Expander.is_similar_edge(G, [n1, n2], [n2, n])]
+                 Expander.is_similar_edge(G, [n1, n2], [n2, n], turn_angles)]
         if len(other) == 0:
             return None
         elif len(other) == 1:
             return other[0]
         else:
-            sorted_other = sorted(other, key=lambda n: u.Utils.turn_angle(G, n2, n1, n), reverse=not left_first)
+            sorted_other = sorted(other, key=lambda n: Expander.turn_angle(G, n2, n1, n, turn_angles), reverse=not left_first)
             return sorted_other[0]
 
 
     def extend_branch(G, n1, n2, left_first):
-        # find next edge in the same street
-        next = Expander.find_next_edge(G, n1, n2, left_first)
-        # if not found, we reach the end of the path
-        if next is None:
-            return [n1, n2]
-        else:
+        turn_angles = {}
+        path = [n1, n2]
+        visited_edges = set([(n1, n2)])
+
+        while True:
+            # find next edge in the same street
+            next = Expander.find_next_edge(G, path[-2], path[-1], left_first, turn_angles)
+            # if not found, we reach the end of the path
+            if next is None:
+                return path
+            # the choice of the next edge only depends on the current one, thus
+            # an edge already visited means that the path is looping
+            if (path[-1], next) in visited_edges:
+                return path
             # if found, we propagate the extension
-            return [n1] + Expander.extend_branch(G, n2, next, left_first)
+            visited_edges.add((path[-1], next))
+            path.append(next)
 
 
 
-    def find_next_edge_on_polygon(G, n1, n2, left_first):
+    def find_next_edge_on_polygon(G, n1, n2, left_first, turn_angles = None):
         other = [n for n in G[n2] if n != n1 and G[n2][n][0]["type"] == "unknown"]
         if len(other) == 0:
             return None
         elif len(other) == 1:
             return other[0]
         else:
-            sorted_other = sorted(other, key=lambda n: u.Utils.turn_angle(G, n2, n1, n), reverse=not left_first)
+            sorted_other = sorted(other, key=lambda n: Expander.turn_angle(G, n2, n1, n, turn_angles), reverse=not left_first)
             return sorted_other[0]
 
 
-    def extend_polygon(G, path, left_first):
+    def extend_polygon(G, path, left_first, turn_angles = None):
+        if turn_angles is None:
+            turn_angles = {}
+        path = list(path)
+        visited = set(path)
 
-        next = Expander.find_next_edge_on_polygon(G, path[-2], path[-1], left_first)
-        # if not found, we reach the end of a path
-        if next is None:
-            return path
-        else:
-            np = path + [next]
-            if next in path:
-                return np
-            else:
-                return Expander.extend_polygon(G, np, left_first)
+        while True:
+            next = Expander.find_next_edge_on_polygon(G, path[-2], path[-1], left_first, turn_angles)
+            # if not found, we reach the end of a path
+            if next is None:
+                return path
+            path.append(next)
+            if next in visited:
+                return path
+            visited.add(next)
 
     def close_polygon(G, path):
-        p1 = Expander.extend_polygon(G, path, True)
+        turn_angles = {}
+        p1 = Expander.extend_polygon(G, path, True, turn_angles)
         if p1[0] == p1[-1]:
             return p1
         else:
-            p2 = Expander.extend_polygon(G, path, False)
+            p2 = Expander.extend_polygon(G, path, False, turn_angles)
             if p2[0] == p2[-1]:
                 return p2
             else:
                 # when a part of the polygon is outside of the map, choose the best option between one side 
                 # and the other
                 p1 = p1[::-1]
-                p1 = Expander.extend_polygon(G, p1, False)
+                p1 = Expander.extend_polygon(G, p1, False, turn_angles)
                 d1 = u.Utils.edge_length([G.nodes[p1[0]]["x"], G.nodes[p1[0]]["y"]], [G.nodes[p1[-1]]["x"], G.nodes[p1[-1]]["y"]])
                 p2 = p2[::-1]
-                p2 = Expander.extend_polygon(G, p2, False)
+                p2 = Expander.extend_polygon(G, p2, False, turn_angles)
                 d2 = u.Utils.edge_length([G.nodes[p2[0]]["x"], G.nodes[p2[0]]["y"]], [G.nodes[p2[-1]]["x"], G.nodes[p2[-1]]["y"]])
                 if d1 < d2:
                     return p1
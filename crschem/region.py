@@ -0,0 +1,114 @@
+import networkx
+import numpy as np
+
+
+class OSMRegion:
+
+    # OSM data of a region (e.g. a bounding box containing several crossroads, or a district),
+    # loaded and projected only once. Each crossroad then uses a subgraph of this region, cropped
+    # around its center, rather than downloading and projecting its own data.
+    def __init__(self, G, crs = "EPSG:2154"):
+        import pyproj
+
+        self.G = G
+        self.crs = crs
+        self.G_projected = None
+        self.node_ids = None
+        self.node_coords = None
+        self.transformer = pyproj.Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+
+
+    def set_osmnx_settings(ignore_cache = False):
+        import osmnx
+        from .crossroad_schematization import CrossroadSchematization
+
+        osmnx.settings.use_cache = not ignore_cache
+        osmnx.settings.useful_tags_node = list(set(osmnx.settings.useful_tags_node + CrossroadSchematization.node_tags_to_keep))
+
+
+    # if an OSMExtract is given, the data is loaded from this local extract
+    def from_bbox(north, south, east, west, ignore_cache = False, osm_extract = None):
+        import osmnx
+
+        OSMRegion.set_osmnx_settings(ignore_cache)
+        if osm_extract is not None:
+            return OSMRegion(osm_extract.get_graph_bbox(north, south, east, west))
+        return OSMRegion(osmnx.graph.graph_from_bbox(north, south, east, west,
+                                                     network_type="all",
+                                                     retain_all=True,
+                                                     truncate_by_edge=True,
+                                                     simplify=False))
+
+
+    # build the region containing all the given (latitude, longitude) points, with a margin (in meters)
+    def from_points(points, margin = 300, ignore_cache = False, osm_extract = None):
+        import osmnx
+
+        latitudes = [p[0] for p in points]
+        longitudes = [p[1] for p in points]
+        north, _, _, _ = osmnx.utils_geo.bbox_from_point((max(latitudes), longitudes[0]), margin)
+        _, south, _, _ = osmnx.utils_geo.bbox_from_point((min(latitudes), longitudes[0]), margin)
+        _, _, east, _ = osmnx.utils_geo.bbox_from_point((latitudes[0], max(longitudes)), margin)
+        _, _, _, west = osmnx.utils_geo.bbox_from_point((latitudes[0], min(longitudes)), margin)
+        return OSMRegion.from_bbox(north, south, east, west, ignore_cache, osm_extract)
+
+
+    def from_place(query, ignore_cache = False):
+        import osmnx
+
+        OSMRegion.set_osmnx_settings(ignore_cache)
+        return OSMRegion(osmnx.graph.graph_from_place(query,
+                                                      network_type="all",
+                                                      retain_all=True,
+                                                      truncate_by_edge=True,
+                                                      simplify=False,
+                                                      buffer_dist=300))
+
+
+    def get_projected(self):
+        import osmnx
+
+        if self.G_projected is None:
+            self.G_projected = osmnx.projection.project_graph(self.G, to_crs = self.crs)
+            self.node_ids = np.array(list(self.G_projected.nodes))
+            self.node_coords = np.array([(self.G_projected.nodes[n]["x"], self.G_projected.nodes[n]["y"]) for n in self.node_ids], dtype=np.float64).reshape(-1, 2)
+        return self.G_projected
+
+
+    # nodes in the square of the given half-size around the center, and their neighbours
+    # (similar to osmnx.graph.graph_from_point, with truncate_by_edge=True)
+    def get_nodes_around(self, latitude, longitude, radius):
+        G = self.get_projected()
+        x, y = self.transformer.transform(longitude, latitude)
+
+        inside = np.all(np.abs(self.node_coords - (x, y)) <= radius, axis=1)
+        nodes = set(self.node_ids[inside].tolist())
+        for n in list(nodes):
+            nodes.update(networkx.all_neighbors(G, n))
+
+        return nodes
+
+
+    def crop(G, nodes, retain_all):
+        import osmnx
+
+        result = G.subgraph(nodes).copy()
+        if not retain_all and len(result.nodes) != 0:
+            result = osmnx.truncate.largest_component(result)
+        return result
+
+
+    # return the (non projected) graph around the given coordinates. All the connected
+    # components are kept by default, as in the data downloaded by crseg from the OSM api
+    def get_graph(self, latitude, longitude, radius, retain_all = True):
+        return OSMRegion.crop(self.G, self.get_nodes_around(latitude, longitude, radius), retain_all)
+
+
+    # return the projected graph around the given coordinates
+    def get_projected_graph(self, latitude, longitude, radius, retain_all = True):
+        return OSMRegion.crop(self.get_projected(), self.get_nodes_around(latitude, longitude, radius), retain_all)
+
+
+    # return the projected version of a subgraph of the region
+    def get_projected_subgraph(self, G):
+        return self.get_projected().subgraph(G.nodes).copy()
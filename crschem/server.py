@@ -0,0 +1,285 @@
+# coding: utf-8
+
+import argparse
+import collections
+import contextlib
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import traceback
+
+from crschem.map_cache import MapnikMapCache
+from crschem.stage_cache import StageCache
+
+
+# directory of the default socket: the runtime directory of the user, or
+# a directory of the user (only accessible by them) in the temporary directory
+def get_default_socket_directory():
+    if "XDG_RUNTIME_DIR" in os.environ:
+        return os.environ["XDG_RUNTIME_DIR"]
+    return os.path.join(tempfile.gettempdir(), "crschem-" + str(os.getuid()))
+
+
+def get_default_socket_path():
+    if "CRSCHEM_SOCKET" in os.environ:
+        return os.environ["CRSCHEM_SOCKET"]
+    return os.path.join(get_default_socket_directory(), "crschem.sock")
+
+
+
+class SchematizationWorker:
+
+    # state kept between the jobs of the daemon: imported modules, OSM extracts,
+    # recently used OSM graphs (least recently used ones are dropped), results of the
+    # stages of the processing (see StageCache), mapnik maps, and the directory of
+    # the intermediate geometries
+    def __init__(self, graph_cache_size = 32, stage_cache = None):
+        self.graph_cache_size = graph_cache_size
+        self.graphs = collections.OrderedDict()
+        self.osm_extracts = {}
+        self.stage_cache = stage_cache if stage_cache is not None else StageCache()
+        self.map_cache = MapnikMapCache()
+        self.debug_sink = None
+
+
+    # import the heavy dependencies once, rather than at the first job
+    def preload(self):
+        for module in ["osmnx", "geopandas", "pandas", "crseg.segmentation", "crmodel.crmodel", "scipy.spatial", "mapnik", "mapnik.printing", "osgeo.gdal"]:
+            try:
+                __import__(module)
+            except ImportError as e:
+                print("Cannot preload", module + ":", e)
+
+
+    def get_osm_extract(self, filename):
+        from crschem.osm_extract import OSMExtract
+
+        filename = os.path.abspath(filename)
+        if not filename in self.osm_extracts:
+            self.osm_extracts[filename] = OSMExtract(filename)
+        return self.osm_extracts[filename]
+
+
+    def get_osm_graph(self, latitude, longitude, ignore_cache = False, overpass = False, osm_extract = None):
+        import crschem.crossroad_schematization as cs
+
+        key = (latitude, longitude, overpass, osm_extract.filename if osm_extract is not None else None)
+        if key in self.graphs and not ignore_cache:
+            self.graphs.move_to_end(key)
+            print("Using OpenStreetMap data kept in memory")
+            return self.graphs[key]
+
+        G_init = cs.CrossroadSchematization.load_osm_graph(latitude, longitude, True, ignore_cache, overpass, osm_extract=osm_extract)
+        self.graphs[key] = G_init
+        self.graphs.move_to_end(key)
+        while len(self.graphs) > self.graph_cache_size:
+            self.graphs.popitem(last=False)
+        return G_init
+
+
+    # the intermediate geometries of all the jobs are written in the same directory
+    def get_debug_sink(self):
+        from crschem.debug import GeometryDebugSink
+
+        if self.debug_sink is None:
+            self.debug_sink = GeometryDebugSink()
+        return self.debug_sink
+
+
+    # run a job given by the arguments of get_crossroad_schematization, from the given working directory
+    def run(self, argv, cwd):
+        from crschem.cmd import get_crossroad_schematization_parser, run_crossroad_schematization
+
+        previous_cwd = os.getcwd()
+        try:
+            os.chdir(cwd)
+            args = get_crossroad_schematization_parser().parse_args(argv)
+            run_crossroad_schematization(args, self)
+            return 0
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+            return 1
+        finally:
+            os.chdir(previous_cwd)
+
+
+    def close(self):
+        self.map_cache.close()
+
+
+
+class SchematizationServer(socketserver.UnixStreamServer):
+
+    # a long-lived worker listening on a Unix socket. A request is a json line
+    # {"argv": [...], "cwd": "..."}, and the answer is a sequence of json lines: the
+    # output of the job ({"output": "..."}) then its exit status ({"status": 0}).
+    # Jobs are run one at a time (osmnx settings and mapnik maps are shared by the process).
+    class RequestHandler(socketserver.StreamRequestHandler):
+
+        class OutputWriter:
+            def __init__(self, wfile):
+                self.wfile = wfile
+
+            def write(self, text):
+                if len(text) != 0:
+                    self.wfile.write((json.dumps({"output": text}) + "\n").encode("utf-8"))
+                return len(text)
+
+            def flush(self):
+                self.wfile.flush()
+
+
+        def handle(self):
+            try:
+                request = json.loads(self.rfile.readline().decode("utf-8"))
+            except ValueError:
+                return
+            writer = SchematizationServer.RequestHandler.OutputWriter(self.wfile)
+            try:
+                with contextlib.redirect_stdout(writer), contextlib.redirect_stderr(writer):
+                    status = self.server.worker.run(request["argv"], request["cwd"])
+                writer.wfile.write((json.dumps({"status": status}) + "\n").encode("utf-8"))
+            except BrokenPipeError:
+                # the client is gone
+                pass
+
+
+    def __init__(self, socket_path, worker):
+        self.socket_path = socket_path
+        self.worker = worker
+
+        directory = os.path.dirname(os.path.abspath(socket_path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, mode=0o700)
+        if directory == os.path.abspath(get_default_socket_directory()):
+            st = os.stat(directory)
+            if st.st_uid != os.getuid() or st.st_mode & 0o077 != 0:
+                raise ValueError(directory + " must be a directory only accessible by the current user")
+
+        if os.path.exists(socket_path):
+            if SchematizationClient.is_running(socket_path):
+                raise ValueError("A worker is already listening on " + socket_path)
+            os.unlink(socket_path)
+
+        # only the user can send jobs: the socket is created with restricted permissions
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, SchematizationServer.RequestHandler)
+        finally:
+            os.umask(umask)
+
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.worker.close()
+
+
+
+class SchematizationClient:
+
+    # a worker is only used if it is run by the current user: jobs (and their
+    # output) are never exchanged with a socket created by another user
+    def is_trusted(socket_path):
+        try:
+            st = os.stat(socket_path)
+        except OSError:
+            return False
+        if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+            print("Ignoring", socket_path + ": not a socket of the current user")
+            return False
+        return True
+
+
+    # user id of the process listening on the other side of the socket, or None if unknown
+    def get_peer_uid(s):
+        if not hasattr(socket, "SO_PEERCRED"):
+            return None
+        credentials = s.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        pid, uid, gid = struct.unpack("3i", credentials)
+        return uid
+
+
+    def connect(socket_path):
+        if not SchematizationClient.is_trusted(socket_path):
+            return None
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(socket_path)
+        except OSError:
+            s.close()
+            return None
+        # the socket may have been replaced since it has been checked
+        uid = SchematizationClient.get_peer_uid(s)
+        if uid is not None and uid != os.getuid():
+            print("Ignoring", socket_path + ": the worker is not run by the current user")
+            s.close()
+            return None
+        return s
+
+
+    def is_running(socket_path):
+        s = SchematizationClient.connect(socket_path)
+        if s is None:
+            return False
+        s.close()
+        return True
+
+
+    # forward a job to the worker, and print its output.
+    # Return the exit status of the job, or None if no worker is running.
+    def run(socket_path, argv, cwd = None):
+        s = SchematizationClient.connect(socket_path)
+        if s is None:
+            return None
+
+        status = 1
+        with s, s.makefile("rwb") as f:
+            f.write((json.dumps({"argv": argv, "cwd": cwd if cwd is not None else os.getcwd()}) + "\n").encode("utf-8"))
+            f.flush()
+            for line in f:
+                message = json.loads(line.decode("utf-8"))
+                if "output" in message:
+                    sys.stdout.write(message["output"])
+                    sys.stdout.flush()
+                elif "status" in message:
+                    status = message["status"]
+        return status
+
+
+
+def get_crossroad_schematization_server_command():
+
+    parser = argparse.ArgumentParser(description="Run a worker for get_crossroad_schematization, keeping imports, OSM data and map styles in memory between jobs. get_crossroad_schematization forwards its jobs to this worker when it is running.")
+    parser.add_argument('-s', '--socket', help='Unix socket of the worker. Default: $CRSCHEM_SOCKET, or crschem.sock in $XDG_RUNTIME_DIR (or in a private crschem-<uid> directory of the temporary directory).', type=str, default=get_default_socket_path())
+    parser.add_argument('--graph-cache-size', help='Number of OSM graphs kept in memory. Default: 32.', type=int, default=32)
+    parser.add_argument('--stage-cache-memory', help='Maximum size of the results of the stages kept in memory, in MB. Default: 256.', type=int, default=256)
+    parser.add_argument('--stage-cache', help='Also keep the results of the stages in the given directory', type=str)
+    parser.add_argument('--stage-cache-size', help='Maximum size of the stage cache directory, in MB. Default: 1024.', type=int, default=1024)
+
+    args = parser.parse_args()
+
+    worker = SchematizationWorker(args.graph_cache_size,
+                                  StageCache(args.stage_cache_memory * 1024 * 1024, args.stage_cache, args.stage_cache_size * 1024 * 1024))
+    worker.preload()
+
+    try:
+        server = SchematizationServer(args.socket, worker)
+    except ValueError as e:
+        print("Error:", e)
+        sys.exit(1)
+
+    print("Listening on", args.socket)
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
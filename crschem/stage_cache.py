@@ -0,0 +1,122 @@
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+
+
+class StageCache:
+
+    # results of the stages of the schematization, kept in memory and optionally on disk.
+    # Each result is stored with a key built from the key of the previous stage and the
+    # parameters of the stage (see StageCache.key), thus a change of a parameter invalidates
+    # the stage using it and all the following ones.
+    # Results are stored as pickled snapshots: a restored result is never shared with
+    # another run. The least recently used results are dropped when the memory
+    # or the disk size (in bytes) is exceeded.
+    def __init__(self, max_memory_size = 256 * 1024 * 1024, directory = None, max_disk_size = 1024 * 1024 * 1024):
+        self.max_memory_size = max_memory_size
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self.entries = collections.OrderedDict()
+        self.memory_size = 0
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+
+    # a key from a sequence of elements (keys of the previous stages, names, parameters)
+    def key(*elements):
+        return hashlib.sha256(repr(elements).encode("utf-8")).hexdigest()
+
+
+    # a hash of the nodes and edges of a graph, with their attributes. The pickled
+    # version is hashed: the same graph built with another order of attributes gives
+    # another hash (i.e. only a cache miss)
+    def hash_graph(G):
+        edges = list(G.edges(keys=True, data=True)) if G.is_multigraph() else list(G.edges(data=True))
+        return hashlib.sha256(pickle.dumps((list(G.nodes(data=True)), edges), protocol=4)).hexdigest()
+
+
+    def get_filename(self, key):
+        return os.path.join(self.directory, key + ".pickle")
+
+
+    def contains(self, key):
+        return key in self.entries or (self.directory is not None and os.path.exists(self.get_filename(key)))
+
+
+    def get(self, key):
+        data = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+        elif self.directory is not None and os.path.exists(self.get_filename(key)):
+            try:
+                with open(self.get_filename(key), "rb") as f:
+                    data = f.read()
+                # the modification time is used for the eviction
+                os.utime(self.get_filename(key))
+            except OSError:
+                data = None
+            if data is not None:
+                self.add_to_memory(key, data)
+
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(data)
+
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.add_to_memory(key, data)
+        if self.directory is not None:
+            self.add_to_disk(key, data)
+
+
+    def add_to_memory(self, key, data):
+        if key in self.entries:
+            self.memory_size -= len(self.entries.pop(key))
+        if len(data) > self.max_memory_size:
+            return
+        self.entries[key] = data
+        self.memory_size += len(data)
+        while self.memory_size > self.max_memory_size:
+            self.memory_size -= len(self.entries.popitem(last=False)[1])
+
+
+    def add_to_disk(self, key, data):
+        # written in a temporary file then moved, so that concurrent readers never see a partial file
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.get_filename(key))
+
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pickle"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum([f[1] for f in files])
+        for mtime, size, name in sorted(files):
+            if total <= self.max_disk_size:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+
+    def clear(self):
+        self.entries = collections.OrderedDict()
+        self.memory_size = 0
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith(".pickle"):
+                    os.unlink(os.path.join(self.directory, name))
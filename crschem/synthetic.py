@@ -0,0 +1,226 @@
+import math
+import random
+
+import networkx
+
+
+class SyntheticCrossroad:
+
+    # a generated star-shaped crossroad: branches around a central node, each one being
+    # a two-way street or a dual carriageway (two one-way streets around a traffic island),
+    # with a crossing at the border of the crossroad on each carriageway, and optionally
+    # crossings_per_branch mid-block crossings spread along the outer part of each branch.
+    # build() returns an osmnx-like graph (not projected) and the matching input model
+    # (cr_input, as produced by crdesc), to be used by CrossroadSchematization(cr_input, G).
+    # Distances are in meters.
+    def __init__(self, nb_branches = 4, nb_dual_carriageways = 0,
+                 crossings = True, traffic_signals = False, crossings_per_branch = 0,
+                 inner_radius = 12, branch_length = 150, segment_length = 25,
+                 carriageway_distance = 10, lanes = 2, highway = "secondary",
+                 angle_jitter = 0, seed = 0,
+                 latitude = 45.77, longitude = 3.09):
+        if nb_branches < 3:
+            raise ValueError("A synthetic crossroad requires at least 3 branches")
+        self.nb_branches = nb_branches
+        self.nb_dual_carriageways = min(nb_dual_carriageways, nb_branches)
+        self.crossings = crossings
+        self.traffic_signals = traffic_signals
+        self.crossings_per_branch = crossings_per_branch
+        self.inner_radius = inner_radius
+        self.branch_length = branch_length
+        self.segment_length = segment_length
+        self.carriageway_distance = carriageway_distance
+        self.lanes = lanes
+        self.highway = highway
+        self.angle_jitter = angle_jitter
+        self.seed = seed
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+    def get_name(self):
+        name = "synthetic-" + str(self.nb_branches) + "-" + str(self.nb_dual_carriageways)
+        if self.crossings_per_branch != 0:
+            name += "-" + str(self.crossings_per_branch)
+        return name
+
+
+    # local coordinates (meters) to (longitude, latitude), using an equirectangular approximation
+    def to_lonlat(self, x, y):
+        return (self.longitude + x / (111320 * math.cos(math.radians(self.latitude))),
+                self.latitude + y / 110574)
+
+
+    def add_edge(self, n1, n2, way_id, name, oneway):
+        length = math.dist(self.coords[n1], self.coords[n2])
+        tags = {"osmid": way_id, "highway": self.highway, "name": name, "lanes": str(self.lanes), "oneway": oneway, "length": length}
+        self.G.add_edge(n1, n2, reversed=False, **tags)
+        if not oneway:
+            self.G.add_edge(n2, n1, reversed=True, **tags)
+
+
+    def add_point(self, x, y, **tags):
+        self.last_node_id += 1
+        lon, lat = self.to_lonlat(x, y)
+        self.G.add_node(self.last_node_id, x=lon, y=lat, **tags)
+        self.coords[self.last_node_id] = (x, y)
+        return self.last_node_id
+
+
+    def add_path(self, nodes, way_id, name, oneway):
+        for n1, n2 in zip(nodes, nodes[1:]):
+            self.add_edge(n1, n2, way_id, name, oneway)
+
+
+    def add_way_row(self, type, id, n1, n2, name, way_id, left_sidewalk = None, right_sidewalk = None, left_island = None, right_island = None):
+        self.features.append({"type": "Feature",
+                              "geometry": {"type": "LineString", "coordinates": [self.to_lonlat(*self.coords[n1]), self.to_lonlat(*self.coords[n2])]},
+                              "properties": {"id": id,
+                                             "osm_node_ids": [str(n1), str(n2)],
+                                             "osm_way_id": str(way_id),
+                                             "type": type,
+                                             "name": name,
+                                             "left_sidewalk": left_sidewalk,
+                                             "right_sidewalk": right_sidewalk,
+                                             "left_island": left_island,
+                                             "right_island": right_island}})
+
+
+    def add_crossing_rows(self, branch_number, nodes):
+        for n in nodes:
+            self.features.append({"type": "Feature",
+                                  "geometry": {"type": "Point", "coordinates": self.to_lonlat(*self.coords[n])},
+                                  "properties": {"id": str(n),
+                                                 "osm_node_id": str(n),
+                                                 "type": "crosswalk",
+                                                 "tactile_paving": "yes",
+                                                 "pedestrian_traffic_light": "yes" if self.traffic_signals else "no",
+                                                 "pedestrian_traffic_light:sound": "unknown"}})
+        if len(nodes) == 1:
+            geometry = {"type": "Point", "coordinates": self.to_lonlat(*self.coords[nodes[0]])}
+        else:
+            geometry = {"type": "LineString", "coordinates": [self.to_lonlat(*self.coords[n]) for n in nodes]}
+        self.features.append({"type": "Feature",
+                              "geometry": geometry,
+                              "properties": {"id": ";".join(map(str, nodes)),
+                                             "osm_node_ids": [str(n) for n in nodes],
+                                             "type": "crossing",
+                                             "branch": branch_number}})
+
+
+    # tags of a crossing node (border crossings are only added if enabled)
+    def crossing_tags(self, border = True):
+        if border and not self.crossings:
+            return {}
+        return {"highway": "crossing", "crossing": "traffic_signals" if self.traffic_signals else "uncontrolled"}
+
+
+    # add the points of the outer part of a branch (two-way street), the first one being given.
+    # Mid-block crossings are spread along this part (the first one at the end of the first
+    # segment, on the border of the input model)
+    def add_outer_points(self, first, points, number):
+        nb_crossings = min(self.crossings_per_branch, len(points))
+        crossings = set([int(i * len(points) / nb_crossings) for i in range(nb_crossings)]) if nb_crossings != 0 else set()
+        outer = [first] + [self.add_point(*p, **(self.crossing_tags(False) if i in crossings else {})) for i, p in enumerate(points)]
+        for i in sorted(crossings):
+            self.add_crossing_rows(number, [outer[i + 1]])
+        return outer
+
+
+    # the points of a line parallel to the branch axis
+    def branch_points(self, angle, shift, radiuses):
+        ux, uy = math.cos(angle), math.sin(angle)
+        nx, ny = -uy, ux
+        return [(r * ux + shift * nx, r * uy + shift * ny) for r in radiuses]
+
+
+    def build_branch(self, k, angle, dual):
+        number = k + 1
+        name = "Street " + str(number)
+        branch_name = "branch n°" + str(number) + " | " + name
+        # as in crdesc, branches are numbered clockwise and sidewalk k is between branches k and k + 1.
+        # Left and right are given in the outward direction.
+        left_sidewalk = str((k - 1) % self.nb_branches)
+        right_sidewalk = str(k)
+        way_id = 1000 * number
+
+        # outer part of the branch (outside of the crossroad), two-way street
+        start = self.inner_radius if not dual else self.inner_radius + 2 * self.segment_length
+        radiuses = [start + i * self.segment_length for i in range(int((self.branch_length - start) / self.segment_length) + 1)]
+
+        if not dual:
+            points = self.branch_points(angle, 0, radiuses)
+            border = self.add_point(*points[0], **self.crossing_tags())
+            outer = self.add_outer_points(border, points[1:], number)
+            self.add_path([self.center] + outer, way_id, name, False)
+
+            self.add_way_row("way", str(way_id), self.center, border, name, way_id, left_sidewalk, right_sidewalk)
+            self.add_way_row("branch", str(number), border, outer[1], branch_name, way_id, left_sidewalk, right_sidewalk)
+            if self.crossings:
+                self.add_crossing_rows(number, [border])
+            return
+
+        island = str(self.nb_islands)
+        self.nb_islands += 1
+
+        # two-way part from the center to the split node
+        split = self.add_point(*self.branch_points(angle, 0, [self.inner_radius / 3])[0])
+        self.add_path([self.center, split], way_id, name, False)
+        self.add_way_row("way", str(way_id), self.center, split, name, way_id, left_sidewalk, right_sidewalk)
+
+        # then the two carriageways, joined after the traffic island
+        join_points = self.branch_points(angle, 0, radiuses)
+        join = self.add_point(*join_points[0])
+        outer = self.add_outer_points(join, join_points[1:], number)
+        self.add_path(outer, way_id + 1, name, False)
+
+        shift = self.carriageway_distance / 2
+        r_carriageway = [self.inner_radius, self.inner_radius + self.segment_length]
+        # outgoing carriageway (right-hand traffic), on the right of the axis
+        points_out = self.branch_points(angle, -shift, r_carriageway)
+        out_border = self.add_point(*points_out[0], **self.crossing_tags())
+        out_next = self.add_point(*points_out[1])
+        self.add_path([split, out_border, out_next, join], way_id + 2, name, True)
+        self.add_way_row("way", str(way_id + 2), split, out_border, name, way_id + 2, None, right_sidewalk, island, None)
+        self.add_way_row("branch", str(number), out_border, out_next, branch_name, way_id + 2, None, right_sidewalk, island, None)
+
+        # incoming carriageway, on the left of the axis
+        points_in = self.branch_points(angle, shift, r_carriageway)
+        in_border = self.add_point(*points_in[0], **self.crossing_tags())
+        in_next = self.add_point(*points_in[1])
+        self.add_path([join, in_next, in_border, split], way_id + 3, name, True)
+        self.add_way_row("way", str(way_id + 3), in_border, split, name, way_id + 3, None, left_sidewalk, island, None)
+        self.add_way_row("branch", str(number), in_next, in_border, branch_name, way_id + 3, None, left_sidewalk, island, None)
+
+        if self.crossings:
+            self.add_crossing_rows(number, [out_border, in_border])
+
+
+    def build(self):
+        import geopandas
+
+        rnd = random.Random(self.seed)
+
+        self.G = networkx.MultiDiGraph(crs="epsg:4326")
+        self.features = []
+        self.coords = {}
+        self.last_node_id = 0
+        self.nb_islands = 0
+
+        self.center = self.add_point(0, 0)
+        self.features.append({"type": "Feature",
+                              "geometry": {"type": "Point", "coordinates": self.to_lonlat(0, 0)},
+                              "properties": {"id": None, "type": "crossroads"}})
+
+        # branches start from the north, clockwise, and dual carriageways are spread around the crossroad
+        step = 2 * math.pi / self.nb_branches
+        duals = set([int(i * self.nb_branches / self.nb_dual_carriageways) for i in range(self.nb_dual_carriageways)])
+        for k in range(self.nb_branches):
+            angle = math.pi / 2 - k * step + rnd.uniform(-self.angle_jitter, self.angle_jitter) * step / 2
+            self.build_branch(k, angle, k in duals)
+
+        for n in self.G.nodes:
+            self.G.nodes[n]["street_count"] = len(set(networkx.all_neighbors(self.G, n)))
+
+        cr_input = geopandas.GeoDataFrame.from_features(self.features, crs="EPSG:4326")
+        return self.G, cr_input
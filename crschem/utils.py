@@ -4,7 +4,7 @@ import shapely.ops
 import numpy as np
 import math
 import re
-import osmnx as ox
+import weakref
 
 
 class Utils:
@@ -83,6 +83,33 @@ class Utils:
         dotv = np.dot(v, v)
         return dot >= 0 and dot <= dotv
 
+    # batched versions of the previous functions, on (N, 2) arrays of coordinates
+    # (e.g. given by a CoordinateStore). A (2,) array is broadcasted to all the rows
+    def vectors(c1, c2):
+        return np.asarray(c2, dtype=np.float64) - np.asarray(c1, dtype=np.float64)
+
+
+    def edge_lengths(c1, c2):
+        v = Utils.vectors(c1, c2)
+        return np.sqrt(np.einsum("...i,...i->...", v, v))
+
+    # rows of null vectors are set to nan
+    def normalized_vectors(c1, c2):
+        v = Utils.vectors(c1, c2)
+        norms = np.sqrt(np.einsum("...i,...i->...", v, v))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return v / np.where(norms == 0, np.nan, norms)[..., None]
+
+    # return true for each edge (n1[i], n2[i]) containing the point p[i]
+    def are_in_edges(p, n1, n2):
+        v = Utils.vectors(n1, n2)
+        vp = Utils.vectors(n1, p)
+
+        cross = v[..., 0] * vp[..., 1] - v[..., 1] * vp[..., 0]
+        dot = np.einsum("...i,...i->...", v, vp)
+        dotv = np.einsum("...i,...i->...", v, v)
+        return (np.abs(cross) <= 1e-6) & (dot >= 0) & (dot <= dotv)
+
 
     def reverse_geom(geom):
         def _reverse(x, y, z=None):
@@ -93,11 +120,13 @@ class Utils:
         return shapely.ops.transform(_reverse, geom)
 
 
+    # number from a label of the input model. Empty labels are only replaced by nan
+    # in assemble_sidewalks, and can be read before (e.g. by crop_osm)
     def get_number_from_label(txt):
         if txt is None:
             return None
         if isinstance(txt, str):
-            return int(txt)
+            return int(txt) if txt != "" else None
         if math.isnan(txt):
             return None
         return int(txt)
@@ -137,6 +166,8 @@ class Utils:
 
     
     def turn_angle(G, middle, n2, n3):
+        import osmnx as ox
+
         c1 = (G.nodes[middle]["x"], G.nodes[middle]["y"])
         c2 = (G.nodes[n2]["x"], G.nodes[n2]["y"])
         c3 = (G.nodes[n3]["x"], G.nodes[n3]["y"])
@@ -147,34 +178,94 @@ class Utils:
             a += 360
         return a
 
+    # batched version of turn_angle, on (N, 2) arrays of coordinates
+    def turn_angles(c_middle, c2, c3):
+        import osmnx as ox
 
-    def get_buffered_osm(osm, supplementary_width = 0):
-
-        regions = []
+        b1 = ox.bearing.calculate_bearing(c2[:, 1], c2[:, 0], c_middle[:, 1], c_middle[:, 0])
+        b2 = ox.bearing.calculate_bearing(c3[:, 1], c3[:, 0], c_middle[:, 1], c_middle[:, 0])
+        a = b2 - b1
+        return np.where(a < 0, a + 360, a)
+
+
+    # the coordinates version of a graph is increased each time its nodes are moved,
+    # thus geometries computed from these coordinates can be cached
+    def get_coordinates_version(osm):
+        return osm.graph.get("coordinates_version", 0)
+
+
+    def touch_coordinates(osm):
+        osm.graph["coordinates_version"] = Utils.get_coordinates_version(osm) + 1
+
+    # the coordinate store of a graph, built on demand and kept with the graph
+    # until its coordinates are modified
+    def get_coordinate_store(osm):
+        store = coordinate_stores.get(osm)
+        if store is None or not store.is_valid(osm):
+            store = CoordinateStore(osm)
+            coordinate_stores[osm] = store
+        return store
+
+    # (N, 2) array of the coordinates of the given nodes
+    def get_nodes_coordinates(osm, nodes):
+        try:
+            return Utils.get_coordinate_store(osm).get_coordinates(nodes)
+        except KeyError:
+            # nodes have been replaced since the creation of the store
+            coordinate_stores[osm] = CoordinateStore(osm)
+            return coordinate_stores[osm].get_coordinates(nodes)
+
+
+    # union of all the roadway edges, buffered by their width. If a center and a radius are given,
+    # only the edges within this distance from the center are used
+    def get_buffered_osm(osm, supplementary_width = 0, center = None, radius = None):
+        edges = []
+        widths = []
+        seen = set()
         for n1 in osm:
             for n2 in osm[n1]:
                 edge = osm[n1][n2][0]
+                # each edge of an undirected graph is seen from its two extremities
+                if not osm.is_directed() and (n2, n1) in seen:
+                    continue
                 if Utils.is_roadway_edge(edge):
-                    p1 = osm.nodes[n1]
-                    p2 = osm.nodes[n2]
-                    e = LineString([[p1["x"], p1["y"]], [p2["x"], p2["y"]]]).buffer((Utils.evaluate_width_way(edge) + supplementary_width) / 2)
-                    regions.append(e)
-        return shapely.ops.unary_union(regions)
+                    edges.append((n1, n2))
+                    seen.add((n1, n2))
+                    widths.append(Utils.get_width_way(edge) + supplementary_width)
+        return Utils.get_union_of_buffered_edges(osm, edges, widths, center, radius)
+
+
+    def get_edge_width_by_osm(n1, n2, osm, supplementary_width = 0):
+        if n1 in osm and n2 in osm[n1]:
+            return Utils.get_width_way(osm[n1][n2][0]) + supplementary_width
+        else:
+            return 1 + supplementary_width
+
+    # array of the edges (pairs of nodes) buffered by the given widths, built in bulk
+    # (with the resolution of BaseGeometry.buffer)
+    def get_buffered_edges(osm, edges, widths):
+        import shapely
+
+        coords = Utils.get_nodes_coordinates(osm, [n for e in edges for n in e]).reshape(-1, 2, 2)
+        lines = shapely.linestrings(coords)
+        return shapely.buffer(lines, np.asarray(widths, dtype=np.float64) / 2, quad_segs=16)
+
+
+    def get_union_of_buffered_edges(osm, edges, widths, center = None, radius = None):
+        import shapely
+
+        if len(edges) == 0:
+            return shapely.GeometryCollection()
+        buffered = Utils.get_buffered_edges(osm, edges, widths)
+        if center is not None and radius is not None:
+            buffered = buffered[shapely.dwithin(buffered, shapely.Point(center), radius)]
+        return shapely.union_all(buffered)
 
 
     def get_edges_buffered_by_osm(edges, osm, supplementary_width = 0):
-        regions = []
-        for n1, n2 in edges:
-            p1 = osm.nodes[n1]
-            p2 = osm.nodes[n2]
-            if n1 in osm and n2 in osm[n1]:
-                edge = osm[n1][n2][0]
-                width = Utils.evaluate_width_way(edge) + supplementary_width
-            else:
-                width = 1 + supplementary_width
-            e = LineString([[p1["x"], p1["y"]], [p2["x"], p2["y"]]]).buffer((width) / 2)
-            regions.append(e)
-        return shapely.ops.unary_union(regions)
+        edges = list(edges)
+        widths = [Utils.get_edge_width_by_osm(n1, n2, osm, supplementary_width) for n1, n2 in edges]
+        return Utils.get_union_of_buffered_edges(osm, edges, widths)
 
 
     def get_buffered_by_osm(polyline, osm, supplementary_width = 0):
@@ -236,11 +327,14 @@ class Utils:
 
         return nb_backward, nb_forward, width
 
-    def evaluate_width_way(gEdge):
+    # the composition of the way can be given if already evaluated
+    def evaluate_width_way(gEdge, composition = None):
         if "width" in gEdge and not re.match(r'^-?\d+(?:\.\d+)$', gEdge["width"]) is None:
             return float(gEdge["width"])
 
-        nb_lanes_backward, nb_lanes_forward, lane_width = Utils.evaluate_way_composition(gEdge)
+        if composition is None:
+            composition = Utils.evaluate_way_composition(gEdge)
+        nb_lanes_backward, nb_lanes_forward, lane_width = composition
         
         result = (nb_lanes_backward + nb_lanes_forward) * lane_width
         if ("cycleway:right" in gEdge and gEdge["cycleway:right"] == "lane") or \
@@ -249,28 +343,27 @@ class Utils:
 
         return result
 
-    def get_initial_node_tags(cr_input, osm_n1):
-        if "osm_node_id" in cr_input.columns.tolist():
-            is_n = cr_input["osm_node_id"] == str(osm_n1)
-            filtered = cr_input[is_n]
-            if len(filtered) > 0:
-                return filtered.iloc[0, :].to_dict()
-            else:
-                return None
-        else:
-                return None
-        
-
-
-    def get_initial_edge_tags(cr_input, osm_n1, osm_n2, inverse = False):
-        for index, row in cr_input.iterrows():
-            if row["osm_node_ids"] == [str(osm_n1), str(osm_n2)]:
-                return row.to_dict()
-        if inverse:
-            return Utils.get_initial_edge_tags(cr_input, osm_n2, osm_n1, False)
-        else:
-            return None
-
+    # evaluate once the width and the composition of each roadway edge of the graph
+    # (the tags are parsed, and the warnings printed, only once), stored as numeric
+    # attributes of the edges: width_m, lanes_backward, lanes_forward and lane_width
+    def add_way_compositions(osm):
+        for n1, n2, edge in osm.edges(data=True):
+            if Utils.is_roadway_edge(edge):
+                composition = Utils.evaluate_way_composition(edge)
+                edge["lanes_backward"], edge["lanes_forward"], edge["lane_width"] = composition
+                edge["width_m"] = Utils.evaluate_width_way(edge, composition)
+
+    # width of the edge, using the precomputed value if available
+    def get_width_way(gEdge):
+        if "width_m" in gEdge:
+            return gEdge["width_m"]
+        return Utils.evaluate_width_way(gEdge)
+
+    # composition of the edge, using the precomputed values if available
+    def get_way_composition(gEdge):
+        if "lane_width" in gEdge:
+            return gEdge["lanes_backward"], gEdge["lanes_forward"], gEdge["lane_width"]
+        return Utils.evaluate_way_composition(gEdge)
 
     def pathid_to_pathcoords(path, osm):
         return [(osm.nodes[n]["x"], osm.nodes[n]["y"]) for n in path]
@@ -294,15 +387,43 @@ class Utils:
     def bounding_box_nodes(osm, shift = 0):
         if len(osm.nodes) == 0:
             return []
-        first = list(osm.nodes.items())[0][1]
-        minx = maxx = first["x"]
-        miny = maxy = first["y"]
-
-        for n in osm.nodes:
-            minx = min(minx, osm.nodes[n]["x"])
-            maxx = max(maxx, osm.nodes[n]["x"])
-            miny = min(miny, osm.nodes[n]["y"])
-            maxy = max(maxy, osm.nodes[n]["y"])
+        coords = np.array([(a["x"], a["y"]) for n, a in osm.nodes(data=True)], dtype=np.float64)
+        minx, miny = coords.min(axis=0)
+        maxx, maxy = coords.max(axis=0)
 
         return [[minx - shift, miny - shift], [minx - shift, maxy + shift], [maxx + shift, miny - shift], [maxx + shift, maxy + shift]]
 
+
+
+class CoordinateStore:
+
+    # coordinates of the nodes of a graph as a (N, 2) float64 array, with the row of each node,
+    # to apply the geometric functions of Utils on a set of nodes at once.
+    # A store is only valid for a given version of the coordinates (see Utils.touch_coordinates):
+    # code moving nodes has to touch the coordinates of the graph.
+    def __init__(self, osm):
+        self.version = Utils.get_coordinates_version(osm)
+        self.node_ids = list(osm.nodes)
+        self.index = dict([(n, i) for i, n in enumerate(self.node_ids)])
+        self.coords = np.array([(a["x"], a["y"]) for n, a in osm.nodes(data=True)], dtype=np.float64).reshape(-1, 2)
+
+
+    # nodes can also be added or removed (e.g. by the segmentation)
+    def is_valid(self, osm):
+        return self.version == Utils.get_coordinates_version(osm) and len(self.node_ids) == len(osm.nodes)
+
+
+    def get_indices(self, nodes):
+        return np.fromiter((self.index[n] for n in nodes), dtype=np.intp)
+
+
+    def get_coordinates(self, nodes):
+        return self.coords[self.get_indices(nodes)]
+
+
+    def get_coordinate(self, node):
+        return self.coords[self.index[node]]
+
+
+# coordinate stores of the graphs (dropped with the graphs)
+coordinate_stores = weakref.WeakKeyDictionary()
@@ -2,11 +2,12 @@
 #encoding: utf-8
 
 import argparse
-import geopandas
 
 import sys
 
 import crschem.crossroad_schematization as cs
+from crschem.osm_extract import OSMExtract
+from crschem.instrumentation import ProcessInstrumentation, JSONLinesSink
 from crschem.model.turning_sidewalk import TurningSidewalk
 
 # a trick to avoid the creation of files given as parameters
@@ -42,6 +43,7 @@ input_params.add_argument('-c', '--by-coordinates', nargs=2, help='Load input fr
 
 group_input.add_argument('--overpass', help='Use Overpass to download data instead of the OSM api', action='store_true')
 group_input.add_argument('--ignore-cache', help='Ignore local cache', action='store_true')
+group_input.add_argument('--osm-extract', help='Load OSM data from a local extract (.osm or .osm.pbf file) rather than downloading it. The extract is indexed on first use.', type=str)
 
 group_preprocess = parser.add_argument_group('Preprocessing', "Parameters of the preprocesses (crseg, crdesc)")
 group_preprocess.add_argument('--c0', help='Initial intersection size (distance between boundaries and middle of the initial intersection). Default: 2.', type=float, default=2)
@@ -63,11 +65,12 @@ group_output = parser.add_argument_group("Output", "Display, log or save results
 group_output.add_argument('-l', '--log-files', help='keep intermediate files and give their name in output', action='store_true')
 group_output.add_argument('-d', '--display-all', help='display all steps', action='store_true')
 group_output.add_argument('--display-preview', help='display a preview of the crossroad schematization', action='store_true')
-group_output.add_argument('-o', '--output', help='output file (supported format: geojson, pdf, tif, shp)', type=FileOpener('w'))
+group_output.add_argument('-o', '--output', help='output file (supported format: geojson, pdf, tif, svg, shp). Can be given several times: the styled outputs are then rendered from a single workspace.', type=FileOpener('w'), action='append')
 group_output.add_argument('--scale', help='Scale of the map. Default: 400 (for 1:400)', type=int, default=400, choices=[400, 500])
 group_output.add_argument('--dpi', help='dpi for tif export', type=int, choices=[96, 300], default=300)
 group_output.add_argument('--layout', help='Map layout.', type=lambda s: cs.CrossroadSchematization.Layout[s], choices=list(cs.CrossroadSchematization.Layout), default = cs.CrossroadSchematization.Layout.A5_landscape)
 group_output.add_argument('--margin', help='Margin in cm. Default: 1.0cm', type=float, default=1)
+group_output.add_argument('--stage-report', help='measure time and memory of each processing stage, print them and append them to the given JSON lines file', type=str)
 
 group_preview = parser.add_argument_group("Preview options", "Parameters used by the preview display")
 group_preview.add_argument('--osm', help='display OpenStreetMap network', action='store_true')
@@ -101,11 +104,18 @@ try:
                                                    snap_aligned_streets = not args.no_snap_aligned_streets,
                                                    ignore_cache = args.ignore_cache,
                                                    overpass = args.overpass,
-                                                   log_files = args.log_files)
+                                                   log_files = args.log_files,
+                                                   osm_extract = OSMExtract(args.osm_extract) if args.osm_extract else None)
 
 
+    if args.stage_report:
+        crschem.instrumentation = ProcessInstrumentation(JSONLinesSink(args.stage_report))
+
     crschem.process()
 
+    if crschem.report is not None:
+        crschem.report.print()
+
     if args.display_preview or args.display_all:
         crschem.show(only_reachable_islands=not args.non_reachable_islands, osm_graph=args.osm,
                      branches=args.branches,
@@ -113,29 +123,8 @@ try:
                      exact_islands=args.exact_islands)
 
     if args.output:
-        if len(args.output.filename) < 4:
-            "Cannot deduce required format with small file names"
-            
-    if args.output:
-    
-        if args.output.filename.endswith(".pdf"):
-            print("Exporting as pdf:", args.output.filename)
-            crschem.toPdf(args.output.filename, args.log_files, resolution=args.dpi, layout=args.layout, margin=args.margin, scale=args.scale, only_reachable_islands=not args.non_reachable_islands)
-        elif args.output.filename.endswith(".tif"):
-            print("Exporting as tif:", args.output.filename)
-            crschem.toTif(args.output.filename, args.log_files, resolution=args.dpi, layout=args.layout, margin=args.margin, scale=args.scale, only_reachable_islands=not args.non_reachable_islands)
-        elif args.output.filename.endswith(".svg"):
-            print("Exporting as svg:", args.output.filename)
-            crschem.toSvg(args.output.filename, args.log_files, resolution=args.dpi, layout=args.layout, margin=args.margin, scale=args.scale, only_reachable_islands=not args.non_reachable_islands)
-        elif args.output.filename.endswith(".geojson"):
-            print("Exporting as geojson:", args.output.filename)
-            crschem.toGeojson(args.output.filename, not args.non_reachable_islands)
-        elif args.output.filename.endswith(".shp"):
-            print("Exporting as shapefile:", args.output.filename)
-            crschem.toShapefiles(args.output.filename, not args.non_reachable_islands)
-        else:
-            print("Unknown output format")
-            
+        crschem.export_all([o.filename for o in args.output], args.log_files, resolution=args.dpi, layout=args.layout, margin=args.margin, scale=args.scale, only_reachable_islands=not args.non_reachable_islands)
+
 
 except ValueError as e:
     print("Error:", e)
@@ -32,6 +32,9 @@ setup(
     entry_points={
         'console_scripts': [
             'get_crossroad_schematization = crschem.cmd:get_crossroad_schematization_command',
+            'get_crossroad_schematization_batch = crschem.batch:get_crossroad_schematization_batch_command',
+            'get_crossroad_schematization_benchmark = crschem.benchmark:get_crossroad_schematization_benchmark_command',
+            'get_crossroad_schematization_server = crschem.server:get_crossroad_schematization_server_command',
         ],
     },
 )